@@ -0,0 +1,37 @@
+# Per-account locking for balance and holdings changes.
+# Every read-check-write of an account happens inside `async with account_locks.transaction(*user_ids)`.
+# Operations on the same account run one at a time; unrelated accounts never wait on each other.
+# Multi-account transactions take their locks in ascending user ID order, so two transfers between
+# the same pair of users in opposite directions cannot deadlock.
+#
+# Stress check against the real command handlers: python -m benchmarks.stress
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+
+
+class AccountLocks:
+    def __init__(self):
+        # Locks only live while someone holds or waits on them.
+        self._locks = weakref.WeakValueDictionary()
+
+    def _lock(self, user_id):
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[user_id] = lock
+        return lock
+
+    @asynccontextmanager
+    async def transaction(self, *user_ids):
+        locks = [self._lock(user_id) for user_id in sorted({int(user_id) for user_id in user_ids})]
+        acquired = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
@@ -0,0 +1,156 @@
+# Raid detection: join-rate tracking and raid-signature scoring for new members.
+# Joins are counted in a ring of one-second buckets, so recording a join and reading the
+# rate are constant-time and the memory used does not depend on how many people join.
+from collections import Counter, deque
+
+
+class SlidingWindowCounter:
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self._counts = [0] * window_seconds
+        self._seconds = [None] * window_seconds
+
+    def add(self, now):
+        second = int(now)
+        index = second % self.window_seconds
+        if self._seconds[index] != second:
+            self._seconds[index] = second
+            self._counts[index] = 0
+        self._counts[index] += 1
+        return self.count(now)
+
+    def count(self, now):
+        oldest = int(now) - self.window_seconds
+        return sum(c for c, s in zip(self._counts, self._seconds) if s is not None and s > oldest)
+
+
+class JoinRateMonitor:
+    # Trips into raid mode once `threshold` joins land within `window_seconds`, and stays there
+    # until the rate has been below the threshold for `quiet_seconds`.
+    def __init__(self, threshold, window_seconds, quiet_seconds):
+        self.threshold = threshold
+        self.quiet_seconds = quiet_seconds
+        self.counter = SlidingWindowCounter(window_seconds)
+        self.raid_mode = False
+        self.raid_started_at = None
+        self.last_tripped_at = None
+        self.raid_join_count = 0
+
+    def record_join(self, now):
+        # Returns True only for the join that switches raid mode on.
+        rate = self.counter.add(now)
+        if self.raid_mode:
+            self.raid_join_count += 1
+        if rate < self.threshold:
+            return False
+        self.last_tripped_at = now
+        if self.raid_mode:
+            return False
+        self.raid_mode = True
+        self.raid_started_at = now
+        self.raid_join_count = rate
+        return True
+
+    def should_end(self, now):
+        return self.raid_mode and now - self.last_tripped_at >= self.quiet_seconds
+
+    def end(self):
+        self.raid_mode = False
+        self.raid_started_at = None
+
+
+# --- Raid signatures ---
+# Raid waves are batches of fresh accounts with near-identical names and the same (or no) avatar.
+# Every recent joiner is reduced to a few small features: an account-age bucket, a MinHash sketch of
+# the normalized name split into LSH bands, and an avatar key. Counters over the rolling window are
+# updated as joiners enter and leave it, so scoring a member costs the same no matter how busy the raid.
+
+MINHASH_PERMUTATIONS = 16
+MINHASH_BAND_SIZE = 2
+_MERSENNE_PRIME = (1 << 61) - 1
+_MINHASH_PARAMS = [(2 * i + 3, 7919 * i + 17) for i in range(MINHASH_PERMUTATIONS)]
+
+
+def normalize_name(name):
+    # "Raider_0042" and "raider.1337" should look the same; digits and separators are noise.
+    return ''.join(ch for ch in name.lower() if ch.isalpha())
+
+
+def name_bands(name):
+    normalized = normalize_name(name)
+    if len(normalized) < 3:
+        shingles = {normalized}
+    else:
+        shingles = {normalized[i:i + 3] for i in range(len(normalized) - 2)}
+    hashes = [hash(shingle) & _MERSENNE_PRIME for shingle in shingles]
+    signature = [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _MINHASH_PARAMS]
+    return [
+        (i, tuple(signature[i:i + MINHASH_BAND_SIZE]))
+        for i in range(0, MINHASH_PERMUTATIONS, MINHASH_BAND_SIZE)
+    ]
+
+
+def account_age_bucket(age_seconds):
+    # Buckets double in width: <1h, <2h, <4h, ... so accounts created in the same batch land together.
+    hours = max(int(age_seconds // 3600), 0)
+    return hours.bit_length()
+
+
+class RaidSignatureEngine:
+    def __init__(self, window_seconds, max_tracked, young_account_seconds, cluster_threshold, flag_score):
+        self.window_seconds = window_seconds
+        self.max_tracked = max_tracked
+        self.young_account_seconds = young_account_seconds
+        self.cluster_threshold = cluster_threshold
+        self.flag_score = flag_score
+        self._recent = deque()
+        self._age_counts = Counter()
+        self._band_counts = Counter()
+        self._avatar_counts = Counter()
+
+    @staticmethod
+    def _decrement(counts, key):
+        # Zero entries are dropped so the counters never outgrow the window.
+        if counts[key] <= 1:
+            del counts[key]
+        else:
+            counts[key] -= 1
+
+    def _forget(self, features):
+        age_bucket, bands, avatar_key = features
+        self._decrement(self._age_counts, age_bucket)
+        for band in bands:
+            self._decrement(self._band_counts, band)
+        self._decrement(self._avatar_counts, avatar_key)
+
+    def _expire(self, now):
+        while self._recent and (len(self._recent) >= self.max_tracked or now - self._recent[0][0] > self.window_seconds):
+            self._forget(self._recent.popleft()[1])
+
+    def score(self, now, account_age_seconds, name, avatar_key):
+        # Scores the joiner against the current window, then adds them to it. avatar_key is None
+        # for a default avatar. Returns (score, flagged).
+        self._expire(now)
+        age_bucket = account_age_bucket(account_age_seconds)
+        bands = name_bands(name)
+        young = account_age_seconds < self.young_account_seconds
+
+        score = 0
+        if young:
+            score += 1
+            if self._age_counts[age_bucket] >= self.cluster_threshold:
+                score += 1
+        if avatar_key is None:
+            score += 1
+        elif self._avatar_counts[avatar_key] >= self.cluster_threshold:
+            score += 2
+        if max(self._band_counts[band] for band in bands) >= self.cluster_threshold:
+            score += 2
+
+        features = (age_bucket, bands, avatar_key)
+        self._recent.append((now, features))
+        self._age_counts[age_bucket] += 1
+        for band in bands:
+            self._band_counts[band] += 1
+        self._avatar_counts[avatar_key] += 1
+        return score, score >= self.flag_score
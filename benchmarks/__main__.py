@@ -0,0 +1,67 @@
+# Offline benchmarks for the slash-command handlers, driven through fake Discord objects.
+#   python -m benchmarks                                  # 1k, 10k and 100k users
+#   python -m benchmarks --users 1000000 --iterations 500 --json before.json
+# Every dataset size runs in its own process in a scratch directory, so the real data files are never
+# touched. Each scenario also reports how much resident memory it added and how far it raised the peak.
+# The bot's own output goes to bench.log there (see --keep).
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_size(users, args, workdir):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, STORAGE_BACKEND=args.backend)
+    env.pop('DISCORD_BOT_TOKEN', None)
+    command = [sys.executable, '-m', 'benchmarks.scenarios', '--users', str(users), '--iterations', str(args.iterations), '--seed', str(args.seed)]
+    with open(os.path.join(workdir, 'bench.log'), 'w') as log:
+        result = subprocess.run(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        print(f"ERROR: the {users}-user run failed; see {os.path.join(workdir, 'bench.log')}.")
+        return None
+    with open(os.path.join(workdir, 'results.json')) as f:
+        return json.load(f)
+
+
+def report(result):
+    print(f"\n{result['users']:,} users ({result['storage_backend']}): {result['data_file_mb']:.1f} MB data file, "
+          f"startup {result['startup_s']:.2f} s, peak RSS {result['startup_peak_rss_mb']:.0f} MB after startup / {result['peak_rss_mb']:.0f} MB overall")
+    print(f"  {'scenario':<30} {'runs':>6} {'p50 ms':>10} {'p99 ms':>10} {'RSS +MB':>8} {'peak +MB':>9}")
+    for name, stats in result["scenarios"].items():
+        print(f"  {name:<30} {stats['runs']:>6} {stats['p50_ms']:>10.3f} {stats['p99_ms']:>10.3f} {stats['rss_growth_mb']:>8.1f} {stats['peak_rss_growth_mb']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--users', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--json', dest='json_path', help='Also write every result to this file.')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directories and print their paths.')
+    args = parser.parse_args()
+
+    results = []
+    for users in args.users:
+        workdir = tempfile.mkdtemp(prefix=f'bench-{users}-')
+        result = run_size(users, args, workdir)
+        if result is not None:
+            report(result)
+            results.append(result)
+        if args.keep or result is None:
+            print(f"  files kept in {workdir}")
+        else:
+            shutil.rmtree(workdir)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0 if len(results) == len(args.users) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+# Synthetic stock_market_data.json files in the current integer-money layout.
+import json
+import random
+
+FIRST_USER_ID = 100_000_000_000_000_000
+# Same as CRYPTO_NAMES in bot.py; the dataset has to exist before bot.py is imported.
+COIN_NAMES = ["Campton Coin"]
+
+
+def user_ids(count):
+    return range(FIRST_USER_ID, FIRST_USER_ID + count)
+
+
+def generate(path, users, coin_names=COIN_NAMES, seed=1, max_balance_cents=1_000_000):
+    # Roughly half the accounts hold coins and about one in twenty clears the Market Investor thresholds,
+    # so the role check and the conversion have real work to do.
+    rng = random.Random(seed)
+    records = {}
+    for user_id in user_ids(users):
+        record = {"balance_cents": rng.randrange(0, max_balance_cents), "holdings_milli": {}, "verification": None, "buy_cooldown_epoch": None}
+        if rng.random() < 0.5:
+            record["holdings_milli"] = {coin: rng.randrange(1_000, 50_000) for coin in coin_names}
+        if rng.random() < 0.05:
+            record["balance_cents"] += 2_000_000
+        records[str(user_id)] = record
+    data = {
+        "coins": {coin: {"price": 120.0} for coin in coin_names},
+        "users": records,
+        "tickets": {},
+        "open_tickets": {},
+        "migrations": {"prune_empty_users": "benchmark", "integer_money": "benchmark"},
+        "market_epoch": 1,
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f)
@@ -0,0 +1,161 @@
+# Stand-ins for the Discord objects the handlers touch. Each one implements just the attributes and
+# coroutines bot.py uses, records what would have been sent, and never opens a connection.
+import itertools
+
+import discord
+
+_ids = itertools.count(900_000_000_000_000_000)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, ephemeral=False, thinking=False):
+        self._done = True
+
+    async def send_message(self, content=None, **kwargs):
+        self._done = True
+        self._interaction.sent.append((content, kwargs))
+
+    async def send_modal(self, modal):
+        self._done = True
+        self._interaction.modal = modal
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self._interaction.sent.append((content, kwargs))
+
+
+class FakeInteraction:
+    def __init__(self, user, guild):
+        self.user = user
+        self.guild = guild
+        self.channel = None
+        self.sent = []  # (content, kwargs) for every response and followup
+        self.modal = None  # set by response.send_modal
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+
+class FakeRole:
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+        self.mention = f"<@&{role_id}>"
+
+
+class FakeMember:
+    def __init__(self, user_id, guild=None, bot=False):
+        self.id = user_id
+        self.guild = guild
+        self.bot = bot
+        self.name = f"user{user_id}"
+        self.display_name = self.name
+        self.discriminator = "0"
+        self.mention = f"<@{user_id}>"
+        self.roles = []
+        self.dms = []
+
+    async def send(self, content=None, **kwargs):
+        self.dms.append((content, kwargs))
+
+    async def add_roles(self, *roles, reason=None):
+        self.roles.extend(role for role in roles if role not in self.roles)
+
+    async def remove_roles(self, *roles, reason=None):
+        self.roles = [role for role in self.roles if role not in roles]
+
+    async def edit(self, nick=None, **kwargs):
+        if nick is not None:
+            self.display_name = nick
+
+
+class FakeTextChannel:
+    def __init__(self, channel_id, name, guild):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.mention = f"<#{channel_id}>"
+        self.messages = []
+        self.overwrites = {}
+
+    async def send(self, content=None, **kwargs):
+        self.messages.append((content, kwargs))
+
+    def overwrites_for(self, target):
+        return self.overwrites.get(target, discord.PermissionOverwrite())
+
+    async def set_permissions(self, target, overwrite=None, **permissions):
+        self.overwrites[target] = overwrite or discord.PermissionOverwrite(**permissions)
+
+    async def purge(self, limit=100, **kwargs):
+        deleted, self.messages = self.messages[-limit:], self.messages[:-limit]
+        return deleted
+
+    async def delete(self, reason=None):
+        self.guild.channels.pop(self.id, None)
+
+
+class FakeCategory(discord.CategoryChannel):
+    # Subclassed so the isinstance(category, discord.CategoryChannel) check in OpenTicketButton passes.
+    def __init__(self, channel_id, guild):
+        self.id = channel_id
+        self.name = "tickets"
+        self.guild = guild
+
+    async def create_text_channel(self, name, overwrites=None, **kwargs):
+        channel = FakeTextChannel(next(_ids), name, self.guild)
+        self.guild.channels[channel.id] = channel
+        return channel
+
+
+class FakeGuild:
+    # Members are created on first lookup, so a guild can "contain" every user in a 1M-user dataset
+    # without building a million objects up front.
+    def __init__(self, guild_id=1, name="Benchmark Guild", roles=(), categories=()):
+        self.id = guild_id
+        self.name = name
+        self.default_role = FakeRole(guild_id, "@everyone")
+        self.me = FakeMember(next(_ids), self, bot=True)
+        self.roles = {role_id: FakeRole(role_id, f"role{role_id}") for role_id in roles}
+        self.channels = {category_id: FakeCategory(category_id, self) for category_id in categories}
+        self.members = {}
+
+    def get_member(self, user_id):
+        member = self.members.get(user_id)
+        if member is None:
+            member = self.members[user_id] = FakeMember(user_id, self)
+        return member
+
+    def get_role(self, role_id):
+        return self.roles.get(role_id)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def text_channel(self, channel_id):
+        # The channel with this ID, created as a plain text channel on first use.
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = FakeTextChannel(channel_id, f"channel{channel_id}", self)
+        return channel
+
+
+def attach(bot, guild):
+    # Points the bot's guild and channel/user lookups at the fake guild instead of the gateway cache.
+    bot._connection._guilds[guild.id] = guild
+    bot.get_channel = guild.get_channel
+    bot.get_user = guild.get_member
+
+    async def fetch_user(user_id):
+        return guild.get_member(user_id)
+    bot.fetch_user = fetch_user
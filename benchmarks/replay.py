@@ -0,0 +1,182 @@
+# Replays a recorded interaction trace (see INTERACTION_TRACE_FILE in bot.py) against a copy of a data file.
+#   python -m benchmarks.replay interaction_trace.jsonl --data stock_market_data.json --speed 60
+#   python -m cProfile -o replay.prof -m benchmarks.replay interaction_trace.jsonl --data stock_market_data.json --speed 0
+# Interactions start at their recorded spacing divided by --speed (0 = back to back) and run concurrently,
+# as they would on the gateway, so bursts like a raid-day verify rush overlap the way they did live.
+# Only interactions are replayed; the scheduled loops (price ticks, role checks, conversion) do not run.
+# The data file (and its .journal, if present) is copied into a scratch directory; the bot's own output
+# goes to replay.log there.
+import argparse
+import asyncio
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import discord
+from discord import app_commands
+
+from benchmarks.fakes import FakeGuild, FakeInteraction, attach
+from benchmarks.scenarios import summarize
+from interaction_trace import load
+
+
+class Replayer:
+    def __init__(self, bot_module, guild):
+        self.bot_module = bot_module
+        self.guild = guild
+        # Persistent components can be rebuilt from their custom_id; anything else (e.g. a /close confirm
+        # button) only existed on one message and is skipped.
+        self.components = {
+            item.custom_id: type(item)
+            for view in (bot_module.TicketView(), bot_module.VerifyView())
+            for item in view.children
+        }
+        self.open_modals = {}  # user ID -> the modal their last button press opened
+        self.samples = defaultdict(list)
+        self.outcomes = defaultdict(Counter)
+
+    def convert_option(self, parameter, value):
+        if parameter.choices:
+            return next(choice for choice in parameter.choices if choice.value == value)
+        if parameter.type is discord.AppCommandOptionType.user:
+            return self.guild.get_member(int(value))
+        if parameter.type is discord.AppCommandOptionType.channel:
+            return self.guild.text_channel(int(value))
+        if parameter.type is discord.AppCommandOptionType.role:
+            return self.guild.get_role(int(value))
+        return value
+
+    async def run_command(self, interaction, data):
+        command = self.bot_module.bot.tree.get_command(data["name"])
+        if command is None:
+            return "unknown"
+        parameters = {parameter.display_name: parameter for parameter in command.parameters}
+        kwargs = {
+            parameters[option["name"]].name: self.convert_option(parameters[option["name"]], option["value"])
+            for option in data.get("options", [])
+        }
+        for check in command.checks:
+            if not await discord.utils.maybe_coroutine(check, interaction):
+                if command.on_error is not None:
+                    await command.on_error(interaction, app_commands.CheckFailure())
+                return "check failed"
+        await command.callback(interaction, **kwargs)
+        return "ok"
+
+    async def run_component(self, interaction, data):
+        item_class = self.components.get(data.get("custom_id"))
+        if item_class is None:
+            return "skipped"
+        await item_class().callback(interaction)
+        if interaction.modal is not None:
+            self.open_modals[interaction.user.id] = interaction.modal
+        return "ok"
+
+    async def run_modal(self, interaction, data):
+        modal = self.open_modals.pop(interaction.user.id, None)
+        if modal is None:
+            return "skipped"
+        # Modal and field custom_ids are random per instance, so fields are matched by position.
+        values = [field.get("value") for row in data.get("components", []) for field in row.get("components", [row.get("component") or {}])]
+        for item, value in zip(modal.children, values):
+            item._value = value  # what discord.py's Modal._refresh does on a real submit
+        await modal.on_submit(interaction)
+        return "ok"
+
+    async def dispatch(self, record):
+        member = self.guild.get_member(record["user"])
+        member.roles = [self.guild.get_role(role_id) for role_id in record.get("roles", [])]
+        interaction = FakeInteraction(member, self.guild)
+        if record.get("channel"):
+            interaction.channel = self.guild.text_channel(record["channel"])
+        data = record["data"]
+        if record["type"] == "application_command":
+            name, handler = f"/{data['name']}", self.run_command(interaction, data)
+        elif record["type"] == "component":
+            name, handler = data.get("custom_id", "component"), self.run_component(interaction, data)
+        else:
+            name, handler = "modal_submit", self.run_modal(interaction, data)
+        start = time.perf_counter()
+        try:
+            outcome = await handler
+        except Exception as e:
+            print(f"ERROR replaying {name} for {record['user']}: {e!r}")
+            outcome = "error"
+        self.samples[name].append(time.perf_counter() - start)
+        self.outcomes[name][outcome] += 1
+
+    async def replay(self, trace, speed):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        first_ts = trace[0]["ts"]
+        lateness = []
+        tasks = []
+        for record in trace:
+            if speed:
+                due = started + (record["ts"] - first_ts) / speed
+                if due > loop.time():
+                    await asyncio.sleep(due - loop.time())
+                lateness.append(max(0.0, loop.time() - due))
+            tasks.append(asyncio.create_task(self.dispatch(record)))
+        await asyncio.gather(*tasks)
+        return loop.time() - started, lateness
+
+
+async def run(bot_module, trace, speed):
+    role_ids = {role_id for record in trace for role_id in record.get("roles", [])}
+    role_ids.update(role_id for role_id in (bot_module.NEW_ARRIVAL_ROLE_ID, bot_module.CAMPTON_CITIZEN_ROLE_ID, bot_module.MARKET_INVESTOR_ROLE_ID, bot_module.QUARANTINE_ROLE_ID) if role_id)
+    guild = FakeGuild(guild_id=trace[0].get("guild") or 1, roles=role_ids, categories=[bot_module.TICKET_CATEGORY_ID])
+    attach(bot_module.bot, guild)
+    bot_module.data_writer.start()
+    replayer = Replayer(bot_module, guild)
+    elapsed, lateness = await replayer.replay(trace, speed)
+    await bot_module.data_writer.stop()
+    bot_module.ledger.close()
+    return replayer, elapsed, lateness
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.replay')
+    parser.add_argument('trace')
+    parser.add_argument('--data', default='stock_market_data.json', help='Data file to replay against (copied, never modified).')
+    parser.add_argument('--speed', type=float, default=10, help='Time compression factor; 0 replays back to back.')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directory and print its path.')
+    args = parser.parse_args()
+
+    trace = sorted(load(args.trace), key=lambda record: record["ts"])
+    if not trace:
+        print(f"{args.trace} has no interactions.")
+        sys.exit(1)
+    span = trace[-1]["ts"] - trace[0]["ts"]
+
+    workdir = tempfile.mkdtemp(prefix='replay-')
+    shutil.copy(args.data, os.path.join(workdir, 'stock_market_data.json'))
+    journal = os.path.splitext(args.data)[0] + '.journal'
+    if os.path.exists(journal):
+        shutil.copy(journal, os.path.join(workdir, 'stock_market_data.journal'))
+    os.chdir(workdir)
+    with open('replay.log', 'w') as log, contextlib.redirect_stdout(log):
+        import bot as bot_module
+        replayer, elapsed, lateness = asyncio.run(run(bot_module, trace, args.speed))
+
+    print(f"Replayed {len(trace)} interactions spanning {span:.0f} s in {elapsed:.2f} s (speed {args.speed:g}x).")
+    if lateness:
+        late = summarize(lateness)
+        print(f"Dispatch lateness: p50 {late['p50_ms']:.3f} ms, p99 {late['p99_ms']:.3f} ms")
+    print(f"  {'handler':<30} {'runs':>6} {'p50 ms':>10} {'p99 ms':>10}  outcomes")
+    for name, samples in sorted(replayer.samples.items(), key=lambda item: -len(item[1])):
+        stats = summarize(samples)
+        outcomes = ", ".join(f"{outcome} {count}" for outcome, count in replayer.outcomes[name].most_common())
+        print(f"  {name:<30} {stats['runs']:>6} {stats['p50_ms']:>10.3f} {stats['p99_ms']:>10.3f}  {outcomes}")
+    if args.keep:
+        print(f"Files kept in {workdir}")
+    else:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# One benchmark run against one dataset size. `python -m benchmarks` starts this in a scratch directory;
+# it generates the dataset, imports bot.py there and writes its measurements as JSON to --out.
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import time
+
+from discord import app_commands
+
+from benchmarks import datasets
+from benchmarks.fakes import FakeGuild, FakeInteraction, attach
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def memory_snapshot():
+    return rss_mb(), peak_rss_mb()
+
+
+def summarize(samples, memory_before=None):
+    # memory_before: memory_snapshot() from just before the scenario ran. Adds how much resident memory
+    # the scenario left behind and how far it raised the process's peak.
+    ordered = sorted(samples)
+    summary = {
+        "runs": len(ordered),
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+    }
+    if memory_before is not None:
+        rss_before, peak_before = memory_before
+        summary["rss_growth_mb"] = rss_mb() - rss_before
+        summary["peak_rss_growth_mb"] = peak_rss_mb() - peak_before
+    return summary
+
+
+async def measure(samples, coro):
+    start = time.perf_counter()
+    await coro
+    samples.append(time.perf_counter() - start)
+
+
+async def run(bot_module, users, iterations, seed):
+    rng = random.Random(seed)
+    ids = datasets.user_ids(users)
+    guild = FakeGuild(roles=[bot_module.MARKET_INVESTOR_ROLE_ID], categories=[bot_module.TICKET_CATEGORY_ID])
+    attach(bot_module.bot, guild)
+    bot_module.data_writer.start()
+
+    def interaction():
+        return FakeInteraction(guild.get_member(rng.choice(ids)), guild)
+
+    cash = app_commands.Choice(name='Cash', value='cash')
+    handlers = {
+        "balance": lambda: bot_module.balance.callback(interaction()),
+        "buy": lambda: bot_module.buy.callback(interaction(), 10.0),
+        "sell": lambda: bot_module.sell.callback(interaction(), 0.001),
+        "transfer": lambda: bot_module.transfer.callback(interaction(), guild.get_member(rng.choice(ids)), 1.0, cash),
+        "OpenTicketButton.callback": lambda: bot_module.OpenTicketButton().callback(interaction()),
+    }
+    results = {}
+    for name, handler in handlers.items():
+        samples = []
+        memory = memory_snapshot()
+        for _ in range(iterations):
+            await measure(samples, handler())
+        results[name] = summarize(samples, memory)
+
+    # The first pass walks every eligible account; later passes only the accounts changed since the last one.
+    samples = []
+    memory = memory_snapshot()
+    for _ in range(3):
+        bot_module.last_investor_full_reconcile = None
+        await measure(samples, bot_module.check_investor_roles())
+    results["check_investor_roles (full)"] = summarize(samples, memory)
+    samples = []
+    memory = memory_snapshot()
+    for _ in range(iterations):
+        await handlers["transfer"]()
+        await measure(samples, bot_module.check_investor_roles())
+    results["check_investor_roles"] = summarize(samples, memory)
+
+    samples = []
+    memory = memory_snapshot()
+    for _ in range(3):
+        bot_module.save_data(bot_module.market_data)
+        await measure(samples, bot_module.data_writer.flush())
+    results["save_data"] = summarize(samples, memory)
+
+    await bot_module.data_writer.stop()
+    bot_module.ledger.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, required=True)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default='results.json')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    datasets.generate('stock_market_data.json', args.users, seed=args.seed)
+    generate_seconds = time.perf_counter() - start
+    data_file_mb = os.path.getsize('stock_market_data.json') / 2**20
+
+    start = time.perf_counter()
+    import bot as bot_module
+    startup_seconds = time.perf_counter() - start
+    startup_rss_mb = peak_rss_mb()
+
+    results = asyncio.run(run(bot_module, args.users, args.iterations, args.seed))
+    with open(args.out, 'w') as f:
+        json.dump({
+            "users": args.users,
+            "storage_backend": bot_module.STORAGE_BACKEND,
+            "generate_s": generate_seconds,
+            "data_file_mb": data_file_mb,
+            "startup_s": startup_seconds,
+            "startup_peak_rss_mb": startup_rss_mb,
+            "peak_rss_mb": peak_rss_mb(),
+            "scenarios": results,
+        }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+# Concurrency check for the money handlers: python -m benchmarks.stress [--accounts 30 --interactions 5000]
+# Fires /buy, /sell, /transfer (cash and coin), /addfunds, /approvewithdrawal and the occasional
+# /manualconvert and price update at a few accounts all at once through the real command callbacks. Every
+# Discord call and every account transaction yields to the event loop, so the handlers interleave and wait on
+# each other's locks. Accounts start small, so many transfers, sells and withdrawals are rejected.
+# Afterwards:
+#   - transfers net to zero, and the cash and coin totals moved only by the buys, sells, deposits,
+#     withdrawals and conversions the ledger recorded;
+#   - every conversion took coins from an account that actually held some, and left nobody holding any
+#     (every account here is a guild member, and a conversion's ledger entries are written back to back);
+#   - no account is negative;
+#   - replaying ledger.jsonl gives exactly the stored accounts.
+# Runs in a scratch directory, so the real data files are never touched.
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+
+from discord import app_commands
+
+from account_locks import AccountLocks
+from benchmarks import datasets
+from benchmarks.fakes import FakeFollowup, FakeGuild, FakeInteraction, FakeMember, FakeResponse, attach
+
+CASH = app_commands.Choice(name='Cash', value='cash')
+COIN = app_commands.Choice(name='Campton Coin', value='campton_coin')
+# Ledger entry kinds that may change the total cash or coins in the market.
+EXTERNAL_KINDS = ("opening", "buy", "sell", "deposit", "withdrawal", "conversion")
+# Share of interactions that are a /manualconvert; each one converts every holder and puts them on a buy
+# cooldown, so price updates (which clear it) run as often to keep coins in play.
+CONVERSION_SHARE = 0.004
+PRICE_UPDATE_SHARE = 0.004
+# Replies that mean the handler applied its change.
+APPLIED_REPLIES = ("Successfully", "Manual crypto to cash conversion initiated")
+
+
+class YieldingAccountLocks(AccountLocks):
+    # The handlers never await while holding a lock, so without this no transaction would ever wait on another.
+    @asynccontextmanager
+    async def transaction(self, *user_ids):
+        async with super().transaction(*user_ids):
+            await asyncio.sleep(0)
+            yield
+
+
+class YieldingResponse(FakeResponse):
+    async def defer(self, ephemeral=False, thinking=False):
+        await asyncio.sleep(0)
+        await super().defer(ephemeral, thinking)
+
+
+class YieldingFollowup(FakeFollowup):
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(0)
+        await super().send(content, **kwargs)
+
+
+class YieldingInteraction(FakeInteraction):
+    def __init__(self, user, guild):
+        super().__init__(user, guild)
+        self.response = YieldingResponse(self)
+        self.followup = YieldingFollowup(self)
+
+
+async def price_update(bot_module):
+    await asyncio.sleep(0)
+    bot_module.update_prices()
+
+
+def plan(bot_module, guild, owner, ids, interactions, rng):
+    # (name, interaction, coroutine) for every call, in a random mix.
+    def member():
+        return guild.get_member(rng.choice(ids))
+
+    calls = []
+    for _ in range(interactions):
+        roll = rng.random()
+        user = member()
+        interaction = YieldingInteraction(user, guild)
+        if roll < 0.15:
+            calls.append(("buy", interaction, bot_module.buy.callback(interaction, rng.randrange(1, 5_000) / 100)))
+        elif roll < 0.3:
+            calls.append(("sell", interaction, bot_module.sell.callback(interaction, rng.randrange(1, 500) / 1000)))
+        elif roll < 0.6:
+            calls.append(("transfer cash", interaction, bot_module.transfer.callback(interaction, member(), rng.randrange(1, 5_000) / 100, CASH)))
+        elif roll < 0.8:
+            calls.append(("transfer coin", interaction, bot_module.transfer.callback(interaction, member(), rng.randrange(1, 500) / 1000, COIN)))
+        elif roll < 0.9 - CONVERSION_SHARE - PRICE_UPDATE_SHARE:
+            interaction = YieldingInteraction(owner, guild)
+            calls.append(("addfunds", interaction, bot_module.add_funds.callback(interaction, user, rng.randrange(1, 2_000) / 100)))
+        elif roll < 0.9 - CONVERSION_SHARE:
+            calls.append(("price update", None, price_update(bot_module)))
+        elif roll < 0.9:
+            interaction = YieldingInteraction(owner, guild)
+            calls.append(("manualconvert", interaction, bot_module.manual_convert.callback(interaction)))
+        else:
+            interaction = YieldingInteraction(owner, guild)
+            calls.append(("approvewithdrawal", interaction, bot_module.approve_withdrawal.callback(interaction, str(user.id), rng.randrange(1, 5_000) / 100)))
+    return calls
+
+
+def check(bot_module, ledger_module):
+    coin = bot_module.CAMPTOM_COIN_NAME
+    users = bot_module.market_data["users"]
+    errors, balances = ledger_module.verify(bot_module.LEDGER_FILE)
+    assert not errors, f"ledger does not verify: {errors[:3]}"
+
+    external = {"cash": 0, "coins": 0}
+    transferred = {"cash": 0, "coins": 0}
+    held = {}
+    converting = False
+    with open(bot_module.LEDGER_FILE, encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if converting and entry["kind"] != "conversion":
+                assert not any(held.values()), f"a conversion left {coin} with users {[user for user, milli in held.items() if milli]}"
+            converting = entry["kind"] == "conversion"
+            if converting:
+                assert entry["coins"].get(coin, 0) < 0, f"user {entry['user']} was converted without holding any {coin}"
+            held[entry["user"]] = held.get(entry["user"], 0) + entry["coins"].get(coin, 0)
+            totals = external if entry["kind"] in EXTERNAL_KINDS else transferred
+            totals["cash"] += entry["cash"]
+            totals["coins"] += entry["coins"].get(coin, 0)
+    assert transferred == {"cash": 0, "coins": 0}, f"transfers created or destroyed money: {transferred}"
+    final = {
+        "cash": sum(account.balance_cents for account in users.values()),
+        "coins": sum(account.quantity(coin) for account in users.values()),
+    }
+    assert final == external, f"market holds {final}, but buys, sells, deposits, withdrawals and conversions add up to {external}"
+
+    for user_id, account in users.items():
+        assert account.balance_cents >= 0 and account.quantity(coin) >= 0, f"user {user_id} went negative"
+        replayed = balances.pop(user_id, {"cash": 0, "coins": {}})
+        assert (account.balance_cents, account.quantity(coin)) == (replayed["cash"], replayed["coins"].get(coin, 0)), \
+            f"user {user_id}: stored {account.balance_cents} cents {account.quantity(coin)} milli, ledger {replayed}"
+    assert not any(account["cash"] or any(account["coins"].values()) for account in balances.values()), "ledger has accounts the store lost"
+    assert not bot_module.account_locks._locks, "locks leaked after every interaction finished"
+    return final
+
+
+async def run(bot_module, accounts, interactions, seed):
+    import ledger as ledger_module
+
+    rng = random.Random(seed)
+    guild = FakeGuild()
+    attach(bot_module.bot, guild)
+    owner = FakeMember(bot_module.bot.owner_id, guild)
+    bot_module.account_locks = YieldingAccountLocks()
+    bot_module.data_writer.start()
+
+    calls = plan(bot_module, guild, owner, list(datasets.user_ids(accounts)), interactions, rng)
+    await asyncio.gather(*(call for _, _, call in calls))
+    await bot_module.data_writer.stop()
+    bot_module.ledger.close()
+
+    outcomes = {}
+    for name, interaction, _ in calls:
+        if interaction is None:
+            outcomes.setdefault(name, [0, 0])[0] += 1
+            continue
+        reply = interaction.sent[-1][0] if interaction.sent else ""
+        outcomes.setdefault(name, [0, 0])[0 if (reply or "").startswith(APPLIED_REPLIES) else 1] += 1
+    return outcomes, check(bot_module, ledger_module)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.stress')
+    parser.add_argument('--accounts', type=int, default=30)
+    parser.add_argument('--interactions', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directory and print its path.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='stress-')
+    os.chdir(workdir)
+    os.environ.pop('DISCORD_BOT_TOKEN', None)
+    datasets.generate('stock_market_data.json', args.accounts, seed=args.seed, max_balance_cents=5_000)
+    import bot as bot_module
+
+    outcomes, final = asyncio.run(run(bot_module, args.accounts, args.interactions, args.seed))
+    print()
+    for name, (applied, rejected) in outcomes.items():
+        print(f"  {name:<18} {applied:>6} applied {rejected:>6} rejected")
+    print(f"OK: {args.interactions} interactions; market holds {final['cash']} cents and {final['coins']} milli-coins, "
+          f"matching the ledger account for account.")
+    if args.keep:
+        print(f"  files kept in {workdir}")
+    else:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,17 +3,39 @@
 import discord
 from discord.ext import commands, tasks
 from discord import app_commands, ui
-import random
 import json
+import hashlib
+import gc
 import os # Keep this import for os.environ.get
 import math
 import asyncio
 import datetime
+import time
+from collections import deque
 from datetime import timedelta
+from storage import JournalStore, AsyncWriter, JOURNAL_DELETE, append_jsonl
+from sqlite_store import SqliteStore
+from antiraid import JoinRateMonitor, RaidSignatureEngine
+from dm_dispatcher import DMDispatcher
+from models import UserAccount, read_only_default_account
+from market_engine import MarketEngine
+from holdings_table import HoldingsTable
+from price_history import PriceHistory
+from ledger import Ledger, tail_states
+from leaderboard import Leaderboard
+from account_locks import AccountLocks
+from order_book import OrderBook
+from interaction_trace import InteractionTrace
+from metrics import MetricsRegistry, timed, activity_labels
+from loop_watchdog import LoopWatchdog
+from scheduler import Scheduler
+from money import parse_cash, parse_coins, price_to_cents, coin_value_cents, coin_cost_cents, coins_for_cash, format_cash, format_coins
 
 # --- Configuration ---
 TOKEN = os.environ.get('DISCORD_BOT_TOKEN') 
-if TOKEN is None:
+# Importing this module (see benchmarks/) loads the data and registers every command without connecting,
+# so the token is only required when it is run as a script.
+if TOKEN is None and __name__ == '__main__':
     print("ERROR: DISCORD_BOT_TOKEN environment variable not found. Bot cannot start.")
     exit()
 
@@ -23,12 +45,51 @@ CRYPTO_NAMES = ["Campton Coin"]
 CAMPTOM_COIN_NAME = "Campton Coin" 
 
 DATA_FILE = 'stock_market_data.json'
+JOURNAL_FILE = 'stock_market_data.journal'
+JOURNAL_COMPACT_THRESHOLD = 1000
+SAVE_COALESCE_SECONDS = 0.5
+# 'json' (snapshot + journal) or 'sqlite'. Switching to sqlite imports the JSON data once.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+SQLITE_FILE = 'stock_market_data.db'
+# Closed tickets are moved here so market_data["tickets"] only holds open ones.
+TICKET_ARCHIVE_FILE = 'ticket_archive.jsonl'
+# Set to a path (e.g. interaction_trace.jsonl) to record every command, button and modal interaction for
+# `python -m benchmarks.replay`. Off by default.
+INTERACTION_TRACE_FILE = os.environ.get('INTERACTION_TRACE_FILE')
+INTERACTION_TRACE_FLUSH_SECONDS = 5
+# Set to a path (e.g. loop_lag_reports.jsonl) to watch for event loop stalls; see loop_watchdog.py. A stall of
+# LOOP_LAG_THRESHOLD_SECONDS or more gets its stack sampled every LOOP_LAG_SAMPLE_SECONDS and reported. Off by default.
+LOOP_LAG_REPORT_FILE = os.environ.get('LOOP_LAG_REPORT_FILE')
+LOOP_LAG_THRESHOLD_SECONDS = 0.5
+LOOP_LAG_SAMPLE_SECONDS = 0.01
+# Periodic market jobs run by scheduler.py. Their due times are persisted, so restarts neither postpone nor
+# repeat them; each run fires up to SCHEDULE_JITTER_SECONDS late. The conversion follows next_conversion_timestamp.
+PRICE_UPDATE_INTERVAL_HOURS = 72
+CONVERSION_INTERVAL_HOURS = 168
+CONVERSION_COUNTDOWN_INTERVAL_HOURS = 36
+INVESTOR_ROLE_CHECK_MINUTES = 5
+SCHEDULE_JITTER_SECONDS = 30
+# A job still waiting this long after it should have fired makes /healthz report unhealthy.
+SCHEDULE_OVERDUE_SECONDS = 600
+# The conversion re-picks its holders this many times if trades change who holds coins while it takes the locks.
+CONVERSION_LOCK_ATTEMPTS = 3
 
 MIN_PRICE = 50.00
 MAX_PRICE = 230.00
 INITIAL_PRICE = 120.00 
 
 VOLATILITY_LEVELS = [0.10, 0.20, 0.30, 0.40, 0.50, 0.60, 0.70, 0.80, 0.90, 1.00, 1.20, 1.50] 
+# Every balance change is appended here; see ledger.py for the format and the offline verifier.
+LEDGER_FILE = 'ledger.jsonl'
+LEDGER_INDEX_FILE = 'ledger.idx'
+HISTORY_PAGE_SIZE = 10
+LEADERBOARD_PAGE_SIZE = 10
+MAX_OPEN_ORDERS_PER_USER = 20
+# One binary file per coin in PRICE_HISTORY_DIR; the last PRICE_HISTORY_CACHE_TICKS ticks are kept in memory.
+PRICE_HISTORY_DIR = 'price_history'
+PRICE_HISTORY_CACHE_TICKS = 500
+# Price bounds per listed coin. Every coin uses the defaults above unless overridden here.
+COIN_SETTINGS = {name: {"min_price": MIN_PRICE, "max_price": MAX_PRICE, "initial_price": INITIAL_PRICE} for name in CRYPTO_NAMES}
 
 ANNOUNCEMENT_CHANNEL_ID = 1453194843009585326 
 TICKET_CATEGORY_ID = 1453203314689708072 
@@ -38,176 +99,512 @@ VERIFY_CHANNEL_ID = 1453236019427283035
 NEW_ARRIVAL_ROLE_ID = 1453229600594333869 
 CAMPTON_CITIZEN_ROLE_ID = 1453229088507428874 
 MARKET_INVESTOR_ROLE_ID = 1453228326033555520 
+QUARANTINE_ROLE_ID = None # Given instead of New Arrival to joiners that match a raid signature. None disables quarantine.
+
+# Raid mode trips when RAID_JOIN_THRESHOLD members join within RAID_WINDOW_SECONDS and ends after
+# RAID_QUIET_SECONDS below that rate. While it is on, welcome DMs stop, the verify channel is locked
+# and joiners get the New Arrival role from a paced queue (RAID_QUEUE_BATCH every RAID_QUEUE_INTERVAL_SECONDS).
+RAID_JOIN_THRESHOLD = 10
+RAID_WINDOW_SECONDS = 10
+RAID_QUIET_SECONDS = 300
+RAID_QUEUE_INTERVAL_SECONDS = 2
+RAID_QUEUE_BATCH = 5
+
+# Raid signatures: each joiner is compared with the last RAID_SIGNATURE_MAX_TRACKED joiners from the
+# past RAID_SIGNATURE_WINDOW_SECONDS (age bucket, similar name, same or default avatar) and quarantined
+# once their score reaches RAID_SIGNATURE_FLAG_SCORE.
+RAID_SIGNATURE_WINDOW_SECONDS = 600
+RAID_SIGNATURE_MAX_TRACKED = 500
+RAID_SIGNATURE_YOUNG_ACCOUNT_DAYS = 7
+RAID_SIGNATURE_CLUSTER_SIZE = 3
+RAID_SIGNATURE_FLAG_SCORE = 4
+
+# Mass DMs go out DM_CONCURRENCY at a time, at most DM_RATE_PER_SECOND overall.
+DM_RATE_PER_SECOND = 2
+DM_CONCURRENCY = 3
+DM_RATE_LIMIT_BACKOFF_SECONDS = 10
+# A DM job that keeps erroring is dropped after this many attempts instead of being retried forever.
+DM_JOB_MAX_ATTEMPTS = 3
+
+INVESTOR_MIN_BALANCE_CENTS = 2000000 # 20000.00 dollars
+INVESTOR_MIN_COINS_MILLI = 70000 # 70.000 coins
+# check_investor_roles normally only looks at accounts that changed; this often it re-checks every account.
+INVESTOR_FULL_RECONCILE_HOURS = 24
+
+# Served by main.py on /metrics in the Prometheus text format. Every slash command, component callback and
+# background loop is wrapped with timed(); persistence and DM numbers come from data_writer and dm_dispatcher.
+metrics = MetricsRegistry()
+command_latency = metrics.histogram("campton_command_duration_seconds", "Slash command handler run time.", ["command"])
+command_errors = metrics.counter("campton_command_errors_total", "Slash command handlers that raised.", ["command"])
+component_latency = metrics.histogram("campton_component_duration_seconds", "Button and modal callback run time.", ["component"])
+component_errors = metrics.counter("campton_component_errors_total", "Button and modal callbacks that raised.", ["component"])
+loop_latency = metrics.histogram("campton_loop_duration_seconds", "Background loop iteration run time.", ["loop"])
+loop_errors = metrics.counter("campton_loop_errors_total", "Background loop iterations that raised.", ["loop"])
+persistence_latency = metrics.histogram("campton_persistence_duration_seconds", "Market data encoding (event loop) and writing (worker thread) time.", ["operation"])
+persistence_bytes = metrics.counter("campton_persistence_bytes_total", "Market data bytes written (JSON backend only).", ["operation"])
+
+loop_lag = metrics.histogram("campton_event_loop_lag_seconds", "How late the loop watchdog's 100 ms heartbeat woke (only with LOOP_LAG_REPORT_FILE set).")
+
+def record_persistence(operation, seconds, size):
+    persistence_latency.observe(seconds, operation)
+    if size is not None:
+        persistence_bytes.inc(operation, amount=size)
+
+if STORAGE_BACKEND == 'sqlite':
+    data_store = SqliteStore(SQLITE_FILE, row_factories={"users": UserAccount.from_dict})
+    data_store.migrate_from(JournalStore(DATA_FILE, JOURNAL_FILE))
+else:
+    data_store = JournalStore(DATA_FILE, JOURNAL_FILE, compact_threshold=JOURNAL_COMPACT_THRESHOLD)
+data_writer = AsyncWriter(data_store, coalesce_delay=SAVE_COALESCE_SECONDS, on_write=record_persistence)
 
 def load_data():
     data = {"coins": {}, "users": {}, "tickets": {}, "next_conversion_timestamp": None}
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            try:
-                loaded_data = json.load(f)
-                data.update(loaded_data)
-                if "coins" not in data: data["coins"] = {}
-                if "users" not in data: data["users"] = {}
-                if "tickets" not in data: data["tickets"] = {}
-                if "next_conversion_timestamp" not in data: data["next_conversion_timestamp"] = (discord.utils.utcnow() + timedelta(days=7)).isoformat()
-                for user_id in data["users"]:
-                    if "verification" not in data["users"][user_id]: data["users"][user_id]["verification"] = {}
-                    if "on_buy_cooldown" not in data["users"][user_id]: data["users"][user_id]["on_buy_cooldown"] = False
-            except json.JSONDecodeError:
-                print(f"Warning: {DATA_FILE} is corrupted or empty. Starting with fresh data.")
+    data_store.load(data)
+    if "coins" not in data: data["coins"] = {}
+    if "users" not in data: data["users"] = {}
+    if "tickets" not in data: data["tickets"] = {}
+    if "dm_jobs" not in data: data["dm_jobs"] = {}
+    if "dm_progress" not in data: data["dm_progress"] = {}
+    if "migrations" not in data: data["migrations"] = {}
+    if "market_epoch" not in data: data["market_epoch"] = 0
+    if "orders" not in data: data["orders"] = {}
+    if "schedule" not in data: data["schedule"] = {}
+    if data.get("next_conversion_timestamp") is None: data["next_conversion_timestamp"] = (discord.utils.utcnow() + timedelta(hours=CONVERSION_INTERVAL_HOURS)).isoformat()
+    if isinstance(data["users"], dict):
+        # The SQLite backend builds accounts as rows are fetched; JSON records are converted here, once.
+        users = {}
+        for user_id, record in data["users"].items():
+            residue = {}
+            users[user_id] = UserAccount.from_dict(record, residue)
+            if residue:
+                legacy_money_residue[user_id] = residue
+        data["users"] = users
     return data
 
+# Filled by load_data: {user_id: {"cents": ..., "milli": ...}} rounded away converting each record that still
+# held old float balances (see convert_legacy_money).
+legacy_money_residue = {}
+
+# None of these touch the disk; data_writer picks the changes up in the background.
 def save_data(data):
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+    # Full snapshot. Only used for bulk changes; single mutations go through save_record/save_user.
+    data_writer.request_snapshot(data)
+
+def save_record(section, key=None):
+    value = market_data[section] if key is None else market_data[section][key]
+    data_writer.mark_dirty(section, key, value)
+
+# Every balance or holdings change runs inside account_locks.transaction(<the user IDs it touches>).
+account_locks = AccountLocks()
+
+# Users whose last mutation left them eligible for Market Investor; drained by check_investor_roles.
+investor_candidates = set()
+
+def is_investor_eligible(user_data):
+    return user_data.balance_cents >= INVESTOR_MIN_BALANCE_CENTS or user_data.quantity(CAMPTOM_COIN_NAME) >= INVESTOR_MIN_COINS_MILLI
+
+def save_user(user_id):
+    user_data = market_data["users"][str(user_id)]
+    save_record("users", str(user_id))
+    holdings_table.sync_account(str(user_id), user_data)
+    leaderboard.update(user_id, holdings_table.net_worth_of(str(user_id), market_engine.prices_cents()))
+    if is_investor_eligible(user_data):
+        investor_candidates.add(int(user_id))
+
+def delete_record(section, key):
+    data_writer.mark_dirty(section, key, JOURNAL_DELETE)
+
+def find_open_ticket(user_id):
+    return market_data["open_tickets"].get(str(user_id))
+
+def _detach_ticket(ticket_id):
+    ticket_info = market_data["tickets"].pop(ticket_id)
+    delete_record("tickets", ticket_id)
+    user_id_str = str(ticket_info["user_id"])
+    if market_data["open_tickets"].get(user_id_str) == ticket_id:
+        del market_data["open_tickets"][user_id_str]
+        delete_record("open_tickets", user_id_str)
+    return dict(ticket_info, channel_id=ticket_id)
+
+async def archive_ticket(ticket_id):
+    if ticket_id not in market_data["tickets"]:
+        return
+    archived = _detach_ticket(ticket_id)
+    await asyncio.to_thread(append_jsonl, TICKET_ARCHIVE_FILE, [archived])
+
+def build_open_ticket_index():
+    # One-time migration for data written before the index existed: index the open tickets
+    # and move every closed one into the archive file.
+    if "open_tickets" in market_data:
+        return
+    market_data["open_tickets"] = {}
+    closed_ids = []
+    if STORAGE_BACKEND == 'sqlite':
+        ticket_statuses = data_store.iter_ticket_statuses()
+    else:
+        ticket_statuses = ((ticket_id, ticket_info["user_id"], ticket_info["status"]) for ticket_id, ticket_info in market_data["tickets"].items())
+    for ticket_id, user_id, status in ticket_statuses:
+        if status == "open":
+            market_data["open_tickets"][str(user_id)] = ticket_id
+        else:
+            closed_ids.append(ticket_id)
+    append_jsonl(TICKET_ARCHIVE_FILE, [_detach_ticket(ticket_id) for ticket_id in closed_ids])
+    save_data(market_data)
+    print(f"Indexed {len(market_data['open_tickets'])} open tickets and archived {len(closed_ids)} closed tickets.")
+
+def prune_empty_users():
+    # One-time cleanup of the empty records get_user_data used to create for every member it was asked about.
+    if market_data["migrations"].get("prune_empty_users"):
+        return
+    if STORAGE_BACKEND == 'sqlite':
+        empty_ids = data_store.fetch_empty_user_ids()
+    else:
+        empty_ids = [user_id_str for user_id_str, user_data in market_data["users"].items() if user_data.is_empty()]
+    for user_id_str in empty_ids:
+        del market_data["users"][user_id_str]
+        delete_record("users", user_id_str)
+    market_data["migrations"]["prune_empty_users"] = discord.utils.utcnow().isoformat()
+    save_record("migrations", "prune_empty_users")
+    print(f"Removed {len(empty_ids)} empty user records.")
+
+def convert_legacy_money():
+    # One-time rewrite of records that still hold float dollars/coins. load_data already converted them
+    # in memory; this writes them back in the integer layout and logs what rounding dropped.
+    if market_data["migrations"].get("integer_money"):
+        return
+    # Records prune_empty_users already removed don't need rewriting.
+    converted = [residue for user_id, residue in legacy_money_residue.items() if user_id in market_data["users"]]
+    if converted:
+        # Rounded to millionths; the + 0 turns Decimal's -0.000000 into 0.000000.
+        residue_cents = round(sum(residue.get("cents", 0) for residue in converted), 6) + 0
+        residue_milli = round(sum(residue.get("milli", 0) for residue in converted), 6) + 0
+        print(f"Converted {len(converted)} user records to integer cents / milli-coins. "
+              f"Rounding residue: {residue_cents} cents, {residue_milli} milli-coins.")
+        save_data(market_data)
+    market_data["migrations"]["integer_money"] = discord.utils.utcnow().isoformat()
+    save_record("migrations", "integer_money")
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True 
-bot = commands.Bot(command_prefix=PREFIX, intents=intents)
+
+class CamptonBot(commands.Bot):
+    async def setup_hook(self):
+        # Runs once per process, after login and before the gateway connects. on_ready fires again after
+        # every reconnect, so everything that must happen exactly once is started here.
+        # Everything loaded at startup lives as long as the process. Freezing it keeps full garbage collections,
+        # which hold the event loop, from walking every account each time a snapshot encode allocates.
+        gc.freeze()
+        data_writer.start()
+        if interaction_trace is not None:
+            interaction_trace.start()
+        if loop_watchdog is not None:
+            loop_watchdog.start()
+        self.add_view(TicketView())
+        self.add_view(VerifyView())
+        dm_dispatcher.start()
+        for background_loop in BACKGROUND_LOOPS:
+            background_loop.start()
+        scheduler.start(wait_for=self.wait_until_ready)
+        print(f"Started background tasks: {', '.join([loop.coro.__name__ for loop in BACKGROUND_LOOPS] + list(scheduler.jobs))}.")
+        await sync_command_tree()
+
+    async def close(self):
+        print("Shutting down, flushing market data to disk...")
+        await scheduler.stop()
+        if interaction_trace is not None:
+            await interaction_trace.stop()
+        await data_writer.stop()
+        ledger.close()
+        if loop_watchdog is not None:
+            loop_watchdog.stop()
+        await super().close()
+
+bot = CamptonBot(command_prefix=PREFIX, intents=intents)
 
 bot.owner_id = 357681843790675978 
 
+interaction_trace = InteractionTrace(INTERACTION_TRACE_FILE, INTERACTION_TRACE_FLUSH_SECONDS) if INTERACTION_TRACE_FILE else None
+
+async def record_interaction(interaction: discord.Interaction):
+    interaction_trace.record(interaction)
+
+if interaction_trace is not None:
+    bot.add_listener(record_interaction, 'on_interaction')
+    print(f"Recording interactions to {INTERACTION_TRACE_FILE}.")
+
+loop_watchdog = None
+if LOOP_LAG_REPORT_FILE:
+    loop_watchdog = LoopWatchdog(LOOP_LAG_REPORT_FILE, LOOP_LAG_THRESHOLD_SECONDS, LOOP_LAG_SAMPLE_SECONDS, activity_labels=activity_labels, on_lag=loop_lag.observe)
+    metrics.sampled("campton_event_loop_stalls_total", "Event loop stalls reported by the loop watchdog.", "counter", ["activity"],
+                    lambda: {(activity,): count for activity, count in loop_watchdog.stall_counts().items()})
+    print(f"Watching for event loop stalls over {LOOP_LAG_THRESHOLD_SECONDS}s; reports go to {LOOP_LAG_REPORT_FILE}.")
+
 market_data = load_data()
 
-if "Campton Coin" not in market_data["coins"] or len(market_data["coins"]) != len(CRYPTO_NAMES):
+market_engine = MarketEngine(COIN_SETTINGS, VOLATILITY_LEVELS)
+reset_coins = market_engine.load_prices(market_data["coins"])
+if reset_coins or set(market_data["coins"]) != set(market_engine.coin_names):
+    for name in reset_coins:
+        print(f"{name} price missing or outside its bounds. Resetting to its initial price.")
     market_data["coins"] = {}
-    for name in CRYPTO_NAMES:
-        market_data["coins"][name] = {"price": INITIAL_PRICE}
-    save_data(market_data)
-elif market_data["coins"]["Campton Coin"]["price"] < MIN_PRICE or market_data["coins"]["Campton Coin"]["price"] > MAX_PRICE:
-    print(f"Detected Campton Coin price outside bounds ({market_data['coins']['Campton Coin']['price']:.2f}). Resetting to INITIAL_PRICE.")
-    market_data["coins"]["Campton Coin"]["price"] = INITIAL_PRICE
-    save_data(market_data)
+    market_engine.write_prices(market_data["coins"])
+    save_record("coins")
+holdings_table = HoldingsTable(market_engine.coin_names)
+price_history = PriceHistory(PRICE_HISTORY_DIR, market_engine.coin_names, PRICE_HISTORY_CACHE_TICKS)
+build_open_ticket_index()
+prune_empty_users()
+convert_legacy_money()
+data_writer.flush_sync()
+if STORAGE_BACKEND == 'sqlite':
+    holdings_table.load(data_store.iter_money_rows())
+else:
+    for user_id_str, user_data in market_data["users"].items():
+        holdings_table.sync_account(user_id_str, user_data)
+print(f"Holdings table built for {len(holdings_table)} users.")
+
+def reprice_leaderboard():
+    net_worths = holdings_table.net_worth_cents(market_engine.prices_cents())
+    leaderboard.rebuild(zip(holdings_table.user_ids, net_worths.tolist()))
+
+leaderboard = Leaderboard()
+reprice_leaderboard()
+
+order_book = OrderBook(market_data["orders"], market_data.get("next_order_id", 1))
+
+ledger = Ledger(LEDGER_FILE, LEDGER_INDEX_FILE)
+if ledger.is_empty():
+    # First start with a ledger: record what everyone already holds so replaying it gives today's balances.
+    opened = 0
+    for row, user_id_str in enumerate(holdings_table.user_ids):
+        coins = {coin: milli for coin, milli in zip(holdings_table.coin_names, holdings_table.holdings[row].tolist()) if milli}
+        balance_cents = int(holdings_table.balances[row])
+        if balance_cents or coins:
+            ledger.record(user_id_str, "opening", cash=balance_cents, coins=coins)
+            opened += 1
+    print(f"Started {LEDGER_FILE} with opening balances for {opened} users.")
+elif market_data.get("ledger_seq") is not None and ledger.last_seq > market_data["ledger_seq"]:
+    # The last run stopped after writing ledger entries but before saving their changes (see ledger.py).
+    # The data is what the bot runs on, so the ledger is brought back in line with it.
+    _, ledger_states = tail_states(LEDGER_FILE, market_data["ledger_seq"])
+    entries_ahead = ledger.last_seq - market_data["ledger_seq"]
+    recovered = 0
+    for user_id_str, history in ledger_states.items():
+        account = market_data["users"].get(user_id_str)
+        stored_cash, stored_coins = (account.balance_cents, {coin: h.milli for coin, h in account.portfolio.items()}) if account else (0, {})
+        replayed_cash, replayed_coins = history[-1]
+        coins = {coin: stored_coins.get(coin, 0) - replayed_coins.get(coin, 0) for coin in stored_coins.keys() | replayed_coins.keys()}
+        coins = {coin: milli for coin, milli in coins.items() if milli}
+        if stored_cash != replayed_cash or coins:
+            ledger.record(user_id_str, "recovery", cash=stored_cash - replayed_cash, coins=coins)
+            recovered += 1
+    print(f"WARNING: {LEDGER_FILE} was {entries_ahead} entries ahead of the saved market data. "
+          f"Recorded recovery entries for {recovered} users whose changes were lost.")
+data_writer.stamp = lambda: ("ledger_seq", ledger.last_seq)
+market_data["ledger_seq"] = ledger.last_seq
+save_record("ledger_seq")
+
+async def resolve_dm_recipient(user_id):
+    user = bot.get_user(user_id)
+    if user is None:
+        try:
+            user = await bot.fetch_user(user_id)
+        except discord.NotFound:
+            return None
+        except discord.HTTPException as e:
+            print(f"Could not fetch DM recipient {user_id}: {e}")
+            return None
+    return user
+
+dm_dispatcher = DMDispatcher(
+    market_data["dm_jobs"], market_data["dm_progress"], save_record, delete_record, resolve_dm_recipient,
+    rate_per_second=DM_RATE_PER_SECOND, concurrency=DM_CONCURRENCY, rate_limit_backoff=DM_RATE_LIMIT_BACKOFF_SECONDS,
+    max_attempts=DM_JOB_MAX_ATTEMPTS
+)
+metrics.sampled("campton_dm_sends_total", "DM send attempts by outcome; rate_limited counts 429 responses.", "counter", ["outcome"],
+                lambda: {(outcome,): count for outcome, count in dm_dispatcher.stats.items() if outcome != "jobs_completed"})
+metrics.sampled("campton_dm_jobs_completed_total", "Mass-DM jobs finished.", "counter", [], lambda: {(): dm_dispatcher.stats["jobs_completed"]})
+metrics.sampled("campton_dm_pending", "DMs queued and not yet sent.", "gauge", [], lambda: {(): dm_dispatcher.pending_count()})
+metrics.sampled("campton_gateway_latency_seconds", "Discord websocket heartbeat latency.", "gauge", [],
+                lambda: {(): bot.latency} if math.isfinite(bot.latency) else {})
 
 async def is_bot_owner_slash(interaction: discord.Interaction) -> bool:
     return interaction.user.id == bot.owner_id
 
-def has_more_than_three_decimals(number: float) -> bool:
-    s = str(f"{number:.4f}") 
-    if '.' in s:
-        decimal_part = s.split('.')[1]
-        return len(decimal_part) > 3
-    return False
-
 def update_prices():
-    for coin_name in market_data["coins"]:
-        current_price = market_data["coins"][coin_name]["price"]
-        chosen_volatility = random.choice(VOLATILITY_LEVELS)
-        change_percent = random.uniform(-chosen_volatility, chosen_volatility)
-        new_price = current_price * (1 + change_percent)
-        new_price = max(MIN_PRICE, min(MAX_PRICE, new_price)) 
-        market_data["coins"][coin_name]["price"] = round(new_price, 2)
-    
-    for user_id_str in market_data["users"]:
-        market_data["users"][user_id_str]["on_buy_cooldown"] = False
-    
-    save_data(market_data)
+    market_engine.step()
+    market_engine.write_prices(market_data["coins"])
+    price_history.append(time.time(), market_engine.prices_cents().tolist())
+    reprice_leaderboard()
+    # Buy cooldowns are tied to the epoch they started in, so moving to the next one clears them all.
+    market_data["market_epoch"] += 1
+    save_record("coins")
+    save_record("market_epoch")
     print("Market price updated and buy cooldown cleared for all users.")
 
+def is_on_buy_cooldown(user_data):
+    return user_data.on_buy_cooldown(market_data["market_epoch"])
+
+# Returned for users without a record. Read-only, so a lookup can never create or persist anything.
+DEFAULT_USER_VIEW = read_only_default_account()
+
 def get_user_data(user_id):
-    if str(user_id) not in market_data["users"]:
-        market_data["users"][str(user_id)] = {"balance": 0.0, "portfolio": {}, "verification": {}, "on_buy_cooldown": False}
-    elif "verification" not in market_data["users"][str(user_id)]:
-        market_data["users"][str(user_id)]["verification"] = {}
-    if "on_buy_cooldown" not in market_data["users"][str(user_id)]:
-        market_data["users"][str(user_id)]["on_buy_cooldown"] = False
-    return market_data["users"][str(user_id)]
-
-def buy_coin(user_id, coin_name, quantity_of_coins_to_buy): 
+    return market_data["users"].get(str(user_id), DEFAULT_USER_VIEW)
+
+def get_or_create_user_data(user_id):
+    # For mutations only. The record is persisted by the save_user() call that follows the change.
+    user = market_data["users"].get(str(user_id))
+    if user is None:
+        user = UserAccount()
+        market_data["users"][str(user_id)] = user
+    return user
+
+async def buy_coin(user_id, coin_name, milli_to_buy):
+    async with account_locks.transaction(user_id):
+        return _buy_coin(user_id, coin_name, milli_to_buy)
+
+def _buy_coin(user_id, coin_name, milli_to_buy):
     user = get_user_data(user_id)
     if coin_name not in market_data["coins"]:
         return "Coin not found."
 
-    if user.get("on_buy_cooldown", False):
-        return "You cannot buy Campton Coin until after the next market price update (approximately every 3 days)."
+    if is_on_buy_cooldown(user):
+        return f"You cannot buy {coin_name} until after the next market price update (approximately every 3 days)."
 
-    coin_price = market_data["coins"][coin_name]["price"]
-    cost = quantity_of_coins_to_buy * coin_price 
+    cost = coin_cost_cents(milli_to_buy, price_to_cents(market_data["coins"][coin_name]["price"]))
 
-    if user["balance"] < cost:
-        return f"Insufficient funds. You need {cost:.2f} dollars but only have {user['balance']:.2f} dollars."
+    if user.balance_cents < cost:
+        return f"Insufficient funds. You need {format_cash(cost)} dollars but only have {format_cash(user.balance_cents)} dollars."
 
-    user["balance"] -= cost
-    user["portfolio"][coin_name] = user["portfolio"].get(coin_name, 0.0) + quantity_of_coins_to_buy
-    save_data(market_data)
-    return f"Successfully bought {quantity_of_coins_to_buy:.3f} {coin_name}(s) for {cost:.2f} dollars." 
+    user = get_or_create_user_data(user_id)
+    user.balance_cents -= cost
+    user.add_quantity(coin_name, milli_to_buy)
+    save_user(user_id)
+    ledger.record(user_id, "buy", cash=-cost, coins={coin_name: milli_to_buy}, price=price_to_cents(market_data["coins"][coin_name]["price"]))
+    return f"Successfully bought {format_coins(milli_to_buy)} {coin_name}(s) for {format_cash(cost)} dollars."
 
-def sell_coin(user_id, coin_name, quantity):
+async def sell_coin(user_id, coin_name, milli):
+    async with account_locks.transaction(user_id):
+        return _sell_coin(user_id, coin_name, milli)
+
+def _sell_coin(user_id, coin_name, milli):
     user = get_user_data(user_id)
     if coin_name not in market_data["coins"]:
         return "Coin not found."
-    if coin_name not in user["portfolio"] or user["portfolio"][coin_name] < quantity:
-        return f"You don't own {quantity:.3f} {coin_name}(s). You have {user['portfolio'].get(coin_name, 0.0):.3f}."
-
-    coin_price = market_data["coins"][coin_name]["price"]
-    revenue = coin_price * quantity
-
-    user["balance"] += revenue
-    user["portfolio"][coin_name] -= quantity
-    if user["portfolio"][coin_name] <= 0.0001: 
-        del user["portfolio"][coin_name]
-    save_data(market_data)
-    return f"Successfully sold {quantity:.3f} {coin_name}(s) for {revenue:.2f} dollars."
+    if user.quantity(coin_name) < milli:
+        return f"You don't own {format_coins(milli)} {coin_name}(s). You have {format_coins(user.quantity(coin_name))}."
+
+    revenue = coin_value_cents(milli, price_to_cents(market_data["coins"][coin_name]["price"]))
+
+    user.balance_cents += revenue
+    user.add_quantity(coin_name, -milli)
+    save_user(user_id)
+    ledger.record(user_id, "sell", cash=revenue, coins={coin_name: -milli}, price=price_to_cents(market_data["coins"][coin_name]["price"]))
+    return f"Successfully sold {format_coins(milli)} {coin_name}(s) for {format_cash(revenue)} dollars."
+
+async def match_orders():
+    # Runs after every price tick. Triggered orders execute at the new price like /buy and /sell;
+    # one that can't (not enough cash or coins, buy cooldown) is dropped and its owner told why.
+    fill_notices = []
+    for coin_name in market_engine.coin_names:
+        price_cents = price_to_cents(market_data["coins"][coin_name]["price"])
+        for order_id, (user_id, _, side, kind, order_price_cents, milli, _) in order_book.pop_crossing(coin_name, price_cents):
+            delete_record("orders", order_id)
+            async with account_locks.transaction(user_id):
+                if side == "buy":
+                    result = _buy_coin(user_id, coin_name, milli)
+                else:
+                    result = _sell_coin(user_id, coin_name, milli)
+            outcome = result if result.startswith("Successfully") else f"It could not be filled and was cancelled: {result}"
+            fill_notices.append((user_id, (
+                f"📒 Your {kind} order #{order_id} to {side} {format_coins(milli)} {coin_name} at {format_cash(order_price_cents)} dollars "
+                f"triggered at {format_cash(price_cents)} dollars.\n{outcome}"
+            )))
+    if fill_notices:
+        print(f"Triggered {len(fill_notices)} resting orders.")
+        dm_dispatcher.enqueue("order_fill", fill_notices)
+
+def schedule_next_conversion():
+    # Every conversion, including a skipped one, moves next_conversion_timestamp and the scheduler together,
+    # so the countdown and the next run agree even after a restart.
+    next_conversion = discord.utils.utcnow() + timedelta(hours=CONVERSION_INTERVAL_HOURS)
+    market_data["next_conversion_timestamp"] = next_conversion.isoformat()
+    save_record("next_conversion_timestamp")
+    scheduler.reschedule("auto_convert_crypto_to_cash", next_conversion.timestamp())
+
+def _convert_holders(user_ids):
+    # Runs with every account in user_ids locked and without awaiting, so the holdings table rows and the
+    # price cannot move underneath it. Converts them all in one array operation.
+    current_price_cents = price_to_cents(market_data["coins"][CAMPTOM_COIN_NAME]["price"])
+    rows = [holdings_table.rows[user_id_str] for user_id_str in user_ids]
+    converted_milli, credited_cents = holdings_table.convert_to_cash(CAMPTOM_COIN_NAME, rows, current_price_cents)
+
+    # Stage 2: apply the results to the accounts and queue the DMs; nothing here waits on Discord.
+    conversion_notices = []
+    for user_id_str, user_campton_coins, cash_received in zip(user_ids, converted_milli.tolist(), credited_cents.tolist()):
+        user_data = market_data["users"][user_id_str]
+        user_data.balance_cents += cash_received
+        user_data.set_quantity(CAMPTOM_COIN_NAME, 0)
+        user_data.buy_cooldown_epoch = market_data["market_epoch"]
+        save_user(user_id_str)
+        ledger.record(user_id_str, "conversion", cash=cash_received, coins={CAMPTOM_COIN_NAME: -user_campton_coins}, price=current_price_cents)
+
+        conversion_notices.append((int(user_id_str), (
+            f"🔔 **Automatic Crypto Conversion!** 🔔\n\n"
+            f"Your {format_coins(user_campton_coins)} {CAMPTOM_COIN_NAME} holdings have been automatically converted to cash.\n"
+            f"You received **{format_cash(cash_received)} dollars** (at a price of {format_cash(current_price_cents)} dollars per coin).\n"
+            f"Your new cash balance is: **{format_cash(user_data.balance_cents)} dollars**.\n\n"
+            f"**You are now on a temporary buy cooldown and cannot purchase Campton Coin until after the next market price update.**"
+        )))
+    return converted_milli, credited_cents, conversion_notices
 
 async def _perform_crypto_to_cash_conversion():
     print("Initiating crypto to cash conversion logic...")
     
     if CAMPTOM_COIN_NAME not in market_data["coins"]:
         print(f"Warning: '{CAMPTOM_COIN_NAME}' not found in market data. Skipping conversion.")
+        schedule_next_conversion()
         return 0 
 
-    current_coin_price = market_data["coins"][CAMPTOM_COIN_NAME]["price"]
-    
     target_guild = None
     if bot.guilds:
         target_guild = bot.guilds[0] 
     if target_guild is None:
         print(f"Warning: Bot is not in any guild. Cannot perform crypto to cash conversion.")
+        schedule_next_conversion()
         return 0
 
-    converted_count = 0
-    for user_id_str, user_data in list(market_data["users"].items()):
-        user_id = int(user_id_str)
-        member = target_guild.get_member(user_id)
-
-        if member and not member.bot: 
-            user_campton_coins = user_data.get("portfolio", {}).get(CAMPTOM_COIN_NAME, 0.0)
-
-            if user_campton_coins > 0.0:
-                cash_received = user_campton_coins * current_coin_price
-                user_data["balance"] += cash_received
-                user_data["portfolio"][CAMPTOM_COIN_NAME] = 0.0
-                del user_data["portfolio"][CAMPTOM_COIN_NAME]
-
-                user_data["on_buy_cooldown"] = True 
-
-                converted_count += 1
-                print(f"Converted {user_campton_coins:.3f} {CAMPTOM_COIN_NAME} for {member.display_name} ({user_id}) to {cash_received:.2f} dollars.")
+    def member_holders():
+        return {
+            user_id_str for user_id_str in (holdings_table.user_ids[row] for row in holdings_table.holder_rows(CAMPTOM_COIN_NAME).tolist())
+            if (member := target_guild.get_member(int(user_id_str))) and not member.bot
+        }
 
-                try:
-                    await member.send(
-                        f"🔔 **Automatic Crypto Conversion!** 🔔\n\n"
-                        f"Your {user_campton_coins:.3f} {CAMPTOM_COIN_NAME} holdings have been automatically converted to cash.\n"
-                        f"You received **{cash_received:.2f} dollars** (at a price of {current_coin_price:.2f} dollars per coin).\n"
-                        f"Your new cash balance is: **{user_data['balance']:.2f} dollars**.\n\n"
-                        f"**You are now on a temporary buy cooldown and cannot purchase Campton Coin until after the next market price update.**"
-                    )
-                except discord.Forbidden:
-                    print(f"Could not send DM to {member.display_name} about auto-conversion. DMs might be disabled.")
-                except Exception as e:
-                    print(f"Error sending auto-conversion DM to {member.display_name}: {e}")
+    # Stage 1: lock the holders who are still guild members. Holdings can change while the locks are being
+    # taken, so the holders are picked again once they are held; anyone who bought in meanwhile is locked
+    # on another pass, and anyone who sold everything is left alone.
+    locked_ids = member_holders()
+    for attempt in range(CONVERSION_LOCK_ATTEMPTS):
+        async with account_locks.transaction(*locked_ids):
+            holders = member_holders()
+            if holders <= locked_ids or attempt == CONVERSION_LOCK_ATTEMPTS - 1:
+                user_ids = sorted(holders & locked_ids)
+                converted_milli, credited_cents, conversion_notices = _convert_holders(user_ids)
+                break
+        locked_ids |= holders
+    converted_count = len(user_ids)
+    print(f"Converted {format_coins(int(converted_milli.sum()))} {CAMPTOM_COIN_NAME} into {format_cash(int(credited_cents.sum()))} dollars across {converted_count} users.")
     
-    market_data["next_conversion_timestamp"] = (discord.utils.utcnow() + timedelta(days=7)).isoformat()
-    save_data(market_data)
+    schedule_next_conversion()
+    dm_dispatcher.enqueue("conversion_notice", conversion_notices)
     print(f"Crypto to cash conversion logic complete. {converted_count} users processed.")
     return converted_count
 
-@tasks.loop(hours=72)
 async def scheduled_price_update():
     print("Running scheduled price update...")
     await bot.change_presence(activity=discord.Game(name="Updating Market Prices...")) 
     update_prices() 
+    await match_orders()
     await bot.change_presence(activity=discord.Game(name="Campton Stocks RP")) 
     if ANNOUNCEMENT_CHANNEL_ID:
         channel = bot.get_channel(ANNOUNCEMENT_CHANNEL_ID)
@@ -222,12 +619,8 @@ async def scheduled_price_update():
         else:
             print(f"Warning: Announcement channel with ID {ANNOUNCEMENT_CHANNEL_ID} not found.")
 
-@scheduled_price_update.before_loop
-async def before_scheduled_price_update():
-    await bot.wait_until_ready()
-    print("Scheduled price update task is waiting for bot to be ready...")
+last_investor_full_reconcile = None
 
-@tasks.loop(minutes=5)
 async def check_investor_roles():
     print("Running scheduled check for Market Investor roles...")
     if MARKET_INVESTOR_ROLE_ID is None:
@@ -247,22 +640,35 @@ async def check_investor_roles():
         print(f"Warning: Market Investor role with ID {MARKET_INVESTOR_ROLE_ID} not found in guild {target_guild.name}. Skipping investor role checks.")
         return
 
-    for member in target_guild.members:
-        if member.bot:
+    global investor_candidates, last_investor_full_reconcile
+    candidates, investor_candidates = investor_candidates, set()
+    now = time.monotonic()
+    if last_investor_full_reconcile is None or now - last_investor_full_reconcile >= INVESTOR_FULL_RECONCILE_HOURS * 3600:
+        # Fallback for anything the mutation hooks missed (e.g. roles removed by hand). The eligible rows come
+        # from the holdings table, so only those accounts are loaded.
+        last_investor_full_reconcile = now
+        eligible_rows = holdings_table.rows_at_least(INVESTOR_MIN_BALANCE_CENTS, CAMPTOM_COIN_NAME, INVESTOR_MIN_COINS_MILLI)
+        candidates.update(int(holdings_table.user_ids[row]) for row in eligible_rows.tolist())
+
+    for user_id in candidates:
+        member = target_guild.get_member(user_id)
+        if member is None or member.bot:
             continue
 
-        user_data = get_user_data(member.id)
-        user_balance = user_data.get("balance", 0.0)
-        campton_coins = user_data.get("portfolio", {}).get(CAMPTOM_COIN_NAME, 0.0)
+        user_data = market_data["users"].get(str(user_id))
+        if user_data is None:
+            continue
+        user_balance = user_data.balance_cents
+        campton_coins = user_data.quantity(CAMPTOM_COIN_NAME)
 
-        if (user_balance >= 20000.0 or campton_coins >= 70.0):
+        if is_investor_eligible(user_data):
             if investor_role_obj not in member.roles:
                 try:
                     await member.add_roles(investor_role_obj)
                     print(f"Assigned 'Market Investor' role to {member.display_name} ({member.id}).")
                     try:
                         await member.send(f"Congratulations! You've earned the **Market Investor** role in {target_guild.name} "
-                                          f"for reaching a balance of {user_balance:.2f} dollars or holding {campton_coins:.3f} Campton Coins!")
+                                          f"for reaching a balance of {format_cash(user_balance)} dollars or holding {format_coins(campton_coins)} Campton Coins!")
                     except discord.Forbidden:
                         print(f"Could not send DM to {member.display_name} about Market Investor role. DMs might be disabled.")
                 except discord.Forbidden:
@@ -271,23 +677,11 @@ async def check_investor_roles():
                 except Exception as e:
                     print(f"An unexpected error occurred while assigning 'Market Investor' role to {member.display_name}: {e}")
 
-@check_investor_roles.before_loop
-async def before_check_investor_roles():
-    await bot.wait_until_ready()
-    print("Scheduled Market Investor role check task is waiting for bot to be ready...")
-
-@tasks.loop(hours=168) 
 async def auto_convert_crypto_to_cash():
     print("Running scheduled auto crypto to cash conversion...")
     await _perform_crypto_to_cash_conversion()
     print("Scheduled auto crypto to cash conversion task complete.")
 
-@auto_convert_crypto_to_cash.before_loop
-async def before_auto_convert_crypto_to_cash():
-    await bot.wait_until_ready()
-    print("Scheduled crypto to cash conversion task is waiting for bot to be ready...")
-
-@tasks.loop(hours=36)
 async def notify_conversion_countdown():
     print("Running scheduled conversion countdown notification...")
     
@@ -299,8 +693,8 @@ async def notify_conversion_countdown():
         return
 
     if "next_conversion_timestamp" not in market_data or market_data["next_conversion_timestamp"] is None:
-        market_data["next_conversion_timestamp"] = (discord.utils.utcnow() + timedelta(days=7)).isoformat()
-        save_data(market_data)
+        market_data["next_conversion_timestamp"] = (discord.utils.utcnow() + timedelta(hours=CONVERSION_INTERVAL_HOURS)).isoformat()
+        save_record("next_conversion_timestamp")
         print("Initialized next_conversion_timestamp as it was missing.")
     
     next_conversion_dt = datetime.datetime.fromisoformat(market_data["next_conversion_timestamp"])
@@ -337,27 +731,110 @@ async def notify_conversion_countdown():
 
     full_notification_message = notification_message_base + notification_message_time + "\n\nPlan your trades accordingly!"
 
-    for member in target_guild.members:
-        if member.bot:
+    # Only members who actually hold Campton Coin have anything to convert.
+    recipients = []
+    for row in holdings_table.holder_rows(CAMPTOM_COIN_NAME).tolist():
+        member = target_guild.get_member(int(holdings_table.user_ids[row]))
+        if member and not member.bot:
+            recipients.append(member.id)
+    dm_dispatcher.enqueue("conversion_countdown", recipients, content=full_notification_message, replace_pending=True)
+
+raid_monitors = {}
+raid_join_queues = {}
+raid_signatures = {}
+raid_locked_channels = {}
+
+def get_raid_monitor(guild_id):
+    if guild_id not in raid_monitors:
+        raid_monitors[guild_id] = JoinRateMonitor(RAID_JOIN_THRESHOLD, RAID_WINDOW_SECONDS, RAID_QUIET_SECONDS)
+        raid_join_queues[guild_id] = deque()
+        raid_signatures[guild_id] = RaidSignatureEngine(
+            RAID_SIGNATURE_WINDOW_SECONDS, RAID_SIGNATURE_MAX_TRACKED, RAID_SIGNATURE_YOUNG_ACCOUNT_DAYS * 86400,
+            RAID_SIGNATURE_CLUSTER_SIZE, RAID_SIGNATURE_FLAG_SCORE
+        )
+    return raid_monitors[guild_id]
+
+async def lock_channel(channel, locked_by):
+    await channel.set_permissions(channel.guild.default_role, send_messages=False)
+    await channel.send(f"🔒 This channel has been locked down by {locked_by}. Only staff can send messages.")
+
+async def unlock_channel(channel, unlocked_by):
+    await channel.set_permissions(channel.guild.default_role, send_messages=None)
+    await channel.send(f"🔓 This channel has been unlocked by {unlocked_by}. Members can now send messages.")
+
+async def notify_owner(message):
+    owner = bot.get_user(bot.owner_id)
+    if owner is None:
+        try:
+            owner = await bot.fetch_user(bot.owner_id)
+        except discord.HTTPException:
+            return
+    try:
+        await owner.send(message)
+    except discord.Forbidden:
+        print("Could not DM owner about raid mode. DMs might be disabled.")
+
+async def enter_raid_mode(guild):
+    monitor = raid_monitors[guild.id]
+    print(f"RAID MODE ON in {guild.name}: {monitor.raid_join_count} joins within {RAID_WINDOW_SECONDS} seconds.")
+    verify_channel = guild.get_channel(VERIFY_CHANNEL_ID)
+    if verify_channel and verify_channel.overwrites_for(guild.default_role).send_messages is not False:
+        try:
+            await lock_channel(verify_channel, "the anti-raid system")
+            raid_locked_channels[guild.id] = verify_channel.id
+        except discord.Forbidden:
+            print(f"ERROR: Bot lacks 'Manage Channels' permission to lock down #{verify_channel.name} during a raid.")
+    await notify_owner(
+        f"🚨 **Raid mode enabled in {guild.name}.** {monitor.raid_join_count} members joined within {RAID_WINDOW_SECONDS} seconds. "
+        f"Welcome DMs are paused and <#{VERIFY_CHANNEL_ID}> has been locked. Raid mode ends automatically after "
+        f"{RAID_QUIET_SECONDS // 60} quiet minutes."
+    )
+
+async def exit_raid_mode(guild):
+    monitor = raid_monitors[guild.id]
+    monitor.end()
+    print(f"RAID MODE OFF in {guild.name}.")
+    locked_channel_id = raid_locked_channels.pop(guild.id, None)
+    locked_channel = guild.get_channel(locked_channel_id) if locked_channel_id else None
+    if locked_channel:
+        try:
+            await unlock_channel(locked_channel, "the anti-raid system")
+        except discord.Forbidden:
+            print(f"ERROR: Bot lacks 'Manage Channels' permission to unlock #{locked_channel.name} after a raid.")
+    await notify_owner(f"✅ Raid mode ended in {guild.name}.")
+
+@tasks.loop(seconds=RAID_QUEUE_INTERVAL_SECONDS)
+async def process_raid_queue():
+    now = time.monotonic()
+    for guild_id, queue in list(raid_join_queues.items()):
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            queue.clear()
             continue
-        if full_notification_message:
+        for _ in range(min(RAID_QUEUE_BATCH, len(queue))):
+            member_id, role_id = queue.popleft()
+            member = guild.get_member(member_id)
+            role = guild.get_role(role_id)
+            if member is None or role is None or role in member.roles:
+                continue
             try:
-                await member.send(full_notification_message)
-                print(f"Sent conversion countdown DM to {member.display_name}.")
-            except discord.Forbidden:
-                print(f"Could not send conversion countdown DM to {member.display_name}. DMs might be disabled.")
-            except Exception as e:
-                print(f"Error sending conversion countdown DM to {member.display_name}: {e}")
-
-@notify_conversion_countdown.before_loop
-async def before_notify_conversion_countdown():
-    await bot.wait_until_ready()
-    print("Scheduled conversion countdown notification task is waiting for bot to be ready...")
+                await member.add_roles(role, reason="Queued during raid mode")
+            except discord.HTTPException as e:
+                print(f"Could not assign '{role.name}' role to queued member {member.display_name}: {e}")
+        if raid_monitors[guild_id].should_end(now) and not queue:
+            await exit_raid_mode(guild)
+
+@tasks.loop(minutes=10)
+async def compact_data_journal():
+    if data_store.needs_compaction():
+        print(f"Compacting {data_store.records_since_snapshot} journal records into {DATA_FILE}...")
+        save_data(market_data)
 
 class OpenTicketButton(discord.ui.Button):
     def __init__(self):
         super().__init__(label="Open New Ticket", style=discord.ButtonStyle.green, custom_id="open_ticket_button")
 
+    @timed(component_latency, component_errors, "open_ticket_button")
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
 
@@ -367,12 +844,16 @@ class OpenTicketButton(discord.ui.Button):
             await interaction.followup.send("Ticket system is not fully configured. Please contact the bot owner.", ephemeral=True)
             return
 
-        for ticket_id, ticket_info in market_data["tickets"].items():
-            if ticket_info["user_id"] == interaction.user.id and ticket_info["status"] == "open":
-                existing_channel = bot.get_channel(int(ticket_id))
-                if existing_channel:
-                    await interaction.followup.send(f"You already have an open ticket: {existing_channel.mention}. Please use that ticket or close it first.", ephemeral=True)
-                    return
+        ticket_id = find_open_ticket(interaction.user.id)
+        if ticket_id is not None:
+            existing_channel = bot.get_channel(int(ticket_id))
+            if existing_channel:
+                await interaction.followup.send(f"You already have an open ticket: {existing_channel.mention}. Please use that ticket or close it first.", ephemeral=True)
+                return
+            # The channel was deleted without /close, so retire the stale ticket.
+            market_data["tickets"][ticket_id]["status"] = "closed"
+            market_data["tickets"][ticket_id]["closed_at"] = discord.utils.utcnow().isoformat()
+            await archive_ticket(ticket_id)
 
         category = bot.get_channel(TICKET_CATEGORY_ID)
         if not category or not isinstance(category, discord.CategoryChannel):
@@ -399,7 +880,9 @@ class OpenTicketButton(discord.ui.Button):
                 "status": "open",
                 "created_at": discord.utils.utcnow().isoformat()
             }
-            save_data(market_data)
+            market_data["open_tickets"][str(interaction.user.id)] = str(new_channel.id)
+            save_record("tickets", str(new_channel.id))
+            save_record("open_tickets", str(interaction.user.id))
 
             ticket_embed = discord.Embed(
                 title=f"New Ticket for {interaction.user.display_name}",
@@ -433,6 +916,7 @@ class VerificationModal(ui.Modal, title='Project New Campton Verification'):
     roblox_username = ui.TextInput(label='Your Roblox Username', placeholder='e.g., RobloxPlayer123', style=discord.TextStyle.short)
     pnc_full_name = ui.TextInput(label='Project New Campton Full Name (First Last)', placeholder='e.g., John Doe', style=discord.TextStyle.short)
 
+    @timed(component_latency, component_errors, "verification_modal")
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True) 
 
@@ -455,11 +939,13 @@ class VerificationModal(ui.Modal, title='Project New Campton Verification'):
             await interaction.followup.send("You are already a Campton Citizen!", ephemeral=True)
             return
 
-        user_data = get_user_data(member.id) 
-        user_data["verification"]["roblox_username"] = str(self.roblox_username)
-        user_data["verification"]["pnc_full_name"] = str(self.pnc_full_name)
-        user_data["verification"]["verified_at"] = discord.utils.utcnow().isoformat()
-        save_data(market_data)
+        user_data = get_or_create_user_data(member.id) 
+        user_data.verification = {
+            "roblox_username": str(self.roblox_username),
+            "pnc_full_name": str(self.pnc_full_name),
+            "verified_at": discord.utils.utcnow().isoformat()
+        }
+        save_user(member.id)
 
         try:
             if new_arrival_role in member.roles:
@@ -492,6 +978,7 @@ class VerifyButton(discord.ui.Button):
     def __init__(self):
         super().__init__(label="Verify and Get Citizen Role", style=discord.ButtonStyle.primary, custom_id="verify_button")
 
+    @timed(component_latency, component_errors, "verify_button")
     async def callback(self, interaction: discord.Interaction):
         member = interaction.user
         guild = interaction.guild
@@ -522,25 +1009,102 @@ class VerifyView(discord.ui.View):
         super().__init__(timeout=None) 
         self.add_item(VerifyButton())
 
+BACKGROUND_LOOPS = [compact_data_journal, process_raid_queue]
+for background_loop in BACKGROUND_LOOPS:
+    background_loop.coro = timed(loop_latency, loop_errors, background_loop.coro.__name__)(background_loop.coro)
+
+scheduler = Scheduler(market_data["schedule"], lambda name: save_record("schedule", name), overdue_grace=SCHEDULE_OVERDUE_SECONDS)
+for job, interval, jitter in [
+    (scheduled_price_update, PRICE_UPDATE_INTERVAL_HOURS * 3600, SCHEDULE_JITTER_SECONDS),
+    (check_investor_roles, INVESTOR_ROLE_CHECK_MINUTES * 60, SCHEDULE_JITTER_SECONDS),
+    (notify_conversion_countdown, CONVERSION_COUNTDOWN_INTERVAL_HOURS * 3600, SCHEDULE_JITTER_SECONDS),
+]:
+    scheduler.add(job.__name__, timed(loop_latency, loop_errors, job.__name__)(job), interval, jitter)
+scheduler.add("auto_convert_crypto_to_cash", timed(loop_latency, loop_errors, "auto_convert_crypto_to_cash")(auto_convert_crypto_to_cash),
+              CONVERSION_INTERVAL_HOURS * 3600, due=datetime.datetime.fromisoformat(market_data["next_conversion_timestamp"]).timestamp())
+
+def loop_healthy(loop):
+    # Background loops report "failed" once an error stops them; scheduled jobs report "overdue" instead.
+    return loop["running"] and not loop.get("failed") and not loop.get("overdue")
+
+def runtime_health():
+    # Served by main.py on / and /healthz. Healthy means connected to the gateway with a measured
+    # latency, every background loop and worker task still alive, and no scheduled job overdue. A job's
+    # last error is reported but doesn't count against health; the next run may well succeed.
+    latency = bot.latency if math.isfinite(bot.latency) else None
+    loops = {
+        loop.coro.__name__: {
+            "running": loop.is_running(),
+            "failed": loop.failed(),
+            "next_run": loop.next_iteration.isoformat() if loop.next_iteration else None,
+        }
+        for loop in BACKGROUND_LOOPS
+    }
+    loops.update(scheduler.status())
+    workers = {"data_writer": data_writer.is_running(), "dm_dispatcher": dm_dispatcher.is_running()}
+    if interaction_trace is not None:
+        workers["interaction_trace"] = interaction_trace.is_running()
+    connected = bot.is_ready() and not bot.is_closed()
+    return {
+        "healthy": connected and latency is not None and all(map(loop_healthy, loops.values())) and all(workers.values()),
+        "gateway": {"connected": connected, "latency_ms": round(latency * 1000, 1) if latency is not None else None, "guilds": len(bot.guilds), "user": str(bot.user) if bot.user else None},
+        "loops": loops,
+        "workers": workers,
+        "pending_dms": dm_dispatcher.pending_count(),
+    }
+
+def command_tree_hash():
+    # What Discord stores for our commands, plus the application it is stored under.
+    payload = [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+    return hashlib.sha256(json.dumps([bot.application_id, payload], sort_keys=True).encode('utf-8')).hexdigest()
+
+async def sync_command_tree():
+    # tree.sync() is a slow, rate-limited round trip, so it only runs when the commands changed since the
+    # last successful sync. The hash of what was synced is kept in market_data.
+    tree_hash = command_tree_hash()
+    if market_data.get("command_tree_hash") == tree_hash:
+        print("Slash commands unchanged since the last sync. Skipping sync.")
+        return
+    try:
+        synced = await bot.tree.sync()
+    except discord.HTTPException as e:
+        print(f"ERROR syncing slash commands: {e}. Will retry on the next start.")
+        return
+    market_data["command_tree_hash"] = tree_hash
+    save_record("command_tree_hash")
+    print(f"Synced {len(synced)} slash commands.")
+
 @bot.event
 async def on_ready():
+    # Also fires after every gateway reconnect; one-time startup work lives in CamptonBot.setup_hook.
     print(f'{bot.user.name} has connected to Discord!')
-    bot.add_view(TicketView())
-    bot.add_view(VerifyView())
-    await bot.tree.sync()
-    print("Slash commands synced!")
-    scheduled_price_update.start()
-    check_investor_roles.start() 
-    auto_convert_crypto_to_cash.start() 
-    notify_conversion_countdown.start() 
-    print("Scheduled price update task started.")
-    print("Scheduled Market Investor role check task started.")
-    print("Scheduled auto crypto to cash conversion task started.")
-    print("Scheduled conversion countdown notification task started.")
 
 @bot.event
 async def on_member_join(member: discord.Member):
     print(f"Member joined: {member.display_name} ({member.id})")
+    now = time.monotonic()
+    monitor = get_raid_monitor(member.guild.id)
+    account_age_seconds = (discord.utils.utcnow() - member.created_at).total_seconds()
+    score, flagged = raid_signatures[member.guild.id].score(now, account_age_seconds, member.name, member.avatar.key if member.avatar else None)
+    quarantine = flagged and QUARANTINE_ROLE_ID is not None
+    if flagged:
+        print(f"Raid signature match for {member.display_name} ({member.id}), score {score}." + (" Quarantining." if quarantine else ""))
+
+    if monitor.record_join(now):
+        await enter_raid_mode(member.guild)
+    if monitor.raid_mode:
+        raid_join_queues[member.guild.id].append((member.id, QUARANTINE_ROLE_ID if quarantine else NEW_ARRIVAL_ROLE_ID))
+        return
+    if quarantine:
+        role = member.guild.get_role(QUARANTINE_ROLE_ID)
+        if role is None:
+            print(f"Warning: Quarantine role with ID {QUARANTINE_ROLE_ID} not found in guild {member.guild.name}.")
+            return
+        try:
+            await member.add_roles(role, reason=f"Raid signature score {score}")
+        except discord.Forbidden:
+            print(f"ERROR: Bot lacks permissions to assign the quarantine role to {member.display_name}.")
+        return
     if NEW_ARRIVAL_ROLE_ID:
         role = member.guild.get_role(NEW_ARRIVAL_ROLE_ID)
         if role:
@@ -568,12 +1132,16 @@ async def on_member_join(member: discord.Member):
 
 @bot.tree.command(name='prices', description='Displays the current price of Campton Coin.')
 @app_commands.check(is_bot_owner_slash)
+@timed(command_latency, command_errors, "prices")
 async def prices(interaction: discord.Interaction):
     await interaction.response.defer()
     update_prices() 
+    await match_orders()
     embed = discord.Embed(title="Current Crypto Market Prices", color=0x00ff00)
     for coin_name, data in market_data["coins"].items():
         embed.add_field(name=coin_name, value=f"{data['price']:.2f} dollars", inline=True)
+    market_cap = int(holdings_table.market_cap_cents(market_engine.prices_cents()).sum())
+    embed.set_footer(text=f"Total market cap: {format_cash(market_cap)} dollars")
     await interaction.followup.send(embed=embed)
 
 @prices.error
@@ -588,6 +1156,7 @@ async def prices_error(interaction: discord.Interaction, error: app_commands.App
 
 @bot.tree.command(name='balance', description='Shows your current balance and portfolio, or another member\'s.')
 @app_commands.describe(member='The member whose balance to view (optional).') 
+@timed(command_latency, command_errors, "balance")
 async def balance(interaction: discord.Interaction, member: discord.Member = None): 
     await interaction.response.defer(ephemeral=True) 
 
@@ -599,78 +1168,228 @@ async def balance(interaction: discord.Interaction, member: discord.Member = Non
 
     user = get_user_data(target_member.id)
     embed = discord.Embed(title=f"{target_member.display_name}'s Portfolio", color=0x0099ff)
-    embed.add_field(name="Cash Balance", value=f"{user['balance']:.2f} dollars", inline=False)
+    embed.add_field(name="Cash Balance", value=f"{format_cash(user.balance_cents)} dollars", inline=False)
 
-    if user["portfolio"]:
+    if user.portfolio:
         portfolio_str = ""
         total_value = 0
-        for coin_name, quantity in user["portfolio"].items():
+        for coin_name, holding in user.portfolio.items():
             current_price = market_data["coins"].get(coin_name, {}).get("price", 0)
-            coin_value = current_price * quantity
+            coin_value = coin_value_cents(holding.milli, price_to_cents(current_price))
             total_value += coin_value
-            portfolio_str += f"- {coin_name}: **{quantity:.3f}** units (Value: {coin_value:.2f} dollars)\n"
+            portfolio_str += f"- {coin_name}: **{format_coins(holding.milli)}** units (Value: {format_cash(coin_value)} dollars)\n"
         embed.add_field(name="Holdings", value=portfolio_str, inline=False)
     else:
         embed.add_field(name="Holdings", value="You own no cryptocurrencies." if target_member == interaction.user else f"{target_member.display_name} owns no cryptocurrencies.", inline=False)
 
     await interaction.followup.send(embed=embed)
 
+COIN_CHOICES = [app_commands.Choice(name=name, value=name) for name in CRYPTO_NAMES]
+
 @bot.tree.command(name='buy', description='Buys Campton Coin with a specified amount of cash (up to 2 decimal places for cash).')
-@app_commands.describe(amount_of_cash='The amount of cash you want to spend (e.g., 50.00).') 
-async def buy(interaction: discord.Interaction, amount_of_cash: float): 
+@app_commands.describe(amount_of_cash='The amount of cash you want to spend (e.g., 50.00).', coin='The coin to buy (defaults to Campton Coin).') 
+@app_commands.choices(coin=COIN_CHOICES)
+@timed(command_latency, command_errors, "buy")
+async def buy(interaction: discord.Interaction, amount_of_cash: float, coin: app_commands.Choice[str] = None): 
     await interaction.response.defer(ephemeral=True)
-    coin_name = CAMPTOM_COIN_NAME
+    coin_name = coin.value if coin else CAMPTOM_COIN_NAME
 
     user_data = get_user_data(interaction.user.id)
-    if user_data.get("on_buy_cooldown", False):
-        await interaction.followup.send("You cannot buy Campton Coin until after the next market price update (approximately every 3 days).", ephemeral=True)
+    if is_on_buy_cooldown(user_data):
+        await interaction.followup.send(f"You cannot buy {coin_name} until after the next market price update (approximately every 3 days).", ephemeral=True)
         return
 
     if amount_of_cash <= 0:
         await interaction.followup.send("You must spend a positive amount of cash.", ephemeral=True)
         return
 
-    s_cash = str(f"{amount_of_cash:.3f}")
-    if '.' in s_cash:
-        decimal_part_cash = s_cash.split('.')[1]
-        if len(decimal_part_cash) > 2 and amount_of_cash * 100 != int(amount_of_cash * 100):
-            await interaction.followup.send("You can only spend cash with up to 2 decimal places (e.g., 50.00).", ephemeral=True)
-            return
+    cash_cents = parse_cash(amount_of_cash)
+    if cash_cents is None:
+        await interaction.followup.send("You can only spend cash with up to 2 decimal places (e.g., 50.00).", ephemeral=True)
+        return
     
-    current_coin_price = market_data["coins"][coin_name]["price"]
-    if current_coin_price <= 0: 
-        await interaction.followup.send("Cannot buy Campton Coin right now, its price is too low or zero.", ephemeral=True)
+    current_price_cents = price_to_cents(market_data["coins"][coin_name]["price"])
+    if current_price_cents <= 0: 
+        await interaction.followup.send(f"Cannot buy {coin_name} right now, its price is too low or zero.", ephemeral=True)
         return
 
-    quantity_of_coins_to_buy = amount_of_cash / current_coin_price
-    quantity_of_coins_to_buy = math.floor(quantity_of_coins_to_buy * 1000) / 1000.0
+    milli_to_buy = coins_for_cash(cash_cents, current_price_cents)
+    if milli_to_buy <= 0:
+        await interaction.followup.send(f"{format_cash(cash_cents)} dollars is not enough to buy 0.001 {coin_name}.", ephemeral=True)
+        return
 
-    result = buy_coin(interaction.user.id, coin_name, quantity_of_coins_to_buy)
+    result = await buy_coin(interaction.user.id, coin_name, milli_to_buy)
     
     if "Successfully bought" in result:
-        await interaction.followup.send(f"Successfully spent {amount_of_cash:.2f} dollars to buy {quantity_of_coins_to_buy:.3f} {coin_name}(s). Your new cash balance is {get_user_data(interaction.user.id)['balance']:.2f} dollars.", ephemeral=True)
+        spent_cents = coin_cost_cents(milli_to_buy, current_price_cents)
+        await interaction.followup.send(f"Successfully spent {format_cash(spent_cents)} dollars to buy {format_coins(milli_to_buy)} {coin_name}(s). Your new cash balance is {format_cash(get_user_data(interaction.user.id).balance_cents)} dollars.", ephemeral=True)
     else:
         await interaction.followup.send(result, ephemeral=True)
 
 @bot.tree.command(name='sell', description='Sells a specified quantity of Campton Coin (up to 3 decimal places).')
-@app_commands.describe(quantity='The number of Campton Coins to sell (e.g., 0.123).')
-async def sell(interaction: discord.Interaction, quantity: float):
+@app_commands.describe(quantity='The number of Campton Coins to sell (e.g., 0.123).', coin='The coin to sell (defaults to Campton Coin).')
+@app_commands.choices(coin=COIN_CHOICES)
+@timed(command_latency, command_errors, "sell")
+async def sell(interaction: discord.Interaction, quantity: float, coin: app_commands.Choice[str] = None):
     await interaction.response.defer(ephemeral=True)
-    coin_name = CAMPTOM_COIN_NAME
+    coin_name = coin.value if coin else CAMPTOM_COIN_NAME
 
     if quantity <= 0:
         await interaction.followup.send("You must sell a positive amount.", ephemeral=True)
         return
 
-    if has_more_than_three_decimals(quantity):
-        await interaction.followup.send("You can only sell Campton Coin with up to 3 decimal places (e.g., 0.123).", ephemeral=True)
+    milli = parse_coins(quantity)
+    if milli is None:
+        await interaction.followup.send(f"You can only sell {coin_name} with up to 3 decimal places (e.g., 0.123).", ephemeral=True)
         return
 
-    result = sell_coin(interaction.user.id, coin_name, quantity)
+    result = await sell_coin(interaction.user.id, coin_name, milli)
     await interaction.followup.send(result, ephemeral=True)
 
+@bot.tree.command(name='order', description='Places a limit or stop order that executes on a future market price update.')
+@app_commands.describe(
+    side='Buy or sell.',
+    price='Limit: the worst price you accept. Stop: the price that triggers the order.',
+    quantity='Number of coins (up to 3 decimal places).',
+    order_type='Limit (default) or stop.',
+    coin='The coin to trade (defaults to Campton Coin).'
+)
+@app_commands.choices(
+    side=[app_commands.Choice(name='Buy', value='buy'), app_commands.Choice(name='Sell', value='sell')],
+    order_type=[app_commands.Choice(name='Limit', value='limit'), app_commands.Choice(name='Stop', value='stop')],
+    coin=COIN_CHOICES
+)
+@timed(command_latency, command_errors, "order")
+async def order(interaction: discord.Interaction, side: app_commands.Choice[str], price: float, quantity: float, order_type: app_commands.Choice[str] = None, coin: app_commands.Choice[str] = None):
+    coin_name = coin.value if coin else CAMPTOM_COIN_NAME
+    kind = order_type.value if order_type else 'limit'
+    price_cents = parse_cash(price)
+    milli = parse_coins(quantity)
+    if price_cents is None or price_cents <= 0 or milli is None or milli <= 0:
+        await interaction.response.send_message("Price must be positive with up to 2 decimal places, and quantity positive with up to 3.", ephemeral=True)
+        return
+    if len(order_book.user_orders(interaction.user.id)) >= MAX_OPEN_ORDERS_PER_USER:
+        await interaction.response.send_message(f"You already have {MAX_OPEN_ORDERS_PER_USER} open orders. Cancel one with /cancel first.", ephemeral=True)
+        return
+
+    order_id = order_book.add(interaction.user.id, coin_name, side.value, kind, price_cents, milli, int(time.time()))
+    save_record("orders", order_id)
+    market_data["next_order_id"] = order_book.next_id
+    save_record("next_order_id")
+    trigger = "at or below" if (side.value == 'buy') == (kind == 'limit') else "at or above"
+    await interaction.response.send_message(
+        f"Order #{order_id} placed: {kind} {side.value} {format_coins(milli)} {coin_name}, triggers when a price update lands {trigger} {format_cash(price_cents)} dollars. "
+        f"Funds and coins are checked when it triggers.", ephemeral=True)
+
+@bot.tree.command(name='orders', description='Lists your open limit and stop orders.')
+@timed(command_latency, command_errors, "orders")
+async def orders(interaction: discord.Interaction):
+    open_orders = order_book.user_orders(interaction.user.id)
+    if not open_orders:
+        await interaction.response.send_message("You have no open orders.", ephemeral=True)
+        return
+    lines = [
+        f"#{order_id} · {kind} {side} {format_coins(milli)} {coin_name} @ {format_cash(price_cents)} dollars (<t:{created_at}:R>)"
+        for order_id, (_, coin_name, side, kind, price_cents, milli, created_at) in open_orders
+    ]
+    embed = discord.Embed(title="Your Open Orders", description="\n".join(lines), color=0x0099ff)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name='cancel', description='Cancels one of your open orders.')
+@app_commands.describe(order_id='The order number shown by /orders.')
+@timed(command_latency, command_errors, "cancel")
+async def cancel(interaction: discord.Interaction, order_id: int):
+    row = market_data["orders"].get(str(order_id))
+    if row is None or row[0] != interaction.user.id:
+        await interaction.response.send_message(f"You have no open order #{order_id}.", ephemeral=True)
+        return
+    order_book.cancel(str(order_id))
+    delete_record("orders", str(order_id))
+    await interaction.response.send_message(f"Order #{order_id} cancelled.", ephemeral=True)
+
+@bot.tree.command(name='leaderboard', description='Shows the richest traders by net worth (cash plus coins).')
+@app_commands.describe(page=f'Page number ({LEADERBOARD_PAGE_SIZE} traders per page).')
+@timed(command_latency, command_errors, "leaderboard")
+async def leaderboard_command(interaction: discord.Interaction, page: app_commands.Range[int, 1] = 1):
+    pages = max(math.ceil(len(leaderboard) / LEADERBOARD_PAGE_SIZE), 1)
+    if page > pages:
+        await interaction.response.send_message(f"There are only {pages} page(s) on the leaderboard.", ephemeral=True)
+        return
+    rows = leaderboard.page(page, LEADERBOARD_PAGE_SIZE)
+    lines = [f"**#{rank}** <@{user_id}> · {format_cash(net_worth)} dollars" for rank, user_id, net_worth in rows]
+    embed = discord.Embed(title="📈 Market Leaderboard", description="\n".join(lines) or "Nobody is on the leaderboard yet.", color=0xffd700)
+    embed.set_footer(text=f"Page {page}/{pages} · {len(leaderboard)} traders · Net worth at current prices")
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name='rank', description='Shows your leaderboard rank, or another member\'s.')
+@app_commands.describe(member='The member whose rank to view (optional).')
+@timed(command_latency, command_errors, "rank")
+async def rank(interaction: discord.Interaction, member: discord.Member = None):
+    target_member = member or interaction.user
+    result = leaderboard.rank(target_member.id)
+    if result is None:
+        await interaction.response.send_message(f"{target_member.display_name} is not on the leaderboard yet.", ephemeral=True)
+        return
+    position, net_worth = result
+    await interaction.response.send_message(f"{target_member.display_name} is ranked **#{position}** of {len(leaderboard)} with a net worth of {format_cash(net_worth)} dollars.", ephemeral=True)
+
+LEDGER_KIND_LABELS = {
+    "opening": "Opening balance", "buy": "Bought", "sell": "Sold", "conversion": "Auto-conversion",
+    "deposit": "Funds added", "withdrawal": "Withdrawal", "transfer_in": "Received from", "transfer_out": "Sent to",
+    "recovery": "Lost in a restart",
+}
+
+def describe_ledger_entry(entry):
+    parts = []
+    if entry["cash"]:
+        parts.append(f"{'+' if entry['cash'] > 0 else ''}{format_cash(entry['cash'])} dollars")
+    for coin_name, milli in entry["coins"].items():
+        parts.append(f"{'+' if milli > 0 else ''}{format_coins(milli)} {coin_name}")
+    label = LEDGER_KIND_LABELS.get(entry["kind"], entry["kind"])
+    if "counterparty" in entry:
+        label += f" <@{entry['counterparty']}>"
+    return f"<t:{entry['ts']}:d> {label}: {', '.join(parts)} (#{entry['seq']})"
+
+@bot.tree.command(name='history', description='Shows your transaction history, newest first.')
+@app_commands.describe(page=f'Page number ({HISTORY_PAGE_SIZE} transactions per page).', member='Whose history to view. (Bot Owner Only)')
+@timed(command_latency, command_errors, "history")
+async def history(interaction: discord.Interaction, page: app_commands.Range[int, 1] = 1, member: discord.Member = None):
+    await interaction.response.defer(ephemeral=True)
+    target_member = member or interaction.user
+    if target_member.id != interaction.user.id and interaction.user.id != bot.owner_id:
+        await interaction.followup.send("You can only view your own transaction history.", ephemeral=True)
+        return
+
+    total = ledger.entry_count(target_member.id)
+    if total == 0:
+        await interaction.followup.send(f"No transactions recorded for {target_member.display_name} yet.", ephemeral=True)
+        return
+    pages = math.ceil(total / HISTORY_PAGE_SIZE)
+    if page > pages:
+        await interaction.followup.send(f"There are only {pages} page(s) of history.", ephemeral=True)
+        return
+
+    entries = await asyncio.to_thread(ledger.read_entries, ledger.page_offsets(target_member.id, page, HISTORY_PAGE_SIZE))
+    embed = discord.Embed(title=f"{target_member.display_name}'s Transactions", description="\n".join(describe_ledger_entry(entry) for entry in entries), color=0x0099ff)
+    embed.set_footer(text=f"Page {page}/{pages} · {total} transactions")
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+@bot.tree.command(name='pricehistory', description='Shows a chart of recent Campton Coin price updates.')
+@app_commands.describe(coin='The coin to chart (defaults to Campton Coin).', points='How many recent price updates to include (2-100).')
+@app_commands.choices(coin=COIN_CHOICES)
+@timed(command_latency, command_errors, "pricehistory")
+async def pricehistory(interaction: discord.Interaction, coin: app_commands.Choice[str] = None, points: app_commands.Range[int, 2, 100] = 30):
+    coin_name = coin.value if coin else CAMPTOM_COIN_NAME
+    chart = price_history.render(coin_name, points)
+    if chart is None:
+        await interaction.response.send_message(f"There is not enough price history for {coin_name} yet. Check back after the next market update.", ephemeral=True)
+        return
+    embed = discord.Embed(title=f"{coin_name} Price History", description=chart, color=0x00ff00)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @bot.tree.command(name='addfunds', description='Adds funds to a specified user\'s balance. (Bot Owner Only)')
 @app_commands.describe(member='The user to add funds to.', amount='The amount of funds to add.')
+@timed(command_latency, command_errors, "addfunds")
 async def add_funds(interaction: discord.Interaction, member: discord.Member, amount: float):
     await interaction.response.defer(ephemeral=True)
 
@@ -682,14 +1401,22 @@ async def add_funds(interaction: discord.Interaction, member: discord.Member, am
         await interaction.followup.send("Amount must be greater than 0.", ephemeral=True)
         return
 
-    user_data = get_user_data(member.id)
-    user_data["balance"] += amount
-    save_data(market_data)
+    cents = parse_cash(amount)
+    if cents is None:
+        await interaction.followup.send("Amounts can have at most 2 decimal places (e.g., 50.00).", ephemeral=True)
+        return
+
+    async with account_locks.transaction(member.id):
+        user_data = get_or_create_user_data(member.id)
+        user_data.balance_cents += cents
+        save_user(member.id)
+        ledger.record(member.id, "deposit", cash=cents, by=str(interaction.user.id))
 
-    await interaction.followup.send(f"Successfully added {amount:.2f} dollars to {member.display_name}'s balance. Their new balance is {user_data['balance']:.2f} dollars.", ephemeral=True)
+    await interaction.followup.send(f"Successfully added {format_cash(cents)} dollars to {member.display_name}'s balance. Their new balance is {format_cash(user_data.balance_cents)} dollars.", ephemeral=True)
 
 @bot.tree.command(name='withdraw', description='Requests a withdrawal of funds from your balance. Funds are deducted upon owner approval.')
 @app_commands.describe(amount='The amount of funds to request for withdrawal.')
+@timed(command_latency, command_errors, "withdraw")
 async def withdraw(interaction: discord.Interaction, amount: float):
     await interaction.response.defer(ephemeral=True)
 
@@ -697,9 +1424,14 @@ async def withdraw(interaction: discord.Interaction, amount: float):
         await interaction.followup.send("You must request a positive amount for withdrawal.", ephemeral=True)
         return
 
+    cents = parse_cash(amount)
+    if cents is None:
+        await interaction.followup.send("Amounts can have at most 2 decimal places (e.g., 50.00).", ephemeral=True)
+        return
+
     user_data = get_user_data(interaction.user.id)
-    if user_data["balance"] < amount:
-        await interaction.followup.send(f"Insufficient funds. You only have {user_data['balance']:.2f} dollars.", ephemeral=True)
+    if user_data.balance_cents < cents:
+        await interaction.followup.send(f"Insufficient funds. You only have {format_cash(user_data.balance_cents)} dollars.", ephemeral=True)
         return
 
     owner = await bot.fetch_user(bot.owner_id)
@@ -710,12 +1442,12 @@ async def withdraw(interaction: discord.Interaction, amount: float):
                 description=f"**{interaction.user.display_name}** (`{interaction.user.id}`) has requested a withdrawal.",
                 color=discord.Color.red()
             )
-            withdrawal_embed.add_field(name="Requested Amount", value=f"{amount:.2f} dollars", inline=False)
-            withdrawal_embed.add_field(name="User's Current Balance", value=f"{user_data['balance']:.2f} dollars", inline=False)
-            withdrawal_embed.set_footer(text=f"To approve, use /approvewithdrawal {interaction.user.id} {amount}")
+            withdrawal_embed.add_field(name="Requested Amount", value=f"{format_cash(cents)} dollars", inline=False)
+            withdrawal_embed.add_field(name="User's Current Balance", value=f"{format_cash(user_data.balance_cents)} dollars", inline=False)
+            withdrawal_embed.set_footer(text=f"To approve, use /approvewithdrawal {interaction.user.id} {format_cash(cents)}")
 
             await owner.send(embed=withdrawal_embed)
-            await interaction.followup.send(f"Your withdrawal request for {amount:.2f} dollars has been sent to the bot owner for approval. Your balance remains {user_data['balance']:.2f} dollars for now.", ephemeral=True)
+            await interaction.followup.send(f"Your withdrawal request for {format_cash(cents)} dollars has been sent to the bot owner for approval. Your balance remains {format_cash(user_data.balance_cents)} dollars for now.", ephemeral=True)
         except discord.Forbidden:
             print(f"Could not send DM to owner {owner.name} about withdrawal request. DMs might be disabled.")
             await interaction.followup.send("Could not send the withdrawal request to the bot owner. Please ensure the bot can DM the owner.", ephemeral=True)
@@ -724,6 +1456,7 @@ async def withdraw(interaction: discord.Interaction, amount: float):
 
 @bot.tree.command(name='approvewithdrawal', description='Approves a user\'s withdrawal request and deducts funds. (Bot Owner Only)')
 @app_commands.describe(user_id='The ID of the user whose withdrawal to approve.', amount='The Amount to deduct.')
+@timed(command_latency, command_errors, "approvewithdrawal")
 async def approve_withdrawal(interaction: discord.Interaction, user_id: str, amount: float):
     await interaction.response.defer(ephemeral=True)
 
@@ -735,6 +1468,11 @@ async def approve_withdrawal(interaction: discord.Interaction, user_id: str, amo
         await interaction.followup.send("Amount must be greater than 0.", ephemeral=True)
         return
 
+    cents = parse_cash(amount)
+    if cents is None:
+        await interaction.followup.send("Amounts can have at most 2 decimal places (e.g., 50.00).", ephemeral=True)
+        return
+
     try:
         target_user = await bot.fetch_user(int(user_id))
     except ValueError:
@@ -744,21 +1482,25 @@ async def approve_withdrawal(interaction: discord.Interaction, user_id: str, amo
         await interaction.followup.send("User not found with the provided ID.", ephemeral=True)
         return
 
-    user_data = get_user_data(target_user.id)
-
-    if user_data["balance"] < amount:
-        await interaction.followup.send(f"User {target_user.display_name} only has {user_data['balance']:.2f} dollars, which is less than the requested {amount:.2f} dollars. Cannot approve.", ephemeral=True)
+    async with account_locks.transaction(target_user.id):
+        # Re-checked under the lock: the balance may have changed since the request was made.
+        user_data = get_user_data(target_user.id)
+        approved = user_data.balance_cents >= cents
+        if approved:
+            user_data.balance_cents -= cents
+            save_user(target_user.id)
+            ledger.record(target_user.id, "withdrawal", cash=-cents, by=str(interaction.user.id))
+
+    if not approved:
+        await interaction.followup.send(f"User {target_user.display_name} only has {format_cash(user_data.balance_cents)} dollars, which is less than the requested {format_cash(cents)} dollars. Cannot approve.", ephemeral=True)
         return
 
-    user_data["balance"] -= amount
-    save_data(market_data)
-
-    await interaction.followup.send(f"Successfully approved withdrawal of {amount:.2f} dollars for {target_user.display_name}. Their new balance is {user_data['balance']:.2f} dollars.", ephemeral=True)
+    await interaction.followup.send(f"Successfully approved withdrawal of {format_cash(cents)} dollars for {target_user.display_name}. Their new balance is {format_cash(user_data.balance_cents)} dollars.", ephemeral=True)
 
     try:
         user_approved_embed = discord.Embed(
             title="✅ Withdrawal Approved! ✅",
-            description=f"Your withdrawal request for {amount:.2f} dollars has been approved by the bot owner.",
+            description=f"Your withdrawal request for {format_cash(cents)} dollars has been approved by the bot owner.",
             color=discord.Color.green()
         )
         await target_user.send(embed=user_approved_embed)
@@ -775,6 +1517,7 @@ async def approve_withdrawal(interaction: discord.Interaction, user_id: str, amo
     app_commands.Choice(name='Cash', value='cash'),
     app_commands.Choice(name='Campton Coin', value='campton_coin')
 ])
+@timed(command_latency, command_errors, "transfer")
 async def transfer(interaction: discord.Interaction, recipient: discord.Member, amount: float, currency_type: app_commands.Choice[str]):
     await interaction.response.defer(ephemeral=True)
 
@@ -782,49 +1525,65 @@ async def transfer(interaction: discord.Interaction, recipient: discord.Member,
         await interaction.followup.send("You must transfer a positive amount.", ephemeral=True)
         return
 
-    if currency_type.value == 'campton_coin' and has_more_than_three_decimals(amount):
-        await interaction.followup.send("You can only transfer Campton Coin with up to 3 decimal places (e.g., 0.123).", ephemeral=True)
-        return
+    if currency_type.value == 'campton_coin':
+        units = parse_coins(amount)
+        if units is None:
+            await interaction.followup.send("You can only transfer Campton Coin with up to 3 decimal places (e.g., 0.123).", ephemeral=True)
+            return
+    else:
+        units = parse_cash(amount)
+        if units is None:
+            await interaction.followup.send("You can only transfer cash with up to 2 decimal places (e.g., 50.00).", ephemeral=True)
+            return
 
     if interaction.user.id == recipient.id:
         await interaction.followup.send("You cannot transfer to yourself.", ephemeral=True)
         return
 
-    sender_data = get_user_data(interaction.user.id)
-    recipient_data = get_user_data(recipient.id)
-    currency_value = currency_type.value
-    currency_name = currency_type.name
-
-    transfer_successful = False
-    feedback_message = ""
-    recipient_dm_message = ""
-
-    if currency_value == 'cash':
-        if sender_data["balance"] < amount:
-            feedback_message = f"Insufficient funds. You only have {sender_data['balance']:.2f} dollars."
-        else:
-            sender_data["balance"] -= amount
-            recipient_data["balance"] += amount
-            transfer_successful = True
-            feedback_message = f"Successfully transferred {amount:.2f} dollars to {recipient.display_name}. Your new balance is {sender_data['balance']:.2f} dollars."
-            recipient_dm_message = f"You received {amount:.2f} dollars from {interaction.user.display_name}. Your new balance is {recipient_data['balance']:.2f} dollars."
-    elif currency_value == 'campton_coin':
-        coin_name = CAMPTOM_COIN_NAME
-        if coin_name not in sender_data["portfolio"] or sender_data["portfolio"][coin_name] < amount:
-            feedback_message = f"Insufficient Campton Coins. You only have {sender_data['portfolio'].get(coin_name, 0.0):.3f} {coin_name}(s)."
+    async with account_locks.transaction(interaction.user.id, recipient.id):
+        sender_data = get_user_data(interaction.user.id)
+        currency_value = currency_type.value
+        currency_name = currency_type.name
+
+        transfer_successful = False
+        feedback_message = ""
+        recipient_dm_message = ""
+
+        if currency_value == 'cash':
+            if sender_data.balance_cents < units:
+                feedback_message = f"Insufficient funds. You only have {format_cash(sender_data.balance_cents)} dollars."
+            else:
+                recipient_data = get_or_create_user_data(recipient.id)
+                sender_data.balance_cents -= units
+                recipient_data.balance_cents += units
+                transfer_successful = True
+                feedback_message = f"Successfully transferred {format_cash(units)} dollars to {recipient.display_name}. Your new balance is {format_cash(sender_data.balance_cents)} dollars."
+                recipient_dm_message = f"You received {format_cash(units)} dollars from {interaction.user.display_name}. Your new balance is {format_cash(recipient_data.balance_cents)} dollars."
+        elif currency_value == 'campton_coin':
+            coin_name = CAMPTOM_COIN_NAME
+            if sender_data.quantity(coin_name) < units:
+                feedback_message = f"Insufficient Campton Coins. You only have {format_coins(sender_data.quantity(coin_name))} {coin_name}(s)."
+            else:
+                recipient_data = get_or_create_user_data(recipient.id)
+                sender_data.add_quantity(coin_name, -units)
+                recipient_data.add_quantity(coin_name, units)
+                transfer_successful = True
+                feedback_message = f"Successfully transferred {format_coins(units)} {coin_name}(s) to {recipient.display_name}. You now have {format_coins(sender_data.quantity(coin_name))} {coin_name}(s)."
+                recipient_dm_message = f"You received {format_coins(units)} {coin_name}(s) from {interaction.user.display_name}. You now have {format_coins(recipient_data.quantity(coin_name))} {coin_name}(s)."
         else:
-            sender_data["portfolio"][coin_name] -= amount
-            recipient_data["portfolio"][coin_name] = recipient_data["portfolio"].get(coin_name, 0.0) + amount
-            if sender_data["portfolio"][coin_name] <= 0.0001:
-                del sender_data["portfolio"][coin_name]
-            transfer_successful = True
-            feedback_message = f"Successfully transferred {amount:.3f} {coin_name}(s) to {recipient.display_name}. You now have {sender_data['portfolio'].get(coin_name, 0.0):.3f} {coin_name}(s)."
-            recipient_dm_message = f"You received {amount:.3f} {coin_name}(s) from {interaction.user.display_name}. You now have {recipient_data['portfolio'].get(coin_name, 0.0):.3f} {coin_name}(s)."
-    else:
-        feedback_message = "Invalid currency type specified."
+            feedback_message = "Invalid currency type specified."
+
+        if transfer_successful:
+            save_user(interaction.user.id)
+            save_user(recipient.id)
+            if currency_value == 'cash':
+                ledger.record(interaction.user.id, "transfer_out", cash=-units, counterparty=str(recipient.id))
+                ledger.record(recipient.id, "transfer_in", cash=units, counterparty=str(interaction.user.id))
+            else:
+                ledger.record(interaction.user.id, "transfer_out", coins={CAMPTOM_COIN_NAME: -units}, counterparty=str(recipient.id))
+                ledger.record(recipient.id, "transfer_in", coins={CAMPTOM_COIN_NAME: units}, counterparty=str(interaction.user.id))
 
     if transfer_successful:
-        save_data(market_data)
         await interaction.followup.send(feedback_message, ephemeral=True)
         if recipient_dm_message:
             try:
@@ -842,6 +1601,7 @@ async def transfer(interaction: discord.Interaction, recipient: discord.Member,
 
 @bot.tree.command(name='sendticketbutton', description='(Owner Only) Sends the "Open Ticket" button to the current channel.')
 @app_commands.check(is_bot_owner_slash)
+@timed(command_latency, command_errors, "sendticketbutton")
 async def send_ticket_button(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
     
@@ -868,6 +1628,7 @@ async def send_ticket_button_error(interaction: discord.Interaction, error: app_
 
 @bot.tree.command(name='sendverifybutton', description='(Owner Only) Sends the "Verify" button to the current channel.')
 @app_commands.check(is_bot_owner_slash)
+@timed(command_latency, command_errors, "sendverifybutton")
 async def send_verify_button(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
 
@@ -893,6 +1654,7 @@ async def send_verify_button_error(interaction: discord.Interaction, error: app_
             await interaction.response.send_message(f"An unexpected error occurred: {error}", ephemeral=True)
 
 @bot.tree.command(name='close', description='Close the current support ticket. (Can only be used in a ticket channel)')
+@timed(command_latency, command_errors, "close")
 async def close(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
 
@@ -913,6 +1675,7 @@ async def close(interaction: discord.Interaction):
     confirm_view = discord.ui.View(timeout=300)
     confirm_button = discord.ui.Button(label="Confirm Close", style=discord.ButtonStyle.red)
 
+    @timed(component_latency, component_errors, "close_ticket_confirm")
     async def confirm_callback(button_interaction: discord.Interaction):
         await button_interaction.response.defer(ephemeral=True)
 
@@ -922,7 +1685,7 @@ async def close(interaction: discord.Interaction):
 
         ticket_info["status"] = "closed"
         ticket_info["closed_at"] = discord.utils.utcnow().isoformat()
-        save_data(market_data)
+        await archive_ticket(str(interaction.channel.id))
 
         await interaction.channel.send("Ticket closed. This channel will be deleted shortly.")
         
@@ -948,6 +1711,7 @@ async def close(interaction: discord.Interaction):
 @bot.tree.command(name='clearmessages', description='(Owner Only) Clears a specified number of messages from the current channel.')
 @app_commands.describe(amount='The number of messages to clear (1-100).')
 @app_commands.check(is_bot_owner_slash)
+@timed(command_latency, command_errors, "clearmessages")
 async def clearmessages(interaction: discord.Interaction, amount: int):
     await interaction.response.defer(ephemeral=True)
 
@@ -986,6 +1750,7 @@ async def clearmessages_error(interaction: discord.Interaction, error: app_comma
 @bot.tree.command(name='lockdown', description='(Owner Only) Locks down the current channel or a specified channel.')
 @app_commands.describe(channel='The channel to lock down (defaults to current channel).')
 @app_commands.check(is_bot_owner_slash)
+@timed(command_latency, command_errors, "lockdown")
 async def lockdown(interaction: discord.Interaction, channel: discord.TextChannel = None):
     await interaction.response.defer(ephemeral=True)
     target_channel = channel or interaction.channel
@@ -996,8 +1761,7 @@ async def lockdown(interaction: discord.Interaction, channel: discord.TextChanne
         return
 
     try:
-        await target_channel.set_permissions(interaction.guild.default_role, send_messages=False)
-        await target_channel.send(f"🔒 This channel has been locked down by {interaction.user.mention}. Only staff can send messages.")
+        await lock_channel(target_channel, interaction.user.mention)
         await interaction.followup.send(f"Successfully locked down {target_channel.mention}.", ephemeral=True)
         print(f"Locked down #{target_channel.name} by {interaction.user.display_name}.")
     except discord.Forbidden:
@@ -1025,6 +1789,7 @@ async def lockdown_error(interaction: discord.Interaction, error: app_commands.A
 @bot.tree.command(name='unlock', description='(Owner Only) Unlocks the current channel or a specified channel.')
 @app_commands.describe(channel='The channel to unlock (defaults to current channel).')
 @app_commands.check(is_bot_owner_slash)
+@timed(command_latency, command_errors, "unlock")
 async def unlock(interaction: discord.Interaction, channel: discord.TextChannel = None):
     await interaction.response.defer(ephemeral=True)
     target_channel = channel or interaction.channel
@@ -1035,8 +1800,9 @@ async def unlock(interaction: discord.Interaction, channel: discord.TextChannel
         return
 
     try:
-        await target_channel.set_permissions(interaction.guild.default_role, send_messages=None)
-        await target_channel.send(f"🔓 This channel has been unlocked by {interaction.user.mention}. Members can now send messages.")
+        await unlock_channel(target_channel, interaction.user.mention)
+        if raid_locked_channels.get(interaction.guild.id) == target_channel.id:
+            del raid_locked_channels[interaction.guild.id]
         await interaction.followup.send(f"Successfully unlocked {target_channel.mention}.", ephemeral=True)
         print(f"Unlocked #{target_channel.name} by {interaction.user.display_name}.")
     except discord.Forbidden:
@@ -1063,6 +1829,7 @@ async def unlock_error(interaction: discord.Interaction, error: app_commands.App
 
 @bot.tree.command(name='manualconvert', description='(Owner Only) Manually triggers the crypto to cash conversion for all users.')
 @app_commands.check(is_bot_owner_slash)
+@timed(command_latency, command_errors, "manualconvert")
 async def manual_convert(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
     print(f"Manual crypto to cash conversion triggered by {interaction.user.display_name} ({interaction.user.id}).")
@@ -1081,6 +1848,7 @@ async def manual_convert_error(interaction: discord.Interaction, error: app_comm
         else:
             await interaction.response.send_message(f"An unexpected error occurred: {error}", ephemeral=True)
 
-# This bot.py file is designed to be run via main.py, which starts the bot.
-# The `if __name__ == '__main__':` block is removed as main.py handles execution.
-bot.run(TOKEN)
+# main.py imports this module and runs the bot next to its status web server; `python bot.py` runs the bot alone.
+if __name__ == '__main__':
+    bot.run(TOKEN)
+    data_writer.flush_sync()
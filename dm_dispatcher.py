@@ -0,0 +1,160 @@
+# Outbound DM queue shared by every mass-DM feature (conversion reminders, conversion notices).
+# Jobs are stored in market_data so a restart picks up where the last run stopped, recipients are
+# messaged a few at a time behind a global token bucket, and throughput is tracked per job.
+import asyncio
+import time
+
+import discord
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        # Pushes the next token `seconds` into the future, e.g. after a 429.
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class DMDispatcher:
+    # jobs:     {job_id: {"kind", "created_at", "content", "recipients": [[user_id, content or None], ...]}}
+    # progress: {job_id: number of recipients already handled}
+    # The recipient list is written once; only the small progress counter is saved per batch.
+    def __init__(self, jobs, progress, save_record, delete_record, resolve_user, rate_per_second, concurrency, rate_limit_backoff, max_attempts=3):
+        self.jobs = jobs
+        self.progress = progress
+        self.save_record = save_record
+        self.delete_record = delete_record
+        self.resolve_user = resolve_user
+        self.concurrency = concurrency
+        self.rate_limit_backoff = rate_limit_backoff
+        self.max_attempts = max_attempts  # a job that errors this many times is dropped
+        self.bucket = TokenBucket(rate_per_second, concurrency)
+        self.stats = {"sent": 0, "forbidden": 0, "failed": 0, "rate_limited": 0, "jobs_completed": 0}
+        self._failures = {}  # job_id -> errors so far
+        self._wakeup = None
+        self._task = None
+
+    def enqueue(self, kind, recipients, content=None, replace_pending=False):
+        # recipients: iterable of user IDs (sent `content`) or (user_id, content) pairs.
+        if replace_pending:
+            for job_id in [job_id for job_id, job in self.jobs.items() if job["kind"] == kind]:
+                print(f"Dropping unfinished DM job {job_id}; superseded by a newer {kind} job.")
+                self._finish(job_id)
+        rows = [[r, None] if isinstance(r, int) else [r[0], r[1]] for r in recipients]
+        if not rows:
+            return None
+        job_id = f"{kind}-{time.time_ns()}"
+        self.jobs[job_id] = {"kind": kind, "created_at": time.time(), "content": content, "recipients": rows}
+        self.progress[job_id] = 0
+        self.save_record("dm_jobs", job_id)
+        self.save_record("dm_progress", job_id)
+        print(f"Queued DM job {job_id} for {len(rows)} recipients.")
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    def pending_count(self):
+        return sum(len(job["recipients"]) - self.progress.get(job_id, 0) for job_id, job in self.jobs.items())
+
+    def _finish(self, job_id):
+        del self.jobs[job_id]
+        self._failures.pop(job_id, None)
+        self.progress.pop(job_id, None)
+        self.delete_record("dm_jobs", job_id)
+        self.delete_record("dm_progress", job_id)
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.is_running():
+            return
+        self._wakeup = asyncio.Event()
+        if self.jobs:
+            print(f"Resuming {len(self.jobs)} unfinished DM job(s), {self.pending_count()} DMs left.")
+            self._wakeup.set()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self.jobs:
+                job_id = min(self.jobs, key=lambda j: self.jobs[j]["created_at"])
+                try:
+                    await self._run_job(job_id)
+                except Exception as e:
+                    failures = self._failures[job_id] = self._failures.get(job_id, 0) + 1
+                    if failures >= self.max_attempts:
+                        if job_id in self.jobs:
+                            left = len(self.jobs[job_id]["recipients"]) - self.progress.get(job_id, 0)
+                            print(f"ERROR in DM job {job_id}: {e}. Giving up after {failures} attempts; {left} DMs were not sent.")
+                            self._finish(job_id)
+                        continue
+                    print(f"ERROR in DM job {job_id}: {e}. Retrying in {self.rate_limit_backoff} seconds.")
+                    await asyncio.sleep(self.rate_limit_backoff)
+
+    async def _run_job(self, job_id):
+        job = self.jobs[job_id]
+        recipients = job["recipients"]
+        started_at = time.monotonic()
+        sent_before = self.stats["sent"]
+        while job_id in self.jobs and self.progress[job_id] < len(recipients):
+            offset = self.progress[job_id]
+            batch = recipients[offset:offset + self.concurrency]
+            await asyncio.gather(*(self._send(user_id, content or job["content"]) for user_id, content in batch))
+            if job_id not in self.jobs:
+                return  # Replaced while this batch was in flight.
+            self.progress[job_id] = offset + len(batch)
+            self.save_record("dm_progress", job_id)
+        if job_id not in self.jobs:
+            return
+        elapsed = time.monotonic() - started_at
+        sent = self.stats["sent"] - sent_before
+        rate = sent / elapsed if elapsed > 0 else 0.0
+        print(f"DM job {job_id} complete: {sent}/{len(recipients)} delivered in {elapsed:.1f}s ({rate:.2f} DMs/s).")
+        self.stats["jobs_completed"] += 1
+        self._finish(job_id)
+
+    async def _send(self, user_id, content):
+        # Every failure is counted here rather than raised, so one bad recipient can't fail the whole batch
+        # (and have the job retried, re-sending to the recipients that already got their DM).
+        try:
+            user = await self.resolve_user(user_id)
+        except discord.HTTPException as e:
+            print(f"Error looking up DM recipient {user_id}: {e}")
+            user = None
+        if user is None:
+            self.stats["failed"] += 1
+            return
+        for attempt in range(2):
+            await self.bucket.acquire()
+            try:
+                await user.send(content)
+                self.stats["sent"] += 1
+                return
+            except discord.Forbidden:
+                self.stats["forbidden"] += 1
+                return
+            except discord.HTTPException as e:
+                if e.status == 429 and attempt == 0:
+                    self.stats["rate_limited"] += 1
+                    self.bucket.pause(self.rate_limit_backoff)
+                    continue
+                self.stats["failed"] += 1
+                print(f"Error sending DM to {user_id}: {e}")
+                return
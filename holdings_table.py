@@ -0,0 +1,99 @@
+# Columnar mirror of every account's cash and coin holdings.
+# market_data["users"] stays the source of truth; this table copies balance_cents and holdings_milli
+# into NumPy arrays (one row per user, one column per listed coin) whenever save_user() runs, so bulk
+# jobs like the weekly conversion, market cap and net worth are single array operations.
+import numpy as np
+
+from money import MILLI_PER_COIN
+
+
+class HoldingsTable:
+    def __init__(self, coin_names, initial_capacity=64):
+        self.coin_names = list(coin_names)
+        self.coin_index = {name: i for i, name in enumerate(self.coin_names)}
+        self.user_ids = []  # row -> user ID string
+        self.rows = {}  # user ID string -> row
+        self.balances = np.zeros(initial_capacity, dtype=np.int64)
+        self.holdings = np.zeros((initial_capacity, len(self.coin_names)), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def _grow(self):
+        capacity = len(self.balances) * 2
+        self.balances = np.resize(self.balances, capacity)
+        self.balances[len(self.user_ids):] = 0
+        holdings = np.zeros((capacity, len(self.coin_names)), dtype=np.int64)
+        holdings[:len(self.user_ids)] = self.holdings[:len(self.user_ids)]
+        self.holdings = holdings
+
+    def update(self, user_id, balance_cents, holdings_milli):
+        # holdings_milli: {coin: milli-coins}. Coins that are no longer listed are ignored.
+        row = self.rows.get(user_id)
+        if row is None:
+            if len(self.user_ids) == len(self.balances):
+                self._grow()
+            row = len(self.user_ids)
+            self.rows[user_id] = row
+            self.user_ids.append(user_id)
+        self.balances[row] = balance_cents
+        self.holdings[row] = 0
+        for coin, milli in holdings_milli.items():
+            column = self.coin_index.get(coin)
+            if column is not None:
+                self.holdings[row, column] = milli
+
+    def sync_account(self, user_id, account):
+        self.update(user_id, account.balance_cents, {coin: holding.milli for coin, holding in account.portfolio.items()})
+
+    def remove(self, user_id):
+        # Moves the last row into the gap so rows stay dense.
+        row = self.rows.pop(user_id, None)
+        if row is None:
+            return
+        last = len(self.user_ids) - 1
+        if row != last:
+            moved = self.user_ids[last]
+            self.user_ids[row] = moved
+            self.rows[moved] = row
+            self.balances[row] = self.balances[last]
+            self.holdings[row] = self.holdings[last]
+        self.user_ids.pop()
+        self.balances[last] = 0
+        self.holdings[last] = 0
+
+    def load(self, rows):
+        # rows: iterable of (user_id, balance_cents, holdings_milli).
+        for user_id, balance_cents, holdings_milli in rows:
+            self.update(user_id, balance_cents, holdings_milli)
+
+    def holder_rows(self, coin):
+        return np.flatnonzero(self.holdings[:len(self.user_ids), self.coin_index[coin]] > 0)
+
+    def rows_at_least(self, balance_cents, coin, milli):
+        # Rows with at least balance_cents cash or at least `milli` of `coin`.
+        count = len(self.user_ids)
+        return np.flatnonzero((self.balances[:count] >= balance_cents) | (self.holdings[:count, self.coin_index[coin]] >= milli))
+
+    def convert_to_cash(self, coin, rows, price_cents):
+        # Sells `coin` for the given rows at price_cents, rounding each sale down to the cent like
+        # money.coin_value_cents. Returns the milli-coins sold and cents credited, aligned with rows.
+        column = self.coin_index[coin]
+        milli = self.holdings[rows, column].copy()
+        proceeds = milli * price_cents // MILLI_PER_COIN
+        self.balances[rows] += proceeds
+        self.holdings[rows, column] = 0
+        return milli, proceeds
+
+    def net_worth_of(self, user_id, prices_cents):
+        row = self.rows[user_id]
+        return int(self.balances[row] + (self.holdings[row] * prices_cents // MILLI_PER_COIN).sum())
+
+    def market_cap_cents(self, prices_cents):
+        # Per-coin value of everything held, aligned with coin_names.
+        return self.holdings[:len(self.user_ids)].sum(axis=0) * prices_cents // MILLI_PER_COIN
+
+    def net_worth_cents(self, prices_cents):
+        # Cash plus holdings for every row, each holding valued like money.coin_value_cents.
+        count = len(self.user_ids)
+        return self.balances[:count] + (self.holdings[:count] * prices_cents // MILLI_PER_COIN).sum(axis=1)
@@ -0,0 +1,79 @@
+# Optional recording of every slash command, button and modal interaction, so real load can be replayed
+# offline with `python -m benchmarks.replay`. One JSON line per interaction:
+#   {"ts": unix time, "type": "application_command" | "component" | "modal_submit",
+#    "user": id, "roles": [role ids], "guild": id, "channel": id, "data": Discord's interaction data}
+# "data" carries the command name and option values, the component custom_id or the submitted modal fields
+# (so verification answers end up in the trace). Resolved user/channel objects are left out.
+# record() only appends to a list; a background task writes the list out every flush_interval seconds.
+import asyncio
+import json
+import time
+
+from storage import append_jsonl
+
+RECORDED_TYPES = ("application_command", "component", "modal_submit")
+
+
+class InteractionTrace:
+    def __init__(self, path, flush_interval=5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self._pending = []
+        self._io_lock = None
+        self._task = None
+
+    def record(self, interaction):
+        kind = interaction.type.name
+        if kind not in RECORDED_TYPES:
+            return
+        data = interaction.data or {}
+        self._pending.append({
+            "ts": round(time.time(), 3),
+            "type": kind,
+            "user": interaction.user.id,
+            "roles": [role.id for role in getattr(interaction.user, 'roles', ()) if not role.is_default()],
+            "guild": interaction.guild_id,
+            "channel": interaction.channel_id,
+            "data": {key: value for key, value in data.items() if key != "resolved"},
+        })
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.is_running():
+            self._io_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            async with self._io_lock:
+                batch, self._pending = self._pending, []
+                try:
+                    await asyncio.to_thread(append_jsonl, self.path, batch)
+                    self.recorded += len(batch)
+                except Exception as e:
+                    print(f"ERROR writing interaction trace {self.path}: {e}. Dropped {len(batch)} interactions.")
+
+    async def stop(self):
+        if self._task is not None:
+            # Taking the lock first guarantees the task is not halfway through a write.
+            async with self._io_lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        batch, self._pending = self._pending, []
+        append_jsonl(self.path, batch)
+        self.recorded += len(batch)
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
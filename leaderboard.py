@@ -0,0 +1,48 @@
+# Net-worth ranking kept sorted as accounts change.
+# Entries are (-net_worth_cents, user_id) in a SortedList, so a rank lookup is a bisect and a page is a
+# slice, both O(log n) rather than a sort of every account. save_user() updates one entry; a price tick
+# rebuilds the list from the vectorized net worths in HoldingsTable.
+from sortedcontainers import SortedList
+
+
+class Leaderboard:
+    def __init__(self):
+        self._entries = SortedList()
+        self._keys = {}  # user ID int -> its entry in _entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update(self, user_id, net_worth_cents):
+        # Accounts worth nothing are left off the board.
+        user_id = int(user_id)
+        old = self._keys.pop(user_id, None)
+        if old is not None:
+            self._entries.remove(old)
+        if net_worth_cents > 0:
+            key = (-net_worth_cents, user_id)
+            self._entries.add(key)
+            self._keys[user_id] = key
+
+    def remove(self, user_id):
+        self.update(user_id, 0)
+
+    def rebuild(self, net_worths):
+        # net_worths: iterable of (user_id, net_worth_cents).
+        self._keys = {int(user_id): (-net_worth, int(user_id)) for user_id, net_worth in net_worths if net_worth > 0}
+        self._entries = SortedList(self._keys.values())
+
+    def rank(self, user_id):
+        # 1-based rank and net worth, or None if the user is not on the board.
+        key = self._keys.get(int(user_id))
+        if key is None:
+            return None
+        return self._entries.index(key) + 1, -key[0]
+
+    def page(self, page, page_size):
+        # [(rank, user_id, net_worth_cents), ...] for a 1-based page.
+        start = (page - 1) * page_size
+        return [
+            (start + i + 1, user_id, -negative_worth)
+            for i, (negative_worth, user_id) in enumerate(self._entries.islice(start, start + page_size))
+        ]
@@ -0,0 +1,272 @@
+# Append-only transaction ledger.
+# Every balance or holdings change is written to ledger.jsonl as one line per affected user. Each line
+# carries the hash of the previous one, so editing or removing a past entry breaks the chain. A side
+# file of (user_id, byte offset) pairs lets /history seek straight to one user's entries.
+#
+# Entries are written as each change happens, the market data a moment later by storage.AsyncWriter, so a
+# crash can leave the ledger ahead of the data. Every data batch saves the ledger's last seq as "ledger_seq";
+# entries after it may not have reached the data. On its next start the bot records a "recovery" entry for
+# each user whose data lost changes, so the ledger matches the data again.
+#
+# Offline check: python ledger.py verify [ledger.jsonl] [--compare stock_market_data.json|stock_market_data.db]
+# Users whose data matches the ledger a few entries back, all after ledger_seq, are reported as behind the
+# ledger, not as mismatches.
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+from money import format_cash
+
+GENESIS_HASH = "0" * 64
+INDEX_DTYPE = np.dtype([("user_id", "<u8"), ("offset", "<u8")])
+
+
+def entry_hash(prev_hash, body):
+    payload = json.dumps(body, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256((prev_hash + payload).encode('utf-8')).hexdigest()
+
+
+class Ledger:
+    def __init__(self, path, index_path):
+        self.path = path
+        self.index_path = index_path
+        self.offsets = {}  # user ID int -> list of byte offsets, oldest first
+        self.last_seq = 0
+        self.last_hash = GENESIS_HASH
+        self.size = 0
+        self._load()
+        self._file = open(path, 'ab')
+        self._index_file = open(index_path, 'ab')
+
+    def _load(self):
+        if os.path.exists(self.index_path):
+            size = os.path.getsize(self.index_path)
+            if size % INDEX_DTYPE.itemsize:
+                with open(self.index_path, 'r+b') as f:
+                    f.truncate(size - size % INDEX_DTYPE.itemsize)
+            index = np.fromfile(self.index_path, dtype=INDEX_DTYPE)
+            order = np.argsort(index["user_id"], kind='stable')
+            users, starts = np.unique(index["user_id"][order], return_index=True)
+            for user_id, offsets in zip(users.tolist(), np.split(index["offset"][order], starts[1:])):
+                self.offsets[user_id] = offsets.tolist()
+            indexed_through = int(index["offset"].max()) if len(index) else -1
+        else:
+            indexed_through = -1
+        if not os.path.exists(self.path):
+            return
+
+        # Find the last complete line, drop a torn one, and index anything the index file missed
+        # (the ledger line is written before its index record, so the index can only lag behind).
+        missing = []
+        with open(self.path, 'rb') as f:
+            offset = 0
+            last_line = None
+            for line in f:
+                if not line.endswith(b'\n'):
+                    print(f"WARNING: {self.path} ends with a partial entry; truncating {len(line)} bytes.")
+                    break
+                if offset > indexed_through:
+                    missing.append((offset, line))
+                last_line = line
+                offset += len(line)
+        if offset != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+        self.size = offset
+        if last_line is not None:
+            entry = json.loads(last_line)
+            self.last_seq = entry["seq"]
+            self.last_hash = entry["hash"]
+        if missing:
+            records = np.array([(int(json.loads(line)["user"]), line_offset) for line_offset, line in missing], dtype=INDEX_DTYPE)
+            with open(self.index_path, 'ab') as f:
+                f.write(records.tobytes())
+            for user_id, line_offset in records.tolist():
+                self.offsets.setdefault(user_id, []).append(line_offset)
+            print(f"Re-indexed {len(missing)} ledger entries missing from {self.index_path}.")
+
+    def is_empty(self):
+        return self.last_seq == 0
+
+    def record(self, user_id, kind, cash=0, coins=None, timestamp=None, **details):
+        # cash: change in cents; coins: {coin: change in milli-coins}. Extra keyword arguments
+        # (price, counterparty, ...) are stored with the entry.
+        body = {
+            "seq": self.last_seq + 1,
+            "ts": int(timestamp if timestamp is not None else time.time()),
+            "user": str(user_id),
+            "kind": kind,
+            "cash": cash,
+            "coins": coins or {},
+            "prev": self.last_hash,
+        }
+        body.update(details)
+        body["hash"] = entry_hash(self.last_hash, body)
+        line = (json.dumps(body, separators=(',', ':')) + '\n').encode('utf-8')
+        # Written through to the OS right away; fsync happens on close(). Losing the last few entries
+        # needs a power cut, not just a crash of the bot.
+        self._file.write(line)
+        self._file.flush()
+        self._index_file.write(np.array([(int(user_id), self.size)], dtype=INDEX_DTYPE).tobytes())
+        self._index_file.flush()
+        self.offsets.setdefault(int(user_id), []).append(self.size)
+        self.size += len(line)
+        self.last_seq = body["seq"]
+        self.last_hash = body["hash"]
+        return body
+
+    def entry_count(self, user_id):
+        return len(self.offsets.get(int(user_id), ()))
+
+    def page_offsets(self, user_id, page, page_size):
+        # Offsets for one page, newest entries first. page starts at 1.
+        offsets = self.offsets.get(int(user_id), [])
+        end = len(offsets) - (page - 1) * page_size
+        return offsets[max(end - page_size, 0):max(end, 0)][::-1]
+
+    def read_entries(self, offsets):
+        # Blocking file reads; run in a worker thread.
+        entries = []
+        with open(self.path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                entries.append(json.loads(f.readline()))
+        return entries
+
+    def close(self):
+        for f in (self._file, self._index_file):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+
+
+def verify(path):
+    # One streaming pass: checks sequence numbers and the hash chain, and replays every entry.
+    # Returns (errors, balances) where balances is {user_id: {"cash": cents, "coins": {coin: milli}}}.
+    errors = []
+    balances = {}
+    prev_hash = GENESIS_HASH
+    expected_seq = 1
+    with open(path, 'rb') as f:
+        for line_number, line in enumerate(f, 1):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                errors.append(f"line {line_number}: not valid JSON")
+                break
+            stored_hash = entry.pop("hash", None)
+            if entry.get("seq") != expected_seq:
+                errors.append(f"line {line_number}: expected seq {expected_seq}, found {entry.get('seq')}")
+            if entry.get("prev") != prev_hash or entry_hash(prev_hash, entry) != stored_hash:
+                errors.append(f"line {line_number}: hash chain broken (seq {entry.get('seq')})")
+            prev_hash = stored_hash
+            expected_seq = entry.get("seq", expected_seq) + 1
+            account = balances.setdefault(entry["user"], {"cash": 0, "coins": {}})
+            account["cash"] += entry["cash"]
+            for coin, milli in entry["coins"].items():
+                account["coins"][coin] = account["coins"].get(coin, 0) + milli
+    return errors, balances
+
+
+def tail_states(path, through_seq):
+    # One pass over the ledger. Returns (balances, states): balances as from verify(), and for every user
+    # with entries after through_seq, their (cash, coins) after their last entry up to it and after each
+    # later one, oldest first.
+    balances = {}
+    states = {}
+    with open(path, 'rb') as f:
+        for line in f:
+            entry = json.loads(line)
+            account = balances.setdefault(entry["user"], {"cash": 0, "coins": {}})
+            if entry["seq"] > through_seq and entry["user"] not in states:
+                states[entry["user"]] = [money_state(account)]
+            account["cash"] += entry["cash"]
+            for coin, milli in entry["coins"].items():
+                account["coins"][coin] = account["coins"].get(coin, 0) + milli
+            if entry["user"] in states:
+                states[entry["user"]].append(money_state(account))
+    return balances, states
+
+
+def money_state(account):
+    return account["cash"], {coin: milli for coin, milli in account["coins"].items() if milli}
+
+
+def _stored_accounts(data_path):
+    # {user_id: (cash, coins)} and the saved ledger_seq (None if the data predates it), from the JSON data
+    # file (snapshot + journal) or the SQLite database.
+    if data_path.endswith('.db'):
+        from sqlite_store import SqliteStore
+        if not os.path.exists(data_path):
+            raise FileNotFoundError(data_path)
+        store = SqliteStore(data_path)
+        accounts = {user_id: (cash, {coin: milli for coin, milli in holdings.items() if milli}) for user_id, cash, holdings in store.iter_money_rows()}
+        through_seq = store.load({}).get("ledger_seq")
+        store.close()
+        return accounts, through_seq
+    from models import UserAccount
+    from storage import JournalStore
+    data = JournalStore(data_path, os.path.splitext(data_path)[0] + '.journal').load({})
+    accounts = {}
+    for user_id, record in data.get("users", {}).items():
+        account = UserAccount.from_dict(record)
+        accounts[user_id] = (account.balance_cents, {coin: h.milli for coin, h in account.portfolio.items()})
+    return accounts, data.get("ledger_seq")
+
+
+def _compare(ledger_path, data_path):
+    # Compares the replayed ledger with the stored accounts. Returns (mismatches, behind): users whose data
+    # matches no point of their ledger history, and users whose data stopped short of entries after
+    # ledger_seq (the bot crashed before saving them; its next start records recovery entries).
+    accounts, through_seq = _stored_accounts(data_path)
+    balances, states = tail_states(ledger_path, through_seq if through_seq is not None else math.inf)
+    mismatches = []
+    behind = []
+    for user_id in sorted(set(accounts) | set(balances), key=int):
+        stored = accounts.get(user_id, (0, {}))
+        replayed = money_state(balances.get(user_id, {"cash": 0, "coins": {}}))
+        if stored == replayed:
+            continue
+        history = states.get(user_id, [])
+        if stored in history:
+            missing = len(history) - 1 - history.index(stored)
+            behind.append(f"user {user_id}: stored {stored[0]} cents {stored[1]} is missing the last {missing} ledger entries")
+        else:
+            mismatches.append(f"user {user_id}: stored {stored[0]} cents {stored[1]}, ledger {replayed[0]} cents {replayed[1]}")
+    return mismatches, behind
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args or args[0] != 'verify':
+        print("Usage: python ledger.py verify [ledger.jsonl] [--compare stock_market_data.json|stock_market_data.db]")
+        sys.exit(2)
+    args = args[1:]
+    compare_path = None
+    if '--compare' in args:
+        i = args.index('--compare')
+        compare_path = args[i + 1]
+        del args[i:i + 2]
+    ledger_path = args[0] if args else 'ledger.jsonl'
+    errors, balances = verify(ledger_path)
+    for error in errors:
+        print(f"ERROR: {error}")
+    total_cash = sum(account["cash"] for account in balances.values())
+    print(f"Replayed {ledger_path}: {len(balances)} users, {format_cash(total_cash)} dollars in cash.")
+    if compare_path:
+        mismatches, behind = _compare(ledger_path, compare_path)
+        for mismatch in mismatches:
+            print(f"MISMATCH: {mismatch}")
+        for user in behind:
+            print(f"BEHIND: {user}")
+        print(f"{len(mismatches)} users differ from {compare_path}.")
+        if behind:
+            print(f"{len(behind)} users are behind the ledger; the bot stopped before saving their last changes. "
+                  f"Its next start records recovery entries for them.")
+        errors += mismatches
+    sys.exit(1 if errors else 0)
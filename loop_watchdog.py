@@ -0,0 +1,119 @@
+# Opt-in event loop lag monitor.
+# A heartbeat coroutine wakes every beat_interval seconds and reports how late it woke (the loop lag). A
+# separate thread watches the heartbeat; once it is more than `threshold` seconds overdue, something is
+# holding the loop, so the thread samples the loop thread's Python stack every sample_interval seconds until
+# the heartbeat comes back. Each stall becomes one JSON line in report_path:
+#   {"ts", "blocked_ms", "activity", "samples", "stacks": [{"samples", "frames": [outermost ... innermost]}]}
+# blocked_ms is a lower bound, within one beat_interval of the real stall. "activity" names the command,
+# component or loop the stack was in (from the labels metrics.timed registers), or else the asyncio task's name.
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+MAX_FRAMES = 30
+MAX_STACKS = 5
+
+
+class LoopWatchdog:
+    def __init__(self, report_path, threshold, sample_interval=0.01, beat_interval=0.1, activity_labels=None, on_lag=None):
+        self.report_path = report_path
+        self.threshold = threshold
+        self.sample_interval = sample_interval
+        self.beat_interval = beat_interval
+        self.activity_labels = activity_labels if activity_labels is not None else {}  # code object -> label
+        self.on_lag = on_lag  # called on the loop with each heartbeat's lag in seconds
+        self.stalls = Counter()  # activity -> stalls reported; written by the watchdog thread, read via stall_counts()
+        self._stalls_lock = threading.Lock()
+        self.last_beat = time.monotonic()
+        self._loop = None
+        self._loop_thread = None
+        self._beat_task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def stall_counts(self):
+        with self._stalls_lock:
+            return dict(self.stalls)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._beat_task = self._loop.create_task(self._beat())
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._beat_task.cancel()
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    async def _beat(self):
+        while True:
+            expected = self._loop.time() + self.beat_interval
+            await asyncio.sleep(self.beat_interval)
+            self.last_beat = time.monotonic()
+            if self.on_lag is not None:
+                self.on_lag(max(0.0, self._loop.time() - expected))
+
+    def _watch(self):
+        stall = None
+        while not self._stopped.wait(self.sample_interval):
+            last_beat = self.last_beat
+            if time.monotonic() - last_beat < self.beat_interval + self.threshold:
+                if stall is not None and last_beat != stall["beat_before"]:
+                    self._report(stall, last_beat)
+                    stall = None
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            if stall is None:
+                stall = {"beat_before": last_beat, "started": time.time() - (time.monotonic() - last_beat), "stacks": Counter(), "activity": Counter()}
+            stack, activity = self._sample(frame)
+            stall["stacks"][stack] += 1
+            stall["activity"][activity] += 1
+            del frame
+
+    def _sample(self, frame):
+        frames = []
+        activity = None
+        while frame is not None:
+            code = frame.f_code
+            if activity is None:
+                activity = self.activity_labels.get(code)
+            frames.append(f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}")
+            frame = frame.f_back
+        if activity is None:
+            task = asyncio.current_task(self._loop)
+            activity = task.get_name() if task is not None else "event loop callback"
+        return tuple(reversed(frames[:MAX_FRAMES])), activity
+
+    def _report(self, stall, beat_after):
+        blocked = beat_after - stall["beat_before"] - self.beat_interval
+        activity = stall["activity"].most_common(1)[0][0]
+        with self._stalls_lock:
+            self.stalls[activity] += 1
+        report = {
+            "ts": round(stall["started"], 3),
+            "blocked_ms": round(blocked * 1000),
+            "activity": activity,
+            "samples": sum(stall["stacks"].values()),
+            "stacks": [{"samples": count, "frames": list(stack)} for stack, count in stall["stacks"].most_common(MAX_STACKS)],
+        }
+        try:
+            with open(self.report_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(report, separators=(',', ':')) + '\n')
+        except OSError as e:
+            print(f"ERROR writing loop lag report to {self.report_path}: {e}")
+        print(f"WARNING: Event loop blocked for {report['blocked_ms']} ms in {activity}. Stack samples written to {self.report_path}.")
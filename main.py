@@ -1,31 +1,94 @@
+# Runs the Discord bot and its status web server on one event loop in one process.
+import asyncio
+import html
+import json
 import os
-import sys
-import subprocess
-from threading import Thread
-from flask import Flask
-
-# Function to run the bot.py script
-def run_bot():
-    # Use sys.executable to ensure the correct Python interpreter is used
-    # This runs bot.py as a separate process, which is more robust than just import
-    # IMPORTANT: If your bot file is named 'CryptoBot.py', change "bot.py" to "CryptoBot.py" here.
-    subprocess.run([sys.executable, "bot.py"]) 
-
-# Start the bot.py script in a separate thread
-# This prevents the Flask web server from blocking your Discord bot's operations
-bot_thread = Thread(target=run_bot)
-bot_thread.start()
-
-# This is a dummy Flask app that Render will detect and use to provide a public URL.
-# Your Discord bot's logic runs independently in 'bot.py'.
-app = Flask(__name__)
-
-@app.route('/')
-def home():
-    return "Your Discord Bot's Web Server is Active!"
+import time
 
+import discord
+from aiohttp import web
+
+# Importing bot.py loads the market data and registers every command; nothing connects until main() runs.
+import bot as campton
+
+# / and /healthz report the bot's real gateway and task state, not just that the web server is up;
+# /metrics exposes bot.py's command, loop, persistence and DM metrics for Prometheus.
 # Render expects the web service to listen on the port specified by the PORT environment variable.
 # If not set, it defaults to 8080.
+PORT = int(os.environ.get("PORT", 8080))
+
+# Read once at startup; STATUS_MARKER is replaced with the live status on every request.
+STATUS_MARKER = "<!-- STATUS -->"
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "index.html"), encoding="utf-8") as f:
+    PAGE_HEAD, PAGE_TAIL = f.read().split(STATUS_MARKER)
+
+started_at = time.monotonic()
+
+
+def format_uptime(seconds):
+    hours, seconds = divmod(int(seconds), 3600)
+    return f"{hours}h {seconds // 60}m"
+
+
+def render_status(health):
+    gateway = health["gateway"]
+    if gateway["connected"]:
+        lines = [f"Connected to Discord as {html.escape(gateway['user'])} in {gateway['guilds']} server(s), latency {gateway['latency_ms']} ms."]
+    else:
+        lines = ['<span class="down">Not connected to Discord.</span>']
+    stopped = [name for name, loop in health["loops"].items() if not loop["running"] or loop.get("failed")]
+    stopped += [name for name, running in health["workers"].items() if not running]
+    overdue = [name for name, loop in health["loops"].items() if loop.get("overdue")]
+    if stopped:
+        lines.append(f'<span class="down">Stopped background tasks: {", ".join(stopped)}.</span>')
+    if overdue:
+        lines.append(f'<span class="down">Overdue scheduled jobs: {", ".join(overdue)}.</span>')
+    if not stopped and not overdue:
+        lines.append("All background tasks are running.")
+    for name, loop in health["loops"].items():
+        if loop.get("last_error"):
+            lines.append(f"Last error in {name} at {loop['last_error_at']}: {html.escape(loop['last_error'])}")
+    lines.append(f"Up for {format_uptime(time.monotonic() - started_at)}; {health['pending_dms']} DMs queued.")
+    return "\n    ".join(f"<p>{line}</p>" for line in lines)
+
+
+async def home(request):
+    return web.Response(text=PAGE_HEAD + render_status(campton.runtime_health()) + PAGE_TAIL, content_type="text/html")
+
+
+async def healthz(request):
+    health = campton.runtime_health()
+    health["uptime_seconds"] = round(time.monotonic() - started_at)
+    return web.Response(text=json.dumps(health), content_type="application/json", status=200 if health["healthy"] else 503)
+
+
+async def prometheus_metrics(request):
+    return web.Response(text=campton.metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+async def main():
+    if campton.TOKEN is None:
+        print("ERROR: DISCORD_BOT_TOKEN environment variable not found. Bot cannot start.")
+        return
+    discord.utils.setup_logging()
+    app = web.Application()
+    app.router.add_get("/", home)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", prometheus_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+    print(f"Status page listening on port {PORT}.")
+    try:
+        async with campton.bot:
+            await campton.bot.start(campton.TOKEN)
+    finally:
+        await runner.cleanup()
+        campton.data_writer.flush_sync()
+
+
 if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 8080))
-    app.run(host='0.0.0.0', port=port)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,43 @@
+# Price simulation for every listed coin.
+# Prices and per-coin bounds live in NumPy arrays so one tick moves the whole market in a single
+# vectorized step; market_data["coins"] is only rewritten from the arrays afterwards.
+import numpy as np
+
+from money import CENTS_PER_DOLLAR
+
+
+class MarketEngine:
+    def __init__(self, coin_settings, volatility_levels, rng=None):
+        # coin_settings: {coin_name: {"min_price", "max_price", "initial_price"}}, in listing order.
+        self.coin_names = list(coin_settings)
+        self.index = {name: i for i, name in enumerate(self.coin_names)}
+        self.min_prices = np.array([coin_settings[name]["min_price"] for name in self.coin_names], dtype=np.float64)
+        self.max_prices = np.array([coin_settings[name]["max_price"] for name in self.coin_names], dtype=np.float64)
+        self.initial_prices = np.array([coin_settings[name]["initial_price"] for name in self.coin_names], dtype=np.float64)
+        self.prices = self.initial_prices.copy()
+        self.volatility_levels = np.asarray(volatility_levels, dtype=np.float64)
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    def load_prices(self, coins):
+        # Takes stored prices from market_data["coins"]; missing or out-of-bounds ones reset to the
+        # coin's initial price. Returns the names that were reset.
+        stored = np.array([coins.get(name, {}).get("price", np.nan) for name in self.coin_names], dtype=np.float64)
+        invalid = ~((stored >= self.min_prices) & (stored <= self.max_prices))
+        self.prices = np.where(invalid, self.initial_prices, stored)
+        return [name for name, bad in zip(self.coin_names, invalid.tolist()) if bad]
+
+    def step(self):
+        # Each coin draws its own volatility level and a uniform move within it.
+        volatility = self.volatility_levels[self.rng.integers(len(self.volatility_levels), size=len(self.prices))]
+        change = self.rng.uniform(-volatility, volatility)
+        self.prices = np.round(np.clip(self.prices * (1 + change), self.min_prices, self.max_prices), 2)
+
+    def prices_cents(self):
+        return np.round(self.prices * CENTS_PER_DOLLAR).astype(np.int64)
+
+    def price(self, coin_name):
+        return float(self.prices[self.index[coin_name]])
+
+    def write_prices(self, coins):
+        for name, price in zip(self.coin_names, self.prices.tolist()):
+            coins.setdefault(name, {})["price"] = price
@@ -0,0 +1,113 @@
+# In-memory user records.
+# market_data["users"] maps a user ID string to a UserAccount. Records are normalized once when they
+# are loaded (from_dict) and converted back to the original JSON layout only when written (to_dict),
+# so nothing else has to check for missing keys. Amounts are integers, see money.py.
+from types import MappingProxyType
+
+from money import CENTS_PER_DOLLAR, MILLI_PER_COIN, legacy_to_units
+
+USER_RECORD_KEYS = ("balance_cents", "holdings_milli", "verification", "buy_cooldown_epoch")
+LEGACY_USER_RECORD_KEYS = ("balance", "portfolio", "on_buy_cooldown")
+
+
+class Holding:
+    __slots__ = ("coin", "milli")
+
+    def __init__(self, coin, milli):
+        self.coin = coin
+        self.milli = milli
+
+    def __repr__(self):
+        return f"Holding({self.coin!r}, {self.milli!r})"
+
+
+class UserAccount:
+    __slots__ = ("balance_cents", "portfolio", "verification", "buy_cooldown_epoch", "extra")
+
+    def __init__(self, balance_cents=0, portfolio=None, verification=None, buy_cooldown_epoch=None, extra=None):
+        self.balance_cents = balance_cents
+        self.portfolio = portfolio if portfolio is not None else {}
+        self.verification = verification
+        # Market epoch the user was put on buy cooldown in; the cooldown ends when the epoch moves on.
+        self.buy_cooldown_epoch = buy_cooldown_epoch
+        # Unknown keys from the stored record, carried through unchanged.
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, record, legacy_residue=None):
+        # Accepts both the integer layout and the old float one ("balance"/"portfolio" in dollars and
+        # coins). For old records, rounding leftovers are added to legacy_residue if one is given.
+        extra = {k: v for k, v in record.items() if k not in USER_RECORD_KEYS and k not in LEGACY_USER_RECORD_KEYS} or None
+        if "balance_cents" in record or "balance" not in record:
+            balance_cents = record.get("balance_cents", 0)
+            holdings = record.get("holdings_milli") or {}
+        else:
+            balance_cents, residue = legacy_to_units(record["balance"], CENTS_PER_DOLLAR)
+            holdings = {}
+            for coin, quantity in (record.get("portfolio") or {}).items():
+                holdings[coin], coin_residue = legacy_to_units(quantity, MILLI_PER_COIN)
+                if legacy_residue is not None:
+                    legacy_residue["milli"] = legacy_residue.get("milli", 0) + coin_residue
+            if legacy_residue is not None:
+                legacy_residue["cents"] = legacy_residue.get("cents", 0) + residue
+        portfolio = {coin: Holding(coin, milli) for coin, milli in holdings.items() if milli > 0}
+        buy_cooldown_epoch = record.get("buy_cooldown_epoch")
+        if buy_cooldown_epoch is None and record.get("on_buy_cooldown"):
+            buy_cooldown_epoch = 0  # Old boolean flag; epoch 0 is the epoch of data that predates epochs.
+        return cls(
+            balance_cents=balance_cents,
+            portfolio=portfolio,
+            verification=record.get("verification") or None,
+            buy_cooldown_epoch=buy_cooldown_epoch,
+            extra=extra,
+        )
+
+    def to_dict(self):
+        record = {
+            "balance_cents": self.balance_cents,
+            "holdings_milli": {coin: holding.milli for coin, holding in self.portfolio.items()},
+            "verification": dict(self.verification) if self.verification else {},
+            "buy_cooldown_epoch": self.buy_cooldown_epoch,
+        }
+        if self.extra:
+            record.update(self.extra)
+        return record
+
+    def quantity(self, coin):
+        # Milli-coins held of `coin`.
+        holding = self.portfolio.get(coin)
+        return holding.milli if holding is not None else 0
+
+    def set_quantity(self, coin, milli):
+        if milli <= 0:
+            self.portfolio.pop(coin, None)
+        elif coin in self.portfolio:
+            self.portfolio[coin].milli = milli
+        else:
+            self.portfolio[coin] = Holding(coin, milli)
+
+    def add_quantity(self, coin, delta_milli):
+        self.set_quantity(coin, self.quantity(coin) + delta_milli)
+
+    def on_buy_cooldown(self, market_epoch):
+        return self.buy_cooldown_epoch == market_epoch
+
+    def is_empty(self):
+        return self.balance_cents == 0 and not self.portfolio and not self.verification and self.buy_cooldown_epoch is None
+
+    def __repr__(self):
+        return f"UserAccount(balance_cents={self.balance_cents!r}, portfolio={self.portfolio!r}, buy_cooldown_epoch={self.buy_cooldown_epoch!r})"
+
+
+class ReadOnlyAccount(UserAccount):
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("This account is a read-only default; use get_or_create_user_data() to modify a user.")
+
+
+def read_only_default_account():
+    account = object.__new__(ReadOnlyAccount)
+    for slot, value in (("balance_cents", 0), ("portfolio", MappingProxyType({})), ("verification", None), ("buy_cooldown_epoch", None), ("extra", None)):
+        object.__setattr__(account, slot, value)
+    return account
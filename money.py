@@ -0,0 +1,69 @@
+# Fixed-point money.
+# Cash is stored as integer cents and coins as integer milli-coins (0.001 coin), so balances stay exact
+# no matter how many trades are applied. Amounts typed into slash commands arrive as floats and are
+# converted here, once; everything after that is integer arithmetic.
+from decimal import Decimal, ROUND_HALF_EVEN
+
+CENTS_PER_DOLLAR = 100
+MILLI_PER_COIN = 1000
+
+# Floats like 0.1 * 100 land a hair away from the integer they stand for.
+_FLOAT_TOLERANCE = 1e-6
+
+
+def _to_units(amount, units_per_whole):
+    scaled = amount * units_per_whole
+    units = round(scaled)
+    if abs(scaled - units) > _FLOAT_TOLERANCE * max(1.0, abs(scaled)):
+        return None
+    return int(units)
+
+
+def parse_cash(amount):
+    # Cents for a user-entered dollar amount, or None if it has more than 2 decimal places.
+    return _to_units(amount, CENTS_PER_DOLLAR)
+
+
+def parse_coins(amount):
+    # Milli-coins for a user-entered coin amount, or None if it has more than 3 decimal places.
+    return _to_units(amount, MILLI_PER_COIN)
+
+
+def price_to_cents(price):
+    return int(round(price * CENTS_PER_DOLLAR))
+
+
+def coin_value_cents(milli, price_cents):
+    # Value of a holding, rounded down to the cent so a sale can never create money.
+    return milli * price_cents // MILLI_PER_COIN
+
+
+def coin_cost_cents(milli, price_cents):
+    # Cost of a purchase, rounded up to the cent for the same reason.
+    return -(-milli * price_cents // MILLI_PER_COIN)
+
+
+def coins_for_cash(cents, price_cents):
+    # Largest whole number of milli-coins that `cents` can pay for.
+    return cents * MILLI_PER_COIN // price_cents
+
+
+def format_cash(cents):
+    sign = '-' if cents < 0 else ''
+    cents = abs(cents)
+    return f"{sign}{cents // CENTS_PER_DOLLAR}.{cents % CENTS_PER_DOLLAR:02d}"
+
+
+def format_coins(milli):
+    sign = '-' if milli < 0 else ''
+    milli = abs(milli)
+    return f"{sign}{milli // MILLI_PER_COIN}.{milli % MILLI_PER_COIN:03d}"
+
+
+def legacy_to_units(value, units_per_whole):
+    # Converts a float from the old JSON layout. Going through repr() keeps the exact decimal the value
+    # was written as, so entered amounts and rounded prices convert without drift; only sub-cent or
+    # sub-milli-coin leftovers of old float arithmetic are rounded (half-even).
+    exact = Decimal(repr(float(value))) * units_per_whole
+    units = exact.quantize(Decimal(1), rounding=ROUND_HALF_EVEN)
+    return int(units), exact - units
@@ -0,0 +1,89 @@
+# Resting limit and stop orders, matched against the market price on each tick.
+# Orders persist in market_data["orders"] as compact rows:
+#   order_id -> [user_id, coin, side, kind, price_cents, milli, created_at]
+# plus the next order ID, kept by the caller, so IDs of filled or cancelled orders are never handed out again.
+# In memory each coin has two heaps. Orders that trigger when the price falls to or below their price
+# (limit buys, stop sells) are keyed by -price; orders that trigger when it rises to or above their
+# price (limit sells, stop buys) by price. A tick pops only the orders that cross, O(k log n).
+import heapq
+from collections import defaultdict
+
+USER, COIN, SIDE, KIND, PRICE, MILLI, CREATED_AT = range(7)
+
+
+def triggers_on_fall(side, kind):
+    return (side == "buy") == (kind == "limit")
+
+
+class OrderBook:
+    def __init__(self, orders, next_id=1):
+        self.orders = orders
+        self._falling = defaultdict(list)
+        self._rising = defaultdict(list)
+        self._by_user = defaultdict(set)
+        # Cancelled orders stay in the heaps until popped; rebuild once they outnumber live ones.
+        self._stale = 0
+        self.next_id = max(next_id, max((int(order_id) for order_id in orders), default=0) + 1)
+        self._rebuild()
+
+    def _rebuild(self):
+        self._falling.clear()
+        self._rising.clear()
+        self._by_user.clear()
+        for order_id, row in self.orders.items():
+            self._push(order_id, row)
+        for heap in list(self._falling.values()) + list(self._rising.values()):
+            heapq.heapify(heap)
+        self._stale = 0
+
+    def _push(self, order_id, row, keep_heap=False):
+        entry_id = int(order_id)
+        if triggers_on_fall(row[SIDE], row[KIND]):
+            heap, entry = self._falling[row[COIN]], (-row[PRICE], entry_id, order_id)
+        else:
+            heap, entry = self._rising[row[COIN]], (row[PRICE], entry_id, order_id)
+        if keep_heap:
+            heapq.heappush(heap, entry)
+        else:
+            heap.append(entry)
+        self._by_user[row[USER]].add(order_id)
+
+    def add(self, user_id, coin, side, kind, price_cents, milli, created_at):
+        order_id = str(self.next_id)
+        self.next_id += 1
+        row = [user_id, coin, side, kind, price_cents, milli, created_at]
+        self.orders[order_id] = row
+        self._push(order_id, row, keep_heap=True)
+        return order_id
+
+    def cancel(self, order_id):
+        row = self.orders.pop(order_id, None)
+        if row is None:
+            return None
+        self._by_user[row[USER]].discard(order_id)
+        self._stale += 1
+        if self._stale > 64 and self._stale > len(self.orders):
+            self._rebuild()
+        return row
+
+    def user_orders(self, user_id):
+        return sorted(((order_id, self.orders[order_id]) for order_id in self._by_user.get(user_id, ())), key=lambda item: int(item[0]))
+
+    def pop_crossing(self, coin, price_cents):
+        # Removes and returns the orders for `coin` that trigger at price_cents, oldest first.
+        crossed = []
+        falling = self._falling.get(coin, [])
+        while falling and -falling[0][0] >= price_cents:
+            crossed.append(heapq.heappop(falling)[2])
+        rising = self._rising.get(coin, [])
+        while rising and rising[0][0] <= price_cents:
+            crossed.append(heapq.heappop(rising)[2])
+        triggered = []
+        for order_id in sorted(crossed, key=int):
+            row = self.orders.pop(order_id, None)
+            if row is None:
+                self._stale -= 1  # A cancelled order's leftover heap entry.
+                continue
+            self._by_user[row[USER]].discard(order_id)
+            triggered.append((order_id, row))
+        return triggered
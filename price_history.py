@@ -0,0 +1,94 @@
+# Append-only price history, one binary file per coin.
+# Each tick appends a fixed 12-byte record (epoch seconds, price in cents), so the files can be
+# memory-mapped as NumPy arrays for long ranges while the most recent ticks are served from a deque.
+import os
+from collections import deque
+
+import numpy as np
+
+from money import format_cash
+
+RECORD_DTYPE = np.dtype([("timestamp", "<i8"), ("price_cents", "<i4")])
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+def history_filename(coin_name):
+    return ''.join(ch if ch.isalnum() else '_' for ch in coin_name.lower()) + '.bin'
+
+
+def render_sparkline(values):
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARK_CHARS[len(SPARK_CHARS) // 2] * len(values)
+    scale = (len(SPARK_CHARS) - 1) / (high - low)
+    return ''.join(SPARK_CHARS[round((value - low) * scale)] for value in values)
+
+
+class PriceHistory:
+    def __init__(self, directory, coin_names, cache_ticks):
+        self.directory = directory
+        self.coin_names = list(coin_names)
+        self.paths = {name: os.path.join(directory, history_filename(name)) for name in self.coin_names}
+        self.recent_ticks = {name: deque(maxlen=cache_ticks) for name in self.coin_names}
+        # Rendered /pricehistory output for the current tick, keyed by (coin, points).
+        self._render_cache = {}
+        os.makedirs(directory, exist_ok=True)
+        for name in self.coin_names:
+            self._load(name)
+
+    def _load(self, coin_name):
+        path = self.paths[coin_name]
+        if not os.path.exists(path):
+            return
+        size = os.path.getsize(path)
+        torn = size % RECORD_DTYPE.itemsize
+        if torn:
+            # A crash mid-append leaves a partial record at the end; drop it.
+            print(f"WARNING: {path} ends with a partial record; truncating {torn} bytes.")
+            with open(path, 'r+b') as f:
+                f.truncate(size - torn)
+        cache = self.recent_ticks[coin_name]
+        for timestamp, price_cents in self.series(coin_name)[-cache.maxlen:].tolist():
+            cache.append((timestamp, price_cents))
+
+    def series(self, coin_name):
+        # The whole history of one coin as a read-only memory-mapped array (empty if there is none yet).
+        path = self.paths[coin_name]
+        if not os.path.exists(path) or os.path.getsize(path) < RECORD_DTYPE.itemsize:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.memmap(path, dtype=RECORD_DTYPE, mode='r')
+
+    def append(self, timestamp, prices_cents):
+        # prices_cents is aligned with coin_names.
+        for name, price_cents in zip(self.coin_names, prices_cents):
+            record = np.array([(int(timestamp), int(price_cents))], dtype=RECORD_DTYPE)
+            with open(self.paths[name], 'ab') as f:
+                f.write(record.tobytes())
+            self.recent_ticks[name].append((int(timestamp), int(price_cents)))
+        self._render_cache.clear()
+
+    def recent(self, coin_name, count):
+        cache = self.recent_ticks[coin_name]
+        if count <= len(cache):
+            return list(cache)[-count:]
+        return self.series(coin_name)[-count:].tolist()
+
+    def render(self, coin_name, points):
+        key = (coin_name, points)
+        if key not in self._render_cache:
+            self._render_cache[key] = self._render(coin_name, points)
+        return self._render_cache[key]
+
+    def _render(self, coin_name, points):
+        ticks = self.recent(coin_name, points)
+        if len(ticks) < 2:
+            return None
+        prices = [price_cents for _, price_cents in ticks]
+        first, last = prices[0], prices[-1]
+        change = (last - first) / first * 100 if first else 0.0
+        return (
+            f"```\n{render_sparkline(prices)}\n```\n"
+            f"Last {len(prices)} updates, <t:{ticks[0][0]}:d> to <t:{ticks[-1][0]}:d>\n"
+            f"Low {format_cash(min(prices))} · High {format_cash(max(prices))} · "
+            f"Now {format_cash(last)} dollars ({change:+.2f}%)"
+        )
@@ -0,0 +1,133 @@
+# One timer for the periodic market jobs (price updates, conversions, reminders, role checks).
+# Due times are unix timestamps kept in a dict the bot persists (market_data["schedule"]), so a redeploy
+# carries on where the last process stopped instead of restarting every interval from zero.
+# Jobs sit in a heap ordered by when they fire; a single task sleeps until the earliest one (or until a
+# job is rescheduled) and runs due jobs one at a time.
+# A job that came due while the bot was down runs once on startup, however many periods were missed, and
+# its next due time stays on the original cadence (due + k * interval). Each run fires a random 0..jitter
+# seconds after its due time, so catch-up runs after a restart don't all land at once.
+# Health is whether the timer task is alive and no job is overdue (still waiting overdue_grace seconds after
+# it should have fired). A job's last error and its time are kept for the status page only: one failed run
+# doesn't mean the next one will fail.
+import asyncio
+import datetime
+import heapq
+import math
+import random
+import time
+
+
+class Job:
+    def __init__(self, name, callback, interval, jitter):
+        self.name = name
+        self.callback = callback
+        self.interval = interval
+        self.jitter = jitter
+        self.due = None
+        self.fire_at = None  # due plus this run's jitter
+        self.generation = 0  # bumped on every reschedule; heap entries from older generations are stale
+        self.last_error = None
+        self.last_error_at = None
+
+
+class Scheduler:
+    def __init__(self, due_times, save_due, overdue_grace=300, rng=None):
+        self.due_times = due_times  # {job name: unix timestamp}
+        self.save_due = save_due  # called with a job name after its due time changes
+        self.overdue_grace = overdue_grace
+        self.jobs = {}
+        self._heap = []  # (fire_at, generation, job name)
+        self._rng = rng or random.Random()
+        self._wakeup = None
+        self._task = None
+
+    def add(self, name, callback, interval, jitter=0, due=None):
+        # due: first due time. Defaults to the persisted one, or now for a job that has never been scheduled.
+        job = Job(name, callback, interval, jitter)
+        self.jobs[name] = job
+        self._set_due(job, due if due is not None else self.due_times.get(name, time.time()))
+
+    def reschedule(self, name, due):
+        self._set_due(self.jobs[name], due)
+
+    def _set_due(self, job, due):
+        job.due = due
+        job.generation += 1
+        self.due_times[job.name] = due
+        self.save_due(job.name)
+        job.fire_at = due + self._rng.uniform(0, job.jitter)
+        heapq.heappush(self._heap, (job.fire_at, job.generation, job.name))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def next_due_after(self, job, now):
+        # The first slot on the job's cadence that is after `now`; missed slots are skipped, not queued.
+        return job.due + job.interval * (math.floor(max(0, now - job.due) / job.interval) + 1)
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self, wait_for=None):
+        # wait_for: optional coroutine function awaited before the first job runs (e.g. bot.wait_until_ready).
+        if self.is_running():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run(wait_for))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, wait_for):
+        if wait_for is not None:
+            await wait_for()
+        while True:
+            while self._heap and self._heap[0][1] != self.jobs[self._heap[0][2]].generation:
+                heapq.heappop(self._heap)
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            fire_at, _, name = self._heap[0]
+            delay = fire_at - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            job = self.jobs[name]
+            # The next due time is saved before the job runs, so a crash mid-run can't make it run twice.
+            self._set_due(job, self.next_due_after(job, time.time()))
+            try:
+                await job.callback()
+            except Exception as e:
+                job.last_error = repr(e)
+                job.last_error_at = time.time()
+                print(f"ERROR in scheduled job {name}: {e}")
+
+    def is_overdue(self, job, now):
+        return now > job.fire_at + self.overdue_grace
+
+    def status(self):
+        now = time.time()
+        return {
+            name: {
+                "running": self.is_running(),
+                "overdue": self.is_overdue(job, now),
+                "next_run": isoformat(job.due),
+                "last_error": job.last_error,
+                "last_error_at": isoformat(job.last_error_at) if job.last_error_at is not None else None,
+            }
+            for name, job in self.jobs.items()
+        }
+
+
+def isoformat(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
@@ -0,0 +1,357 @@
+# Optional SQLite storage engine for the market data (STORAGE_BACKEND=sqlite).
+# Users, holdings, verification records and tickets live in indexed tables and are loaded
+# one row at a time on first access, so neither memory nor startup time grows with every
+# account the bot has ever seen. Smaller sections (coins, timestamps, ...) go in a key/value table.
+# It plugs into the same AsyncWriter as JournalStore: encode_* on the loop, write_* in a thread.
+import json
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+from storage import JOURNAL_DELETE, json_default
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    balance_cents INTEGER NOT NULL DEFAULT 0,
+    buy_cooldown_epoch INTEGER,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS holdings (
+    user_id INTEGER NOT NULL,
+    coin TEXT NOT NULL,
+    quantity_milli INTEGER NOT NULL,
+    PRIMARY KEY (user_id, coin)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS holdings_by_coin_milli ON holdings (coin, quantity_milli);
+CREATE TABLE IF NOT EXISTS verification (
+    user_id INTEGER PRIMARY KEY,
+    roblox_username TEXT,
+    pnc_full_name TEXT,
+    verified_at TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    channel_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    issue TEXT,
+    created_at TEXT,
+    closed_at TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS tickets_by_user_status ON tickets (user_id, status);
+CREATE TABLE IF NOT EXISTS kv (
+    section TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (section, key)
+) WITHOUT ROWID;
+"""
+
+USER_COLUMNS = ("balance_cents", "holdings_milli", "verification", "buy_cooldown_epoch")
+VERIFICATION_COLUMNS = ("roblox_username", "pnc_full_name", "verified_at")
+TICKET_COLUMNS = ("user_id", "status", "issue", "created_at", "closed_at")
+TABLE_SECTIONS = ("users", "tickets")
+SCALAR_KEY = ''
+
+
+def _extra(record, known_columns):
+    extra = {k: v for k, v in record.items() if k not in known_columns}
+    return json.dumps(extra, separators=(',', ':')) if extra else None
+
+
+def _with_extra(record, extra):
+    if extra:
+        record.update(json.loads(extra))
+    return record
+
+
+class LazyTableMap(MutableMapping):
+    # Dict-like view of one table. Rows are fetched by primary key on first access and cached;
+    # writes only touch the cache, AsyncWriter persists whatever save_record() marks dirty.
+    # Keys found missing are remembered too, so looking up members without an account doesn't query every
+    # time. Every row is written through this map, so a missing key only appears by being set here.
+    def __init__(self, store, section, row_factory=None):
+        self._store = store
+        self._section = section
+        self._row_factory = row_factory
+        self._cache = {}
+        self._deleted = set()
+        self._missing = set()
+
+    def __getitem__(self, key):
+        if key in self._cache:
+            return self._cache[key]
+        if key in self._deleted or key in self._missing:
+            raise KeyError(key)
+        value = self._store.fetch_row(self._section, key)
+        if value is None:
+            self._missing.add(key)
+            raise KeyError(key)
+        if self._row_factory is not None:
+            value = self._row_factory(value)
+        self._cache[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._deleted.discard(key)
+        self._missing.discard(key)
+        self._cache[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._cache.pop(key, None)
+        self._deleted.add(key)
+
+    def __iter__(self):
+        seen = set()
+        for key in self._cache:
+            seen.add(key)
+            yield key
+        for key in self._store.fetch_keys(self._section):
+            if key not in seen and key not in self._deleted:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def cached_items(self):
+        return self._cache.items()
+
+
+class LazyTableSnapshot:
+    def __init__(self, rows, deleted):
+        self.rows = rows
+        self.deleted = deleted
+
+
+class SqliteStore:
+    def __init__(self, db_path, row_factories=None):
+        # row_factories: {"users": callable} turning a fetched row dict into the in-memory record type.
+        self.db_path = db_path
+        self.row_factories = row_factories or {}
+        self.records_since_snapshot = 0
+        self._write_lock = threading.Lock()
+        self._reader = self._connect()
+        self._reader.executescript(SCHEMA)
+        self._writer = self._connect()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    # --- Reads (event loop thread) ---
+
+    def load(self, data):
+        data["users"] = LazyTableMap(self, "users", self.row_factories.get("users"))
+        data["tickets"] = LazyTableMap(self, "tickets", self.row_factories.get("tickets"))
+        for section, key, value in self._reader.execute("SELECT section, key, value FROM kv"):
+            if key == SCALAR_KEY:
+                data[section] = json.loads(value)
+            else:
+                data.setdefault(section, {})[key] = json.loads(value)
+        return data
+
+    def fetch_row(self, section, key):
+        if section == "users":
+            return self._fetch_user(int(key))
+        return self._fetch_ticket(int(key))
+
+    def _fetch_user(self, user_id):
+        row = self._reader.execute(
+            "SELECT balance_cents, buy_cooldown_epoch, extra FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        balance_cents, buy_cooldown_epoch, extra = row
+        holdings = dict(self._reader.execute(
+            "SELECT coin, quantity_milli FROM holdings WHERE user_id = ?", (user_id,)
+        ))
+        verification = {}
+        v_row = self._reader.execute(
+            "SELECT roblox_username, pnc_full_name, verified_at, extra FROM verification WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if v_row is not None:
+            verification = {k: v for k, v in zip(VERIFICATION_COLUMNS, v_row[:3]) if v is not None}
+            _with_extra(verification, v_row[3])
+        user = {"balance_cents": balance_cents, "holdings_milli": holdings, "verification": verification, "buy_cooldown_epoch": buy_cooldown_epoch}
+        return _with_extra(user, extra)
+
+    def _fetch_ticket(self, channel_id):
+        row = self._reader.execute(
+            "SELECT user_id, status, issue, created_at, closed_at, extra FROM tickets WHERE channel_id = ?", (channel_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        ticket = {k: v for k, v in zip(TICKET_COLUMNS, row[:5]) if v is not None}
+        return _with_extra(ticket, row[5])
+
+    def iter_money_rows(self):
+        # (user_id, balance_cents, holdings_milli) for every stored user, read straight from the tables
+        # without caching accounts. Rows changed since the last flush are not reflected.
+        holdings = {}
+        for user_id, coin, milli in self._reader.execute("SELECT user_id, coin, quantity_milli FROM holdings"):
+            holdings.setdefault(user_id, {})[coin] = milli
+        for user_id, balance_cents in self._reader.execute("SELECT user_id, balance_cents FROM users"):
+            yield str(user_id), balance_cents, holdings.get(user_id, {})
+
+    def fetch_empty_user_ids(self):
+        # Users UserAccount.is_empty() would report, found without loading them. Like iter_money_rows,
+        # this reads the tables as last flushed.
+        return [str(row[0]) for row in self._reader.execute(
+            "SELECT user_id FROM users WHERE balance_cents = 0 AND buy_cooldown_epoch IS NULL"
+            " AND NOT EXISTS (SELECT 1 FROM holdings WHERE holdings.user_id = users.user_id AND quantity_milli > 0)"
+            " AND NOT EXISTS (SELECT 1 FROM verification WHERE verification.user_id = users.user_id)"
+        )]
+
+    def iter_ticket_statuses(self):
+        # (channel_id, user_id, status) for every stored ticket, without loading them.
+        for channel_id, user_id, status in self._reader.execute("SELECT channel_id, user_id, status FROM tickets"):
+            yield str(channel_id), user_id, status
+
+    def fetch_keys(self, section):
+        if section == "users":
+            query = "SELECT user_id FROM users"
+        else:
+            query = "SELECT channel_id FROM tickets"
+        return [str(row[0]) for row in self._reader.execute(query)]
+
+    # --- Encoding ---
+    # Turns live dicts into plain tuples so the writes never see objects that are still mutating.
+    # encode_batch and snapshot_view run on the event loop, encode_snapshot in AsyncWriter's worker thread.
+
+    def _encode_op(self, section, key, value):
+        if section in TABLE_SECTIONS:
+            if value is JOURNAL_DELETE:
+                return (section, int(key), None)
+            if section == "users" and not hasattr(value, "to_dict") and section in self.row_factories:
+                value = self.row_factories[section](value)  # e.g. a legacy JSON record during migrate_from
+            if hasattr(value, "to_dict"):
+                value = value.to_dict()
+            if section == "users":
+                verification = value.get("verification") or {}
+                return ("users", int(key), (
+                    value.get("balance_cents", 0),
+                    value.get("buy_cooldown_epoch"),
+                    _extra(value, USER_COLUMNS),
+                    list(value.get("holdings_milli", {}).items()),
+                    tuple(verification.get(k) for k in VERIFICATION_COLUMNS) + (_extra(verification, VERIFICATION_COLUMNS),) if verification else None,
+                ))
+            return ("tickets", int(key), tuple(value.get(k) for k in TICKET_COLUMNS) + (_extra(value, TICKET_COLUMNS),))
+        if value is JOURNAL_DELETE:
+            return ("kv", section, SCALAR_KEY if key is None else key, None)
+        return ("kv", section, SCALAR_KEY if key is None else key, json.dumps(value, separators=(',', ':'), default=json_default))
+
+    def encode_batch(self, records):
+        return [self._encode_op(section, key, value) for (section, key), value in records.items()]
+
+    def snapshot_view(self, data):
+        # Copies of the containers, so rows loaded, added or deleted during the encode don't change what the
+        # worker thread walks. Rows that were never loaded cannot have changed, so a lazy table contributes
+        # only its cached rows and its deletions.
+        view = {}
+        for section, value in data.items():
+            if isinstance(value, LazyTableMap):
+                view[section] = LazyTableSnapshot(dict(value.cached_items()), set(value._deleted))
+            else:
+                view[section] = dict(value) if isinstance(value, dict) else value
+        return view
+
+    def encode_snapshot(self, view):
+        ops = []
+        for section, value in view.items():
+            if section in TABLE_SECTIONS and isinstance(value, LazyTableSnapshot):
+                ops.extend(self._encode_op(section, key, row) for key, row in value.rows.items())
+                ops.extend(self._encode_op(section, key, JOURNAL_DELETE) for key in value.deleted)
+            elif section in TABLE_SECTIONS:
+                ops.extend(self._encode_op(section, key, row) for key, row in value.items())
+            elif isinstance(value, dict):
+                ops.append(("kv_replace", section, None))
+                ops.extend(self._encode_op(section, key, item) for key, item in value.items())
+            else:
+                ops.append(self._encode_op(section, None, value))
+        return ops
+
+    # --- Writes (worker thread) ---
+
+    def _apply(self, conn, op):
+        kind = op[0]
+        if kind == "users":
+            _, user_id, row = op
+            conn.execute("DELETE FROM holdings WHERE user_id = ?", (user_id,))
+            if row is None:
+                conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+                conn.execute("DELETE FROM verification WHERE user_id = ?", (user_id,))
+                return
+            balance_cents, buy_cooldown_epoch, extra, holdings, verification = row
+            conn.execute(
+                "INSERT OR REPLACE INTO users (user_id, balance_cents, buy_cooldown_epoch, extra) VALUES (?, ?, ?, ?)",
+                (user_id, balance_cents, buy_cooldown_epoch, extra),
+            )
+            conn.executemany(
+                "INSERT INTO holdings (user_id, coin, quantity_milli) VALUES (?, ?, ?)",
+                [(user_id, coin, milli) for coin, milli in holdings],
+            )
+            if verification is None:
+                conn.execute("DELETE FROM verification WHERE user_id = ?", (user_id,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO verification (user_id, roblox_username, pnc_full_name, verified_at, extra) VALUES (?, ?, ?, ?, ?)",
+                    (user_id,) + verification,
+                )
+        elif kind == "tickets":
+            _, channel_id, row = op
+            if row is None:
+                conn.execute("DELETE FROM tickets WHERE channel_id = ?", (channel_id,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO tickets (channel_id, user_id, status, issue, created_at, closed_at, extra) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (channel_id,) + row,
+                )
+        elif kind == "kv_replace":
+            conn.execute("DELETE FROM kv WHERE section = ?", (op[1],))
+        else:
+            _, section, key, value = op
+            if value is None:
+                conn.execute("DELETE FROM kv WHERE section = ? AND key = ?", (section, key))
+            else:
+                conn.execute("INSERT OR REPLACE INTO kv (section, key, value) VALUES (?, ?, ?)", (section, key, value))
+
+    def write_batch(self, ops):
+        with self._write_lock, self._writer:
+            for op in ops:
+                self._apply(self._writer, op)
+
+    def write_snapshot(self, ops):
+        self.write_batch(ops)
+
+    def payload_size(self, ops):
+        # SQLite decides what reaches the disk (pages, WAL), so there is no byte count to report.
+        return None
+
+    def needs_compaction(self):
+        # WAL checkpoints are handled by SQLite itself.
+        return False
+
+    def close(self):
+        with self._write_lock:
+            self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # --- One-shot migration ---
+
+    def migrate_from(self, json_store):
+        # Imports the JSON snapshot + journal once; the marker row prevents a second import.
+        if self._reader.execute("SELECT 1 FROM kv WHERE section = 'meta' AND key = 'migrated_from_json'").fetchone():
+            return False
+        data = json_store.load({})
+        ops = []
+        if data:
+            ops = self.encode_snapshot(self.snapshot_view(data))
+            print(f"Migrating {len(data.get('users', {}))} users and {len(data.get('tickets', {}))} tickets from {json_store.snapshot_path} into {self.db_path}...")
+        ops.append(("kv", "meta", "migrated_from_json", json.dumps(json_store.snapshot_path)))
+        self.write_batch(ops)
+        return bool(data)
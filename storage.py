@@ -0,0 +1,310 @@
+# Persistence for the market data.
+# The state lives in a JSON snapshot (stock_market_data.json) plus an append-only journal.
+# Every mutation appends one small record to the journal, so the cost of saving a trade
+# does not depend on how many users exist. snapshot() folds the journal back into the snapshot.
+# AsyncWriter keeps all of that disk I/O off the event loop and merges bursts of mutations.
+import asyncio
+import json
+import os
+import time
+
+JOURNAL_DELETE = object()
+# A snapshot encode that trips over a dict resized by the event loop is retried this many times in total.
+SNAPSHOT_ENCODE_ATTEMPTS = 3
+
+
+def _atomic_write(path, payload):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def json_default(value):
+    # Lets model objects (e.g. UserAccount) be stored in their plain JSON layout.
+    return value.to_dict()
+
+
+def append_jsonl(path, records):
+    if not records:
+        return
+    with open(path, 'ab') as f:
+        f.write(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records).encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def encode_record(section, key, value):
+    record = {"s": section}
+    if key is not None:
+        record["k"] = key
+    if value is JOURNAL_DELETE:
+        record["del"] = True
+    else:
+        record["v"] = value
+    return json.dumps(record, separators=(',', ':'), default=json_default) + '\n'
+
+
+def apply_record(data, record):
+    section = record["s"]
+    key = record.get("k")
+    if key is None:
+        if record.get("del"):
+            data.pop(section, None)
+        else:
+            data[section] = record["v"]
+        return
+    target = data.setdefault(section, {})
+    if record.get("del"):
+        target.pop(key, None)
+    else:
+        target[key] = record["v"]
+
+
+class JournalStore:
+    def __init__(self, snapshot_path, journal_path, compact_threshold=1000):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_threshold = compact_threshold
+        self.records_since_snapshot = 0
+        self._journal = None
+
+    def load(self, data):
+        # Fills `data` from the latest snapshot, then replays the journal tail on top of it.
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as f:
+                try:
+                    data.update(json.load(f))
+                except json.JSONDecodeError:
+                    print(f"Warning: {self.snapshot_path} is corrupted or empty. Starting with fresh data.")
+
+        self.records_since_snapshot = 0
+        if not os.path.exists(self.journal_path):
+            return data
+
+        good_offset = 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn write from a crash can only ever be the last line.
+                    print(f"Warning: Discarding unreadable tail of {self.journal_path} at byte {good_offset}.")
+                    break
+                apply_record(data, record)
+                good_offset += len(line)
+                self.records_since_snapshot += 1
+        if good_offset != os.path.getsize(self.journal_path):
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(good_offset)
+        print(f"Replayed {self.records_since_snapshot} journal record(s) from {self.journal_path}.")
+        return data
+
+    def _open_journal(self):
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'ab')
+        return self._journal
+
+    def append(self, section, key, value):
+        self.append_lines([encode_record(section, key, value)])
+
+    def append_lines(self, lines):
+        journal = self._open_journal()
+        journal.write(''.join(lines).encode('utf-8'))
+        journal.flush()
+        os.fsync(journal.fileno())
+        self.records_since_snapshot += len(lines)
+
+    def needs_compaction(self):
+        return self.records_since_snapshot >= self.compact_threshold
+
+    # encode_batch and snapshot_view run on the event loop; encode_snapshot and write_* in AsyncWriter's
+    # worker thread.
+    def encode_batch(self, records):
+        return [encode_record(section, key, value) for (section, key), value in records.items()]
+
+    def write_batch(self, lines):
+        self.append_lines(lines)
+
+    def snapshot_view(self, data):
+        # Shallow copies of the sections, so users or tickets added or removed while the worker thread encodes
+        # don't change the dicts it walks. The records themselves are shared, see AsyncWriter._write_snapshot.
+        return {section: dict(value) if isinstance(value, dict) else value for section, value in data.items()}
+
+    def encode_snapshot(self, data):
+        return json.dumps(data, separators=(',', ':'), default=json_default).encode('utf-8')
+
+    def payload_size(self, payload):
+        # Bytes a write_batch/write_snapshot payload puts on disk (journal lines are ASCII JSON).
+        return len(payload) if isinstance(payload, bytes) else sum(map(len, payload))
+
+    def snapshot(self, data):
+        self.write_snapshot(self.encode_snapshot(data))
+
+    def write_snapshot(self, payload):
+        # Replaying the old journal over the new snapshot is harmless (records carry full values),
+        # so a crash between the rename and the truncate cannot lose or corrupt anything.
+        _atomic_write(self.snapshot_path, payload)
+        journal = self._open_journal()
+        journal.truncate(0)
+        journal.flush()
+        os.fsync(journal.fileno())
+        self.records_since_snapshot = 0
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+class AsyncWriter:
+    # Mutations only mark records dirty. A background task waits `coalesce_delay` seconds after
+    # the first one, encodes everything that piled up (one record per key, however often it changed)
+    # and hands the encoded batch to a worker thread to write. Full snapshots are encoded in that thread
+    # too, since serializing every user on the event loop would stall it for seconds on a large server.
+    # on_write(operation, seconds, size) is called after each encode and write, for metrics; size is the
+    # payload's byte count for writes (None if the store can't tell) and None for encodes.
+    # stamp, if set, is called as each batch or snapshot is taken and returns a (section, value) that is
+    # saved along with it, so the data on disk records how far it got (bot.py stamps the ledger's last seq).
+    def __init__(self, store, coalesce_delay=0.5, on_write=None):
+        self.store = store
+        self.coalesce_delay = coalesce_delay
+        self.on_write = on_write
+        self.stamp = None
+        self._pending = {}
+        self._snapshot_data = None
+        self._wakeup = None
+        self._io_lock = None
+        self._task = None
+
+    def mark_dirty(self, section, key, value):
+        self._pending[(section, key)] = value
+        self._notify()
+
+    def request_snapshot(self, data):
+        self._snapshot_data = data
+        self._notify()
+
+    def has_pending(self):
+        return bool(self._pending) or self._snapshot_data is not None
+
+    def _notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.is_running():
+            return
+        self._wakeup = asyncio.Event()
+        self._io_lock = asyncio.Lock()
+        if self.has_pending():
+            self._wakeup.set()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.coalesce_delay)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"ERROR writing market data to disk: {e}. Will retry on the next change.")
+
+    def _take_batch(self):
+        # Batches are encoded on the event loop so a record can never be serialized mid-mutation. For a
+        # snapshot only the store's snapshot_view is taken here; a snapshot already contains every pending
+        # record, so those are dropped.
+        pending, self._pending = self._pending, {}
+        snapshot_data, self._snapshot_data = self._snapshot_data, None
+        if self.stamp is not None:
+            section, value = self.stamp()
+            pending[(section, None)] = value
+            if snapshot_data is not None:
+                snapshot_data[section] = value
+        if snapshot_data is not None:
+            return None, self.store.snapshot_view(snapshot_data)
+        started = time.perf_counter()
+        payload = self.store.encode_batch(pending)
+        self._report("encode_batch", time.perf_counter() - started)
+        return pending, payload
+
+    def _write_snapshot(self, view):
+        # Worker thread. Records are shared with the event loop, so one can change while it is encoded. A
+        # torn record is harmless: the change also marked it dirty, and that record is written after this
+        # snapshot. A record's own dict changing size mid-encode raises RuntimeError, so encode again.
+        for attempt in range(SNAPSHOT_ENCODE_ATTEMPTS):
+            started = time.perf_counter()
+            try:
+                payload = self.store.encode_snapshot(view)
+                break
+            except RuntimeError:
+                if attempt == SNAPSHOT_ENCODE_ATTEMPTS - 1:
+                    raise
+        encoded = time.perf_counter()
+        self.store.write_snapshot(payload)
+        return payload, encoded - started, time.perf_counter() - encoded
+
+    def _report(self, operation, seconds, payload=None):
+        if self.on_write is not None:
+            self.on_write(operation, seconds, self.store.payload_size(payload) if payload is not None else None)
+
+    def _restore_batch(self, pending, snapshot_data):
+        for record_key, value in pending.items():
+            self._pending.setdefault(record_key, value)
+        if snapshot_data is not None and self._snapshot_data is None:
+            self._snapshot_data = snapshot_data
+
+    async def flush(self):
+        if self._io_lock is None:
+            self.flush_sync()
+            return
+        async with self._io_lock:
+            if not self.has_pending():
+                return
+            snapshot_data = self._snapshot_data
+            pending, payload = self._take_batch()
+            try:
+                if pending is None:
+                    payload, encode_seconds, write_seconds = await asyncio.to_thread(self._write_snapshot, payload)
+                    self._report("encode_snapshot", encode_seconds)
+                    self._report("write_snapshot", write_seconds, payload)
+                elif payload:
+                    started = time.perf_counter()
+                    await asyncio.to_thread(self.store.write_batch, payload)
+                    self._report("write_batch", time.perf_counter() - started, payload)
+            except Exception:
+                self._restore_batch(pending or {}, snapshot_data)
+                raise
+
+    def flush_sync(self):
+        # For use when no event loop is running (startup, after bot.run returns).
+        if not self.has_pending():
+            return
+        pending, payload = self._take_batch()
+        if pending is None:
+            payload, encode_seconds, write_seconds = self._write_snapshot(payload)
+            self._report("encode_snapshot", encode_seconds)
+            self._report("write_snapshot", write_seconds, payload)
+        elif payload:
+            started = time.perf_counter()
+            self.store.write_batch(payload)
+            self._report("write_batch", time.perf_counter() - started, payload)
+
+    async def stop(self):
+        if self._task is not None:
+            # Taking the lock first guarantees the task is not halfway through a write.
+            async with self._io_lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        self.store.close()